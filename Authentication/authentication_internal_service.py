@@ -1,9 +1,13 @@
 import psycopg2 # PostgreSQL adapter for Python
 import os # For accessing environment variables
+import sys
 import bcrypt # For secure password hashing
 from dotenv import load_dotenv # To load environment variables from .env file
 from datetime import datetime, timezone, timedelta # For handling dates and session timeout
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Monitoring.db_metrics import InstrumentedCursor
+
 # Load variables from .env file
 load_dotenv() 
 
@@ -16,7 +20,8 @@ def connect_db():
             port=os.getenv("DB_PORT"),
             database=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
+            password=os.getenv("DB_PASSWORD"),
+            cursor_factory=InstrumentedCursor, # Times every query (see Monitoring/db_metrics.py)
         )
         return conn
     except psycopg2.Error as e:
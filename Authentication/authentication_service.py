@@ -1,10 +1,15 @@
 import os
+import sys
 import urllib.parse
 import requests
 from flask import Flask, request, redirect, render_template_string
 from google.oauth2 import id_token
 from google.auth.transport import requests as grequests
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Monitoring.flask_metrics import instrument_flask
+from Monitoring.http_metrics import install_http_metrics
+
 # load .env if present for local development
 try:
     from dotenv import load_dotenv
@@ -14,6 +19,8 @@ except Exception:
     pass
 
 app = Flask(__name__)
+instrument_flask(app, "authentication") # Route latencies on /metrics
+install_http_metrics() # Google and Telegram calls
 authenticated_users = {}   # { tg_id: {google_sub, email, name} }
 
 
@@ -1,13 +1,19 @@
 from flask import Flask, request, jsonify
 import psycopg2
 import os
+import sys
 import bcrypt
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Monitoring.db_metrics import InstrumentedCursor
+from Monitoring.flask_metrics import instrument_flask
+
 load_dotenv()
 
 app = Flask(__name__)
+instrument_flask(app, "login_registration") # Route latencies and DB timings on /metrics
 
 # ---------------------------------------
 # DATABASE CONNECTION
@@ -19,7 +25,8 @@ def connect_db():
             port=os.getenv("DB_PORT"),
             database=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
+            password=os.getenv("DB_PASSWORD"),
+            cursor_factory=InstrumentedCursor, # Times every query (see Monitoring/db_metrics.py)
         )
         return conn
     except psycopg2.Error as e:
@@ -0,0 +1,422 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import queue
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import httpx
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)  # Allows imports from the project root
+from Benchmarks.service_benchmark import (BENCH_DB_NAME, FIRST_USER_ID, create_database, free_port, git_commit, percentile,
+                                          seed_database, start_fake_paypal, start_service, wait_ready)
+
+# End-to-end load test of telegram_bot.py without Telegram: the bot runs unmodified (polling, persistence, Calendar
+# service, fake PayPal) against a local fake Bot API. Thousands of simulated users send their commands and button
+# presses through getUpdates and read the replies the bot sends to their chat, like a person would: every step is
+# timed from the update being made available to the reply that ends it. The CPU used by the bot and by the Calendar
+# service is read from their /metrics endpoints, so that a change to the handlers can be measured offline.
+FAKE_TOKEN = "123456:LOAD-TEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Load test", "username": "load_test_bot"}
+FLOWS = ("view_events", "see_more", "pay", "create_event")
+
+# ---- FAKE TELEGRAM BOT API ----
+def request_parameters(content_type, body):
+    """Parameters of a Bot API call: form fields (JSON-encoded values), multipart (uploads) or JSON."""
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=default_policy).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+        return {part.get_param("name", header="content-disposition"): part.get_content() for part in message.iter_parts()
+                if part.get_filename() is None}
+    return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+class FakeBotAPI:
+    """
+    Bot API replacement: getUpdates serves the updates queued by the simulated users (long polling), and every
+    message sent, edited or deleted by the bot is handed to the simulated user of the chat.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.updates = queue.Queue()
+        self.inboxes = {} # chat_id -> asyncio.Queue of (method, parameters) read by the simulated user
+        self.lock = threading.Lock()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.calls = {} # method -> number of calls
+        self.polling = threading.Event() # Set by the first getUpdates: the bot is ready
+
+    def push(self, update):
+        with self.lock:
+            update["update_id"] = self.next_update_id
+            self.next_update_id += 1
+        self.updates.put(update)
+
+    def new_message_id(self):
+        with self.lock:
+            self.next_message_id += 1
+            return self.next_message_id
+
+    def get_updates(self, params):
+        self.polling.set()
+        try:
+            updates = [self.updates.get(timeout=float(params.get("timeout") or 0))]
+        except queue.Empty:
+            return []
+        while len(updates) < int(params.get("limit") or 100):
+            try:
+                updates.append(self.updates.get_nowait())
+            except queue.Empty:
+                break
+        return updates
+
+    def call(self, method, params):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return self.get_updates(params)
+        if method == "getMe":
+            return BOT_USER
+        if "reply_markup" in params and isinstance(params["reply_markup"], str):
+            params["reply_markup"] = json.loads(params["reply_markup"])
+
+        if method in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            message_id = int(params["message_id"]) if method == "editMessageText" else self.new_message_id()
+            result = {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                      "from": BOT_USER, "text": params.get("text", "")}
+            if method == "sendPhoto":
+                result["photo"] = [{"file_id": f"photo{message_id}", "file_unique_id": f"u{message_id}", "width": 800, "height": 800}]
+            params["message_id"] = message_id
+            self.deliver(chat_id, method, params)
+            return result
+        if method == "deleteMessage":
+            self.deliver(int(params["chat_id"]), method, params)
+        return True
+
+    def deliver(self, chat_id, method, params):
+        inbox = self.inboxes.get(chat_id)
+        if inbox is not None:
+            self.loop.call_soon_threadsafe(inbox.put_nowait, (method, params))
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive: the bot reuses its connections, like with api.telegram.org
+
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    response = {"ok": True, "result": api.call(method, request_parameters(self.headers.get("Content-Type", ""), body))}
+                except Exception as e:
+                    response = {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(200 if response["ok"] else 400)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except ConnectionError:
+                    pass # The bot was stopped during a long polling getUpdates
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True).start()
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+# ---- SIMULATED USERS ----
+class StepTimeout(Exception):
+    pass
+
+class SimulatedUser:
+    """A Telegram user in a private chat with the bot (chat id = user id = a seeded user)."""
+
+    def __init__(self, api, user_id, rng, timeout):
+        self.api = api
+        self.user_id = user_id
+        self.rng = rng
+        self.timeout = timeout
+        self.inbox = asyncio.Queue()
+        api.inboxes[user_id] = self.inbox
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    def send_text(self, text):
+        message = {"message_id": self.api.new_message_id(), "date": int(time.time()), "chat": self.chat, "from": self.user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self.api.push({"message": message})
+
+    def press(self, message, callback_data):
+        """Presses a button of a message sent by the bot (message = parameters of the sendMessage/editMessageText)."""
+        self.api.push({"callback_query": {
+            "id": f"{self.user_id}-{time.perf_counter_ns()}", "from": self.user, "chat_instance": str(self.user_id), "data": callback_data,
+            "message": {"message_id": message["message_id"], "date": int(time.time()), "chat": self.chat, "from": BOT_USER,
+                        "text": message.get("text", "")},
+        }})
+
+    async def step(self, send, done, seen=None):
+        """Sends an update and waits for the reply matching `done`; the other replies are passed to `seen`. Returns (reply, seconds)."""
+        while not self.inbox.empty(): # Leftovers of a previous step (e.g. a reminder)
+            self.inbox.get_nowait()
+        start = time.perf_counter()
+        send()
+        deadline = start + self.timeout
+        while True:
+            try:
+                method, params = await asyncio.wait_for(self.inbox.get(), max(0.0, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                raise StepTimeout() from None
+            if done(method, params):
+                return params, time.perf_counter() - start
+            if seen is not None:
+                seen(method, params)
+
+def text_of(params):
+    return params.get("text") or ""
+
+def buttons(params):
+    markup = params.get("reply_markup") or {}
+    return [button for row in markup.get("inline_keyboard", []) for button in row if "callback_data" in button]
+
+def find_button(params, prefix):
+    return next((button["callback_data"] for button in buttons(params) if button["callback_data"].startswith(prefix)), None)
+
+# ---- FLOWS ----
+async def view_events(user):
+    """/viewEvents: returns the see_more buttons received, with their messages."""
+    events = []
+    def seen(method, params):
+        data = find_button(params, "see_more:")
+        if data:
+            events.append((params, data))
+    reply, seconds = await user.step(
+        lambda: user.send_text("/viewEvents"),
+        lambda method, params: text_of(params).startswith(("Select on option", "No more events", "Failed to fetch")),
+        seen,
+    )
+    return events, seconds, "ok" if not text_of(reply).startswith("Failed") else "error"
+
+async def see_more(user, message, data):
+    reply, seconds = await user.step(
+        lambda: user.press(message, data),
+        lambda method, params: method == "sendMessage" and (find_button(params, "pay:") or text_of(params).startswith(("Impossible", "Failed"))),
+    )
+    return find_button(reply, "pay:"), seconds, "ok" if find_button(reply, "pay:") else "error"
+
+async def pay(user, event_id):
+    reply, seconds = await user.step(
+        lambda: user.send_text(f"/pay {event_id}"),
+        lambda method, params: method == "sendMessage" and text_of(params).startswith(
+            ("Your seat is held", "You already have", "Impossible to reserve", "Failed to reserve", "Many people")),
+    )
+    text = text_of(reply)
+    return seconds, "ok" if text.startswith("Your seat") else ("error" if text.startswith("Failed") else "refused")
+
+async def pick_date(user, calendar_message, prompt, target):
+    """Goes through the calendar widget (year, month, day) of the event creation. Returns the seconds spent."""
+    total = 0.0
+    for step, value in (("y", f"{target.year}_"), ("m", f"{target.year}_{target.month}_"), ("d", f"{target.year}_{target.month}_{target.day}")):
+        data = find_button(calendar_message, f"cbcal_0_s_{step}_{value}")
+        if data is None:
+            raise StepTimeout() # The widget did not show the expected button
+        calendar_message, seconds = await user.step(
+            lambda: user.press(calendar_message, data),
+            lambda method, params: text_of(params) == prompt and buttons(params) or text_of(params).startswith("Enter "),
+        )
+        total += seconds
+    return total
+
+async def create_event(user):
+    """/createEvent, with every question of the conversation answered. Returns (seconds, outcome)."""
+    target = date.today() + timedelta(days=user.rng.randint(30, 300))
+    prompts = lambda *starts: (lambda method, params: text_of(params).startswith(starts))
+    total = 0.0
+    reply, seconds = await user.step(lambda: user.send_text("/createEvent"), prompts("Select the type"))
+    total += seconds
+    reply, seconds = await user.step(lambda: user.press(reply, user.rng.choice(("serata", "porta_party", "workshop"))), prompts("Enter event title"))
+    total += seconds
+    reply, seconds = await user.step(lambda: user.send_text(f"Load test event {user.user_id}"), prompts("Select START DATE"))
+    total += seconds + await pick_date(user, reply, "Select START DATE:", target)
+    reply, seconds = await user.step(lambda: user.send_text("20:00"), prompts("Select END DATE"))
+    total += seconds + await pick_date(user, reply, "Select END DATE:", target)
+    for answer, prompt in (("23:30", "Enter location"), ("Load test hall", "Enter capacity"), ("50", "Enter cost"), ("10", "Is the event active")):
+        reply, seconds = await user.step(lambda: user.send_text(answer), prompts(prompt))
+        total += seconds
+    reply, seconds = await user.step(lambda: user.press(reply, "True"), prompts("*Event created", "Failed to create"))
+    return total + seconds, "ok" if text_of(reply).startswith("*Event created") else "refused"
+
+async def journey(user, creator, results, think):
+    """One visit: an admin creates an event, the other users look at the events and book one of them."""
+    async def pause():
+        await asyncio.sleep(think * user.rng.uniform(0.5, 1.5))
+
+    try:
+        if creator:
+            seconds, outcome = await create_event(user)
+            results["create_event"].append(seconds)
+            results["refused"] += outcome == "refused"
+            return
+        events, seconds, outcome = await view_events(user)
+        results["view_events"].append(seconds)
+        results["errors"] += outcome == "error"
+        if not events:
+            return
+        await pause()
+        message, data = user.rng.choice(events)
+        pay_data, seconds, outcome = await see_more(user, message, data)
+        results["see_more"].append(seconds)
+        results["errors"] += outcome == "error"
+        if not pay_data:
+            return
+        await pause()
+        seconds, outcome = await pay(user, int(pay_data.split(":")[1]))
+        results["pay"].append(seconds)
+        results["refused"] += outcome == "refused"
+        results["errors"] += outcome == "error"
+    except StepTimeout:
+        results["timeouts"] += 1
+
+async def drive(api, users, creators, rounds, ramp, think, timeout, seed):
+    rng = random.Random(seed)
+    simulated = [SimulatedUser(api, FIRST_USER_ID + i, random.Random(rng.random()), timeout) for i in range(users)]
+    creator_ids = set(rng.sample(range(users), min(creators, users)))
+    results = {flow: [] for flow in FLOWS}
+    results.update(timeouts=0, errors=0, refused=0)
+
+    async def run_user(index, user):
+        await asyncio.sleep(ramp * index / users) # Users arrive evenly over the ramp
+        for _ in range(rounds):
+            await journey(user, index in creator_ids, results, think)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(index, user) for index, user in enumerate(simulated)))
+    return results, time.perf_counter() - start
+
+# ---- PROCESSES ----
+def process_cpu_seconds(metrics_url):
+    """CPU time of a process, from the process_cpu_seconds_total exposed on its /metrics."""
+    try:
+        text = httpx.get(metrics_url, timeout=5).text
+    except httpx.HTTPError:
+        return None
+    match = re.search(r"^process_cpu_seconds_total (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+def start_bot(env, log_path):
+    with open(log_path, "w") as log:
+        return subprocess.Popen([sys.executable, os.path.join(ROOT, "telegram_bot.py")], env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of telegram_bot.py against a local fake Telegram Bot API.")
+    parser.add_argument("--users", type=int, default=2000, help="Simulated users (each one is a seeded user)")
+    parser.add_argument("--creators", type=int, default=20, help="Simulated admins going through /createEvent instead")
+    parser.add_argument("--rounds", type=int, default=1, help="Visits of every user")
+    parser.add_argument("--ramp", type=float, default=30, help="Seconds over which the users arrive")
+    parser.add_argument("--think", type=float, default=1.0, help="Average seconds between the steps of a user")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a step without reply is counted as a timeout")
+    parser.add_argument("--events", type=int, default=300, help="Events seeded")
+    parser.add_argument("--reservations", type=int, default=2000, help="Reservations seeded")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the data set and of the users' choices")
+    parser.add_argument("--reuse-db", action="store_true", help=f"Do not recreate and seed the {BENCH_DB_NAME} database")
+    parser.add_argument("--output", default="bot_load_results.json", help="JSON file of the results")
+    args = parser.parse_args()
+
+    os.environ["DB_NAME"] = BENCH_DB_NAME # Used by setup_tables.connect_db here, by the Calendar service and by the bot
+    if not args.reuse_db:
+        print(f"Seeding {BENCH_DB_NAME}: {args.events} events, {args.users} users, {args.reservations} reservations (seed {args.seed})")
+        create_database()
+        seed_database(args.events, args.users, args.reservations, args.seed)
+
+    loop = asyncio.new_event_loop()
+    api = FakeBotAPI(loop)
+    work_dir = tempfile.mkdtemp(prefix="bot_load_test_")
+    env = dict(os.environ, TRACE_EXPORTER="none", PYTHONDONTWRITEBYTECODE="1",
+               SLOW_QUERY_LOG=os.path.join(work_dir, "slow_queries.jsonl"), QUERY_STATS_DIR=os.path.join(work_dir, "query_stats"),
+               WAITING_ROOM_SNAPSHOT=os.path.join(work_dir, "waiting_rooms.json"),
+               PAYPAL_API_URL=start_fake_paypal(0), BUSINESS_PAYPAL_ID="load-test", BUSINESS_PAYPAL_SECRET="load-test")
+    env.pop("POSTER_CACHE_CHAT_ID", None)
+    calendar, calendar_url = start_service("calendar", env)
+    bot_metrics_port = free_port()
+    env.update(BOT_TOKEN=FAKE_TOKEN, TELEGRAM_API_URL=api.start(), CALENDAR_SERVICE_URL=calendar_url, BOT_METRICS_PORT=str(bot_metrics_port))
+    bot_log = os.path.join(work_dir, "bot.log")
+    bot = None
+    try:
+        wait_ready(calendar_url, calendar)
+        bot = start_bot(env, bot_log)
+        if not api.polling.wait(60):
+            raise RuntimeError(f"the bot did not start polling (see {bot_log})")
+
+        bot_metrics, calendar_metrics = f"http://127.0.0.1:{bot_metrics_port}/metrics", f"{calendar_url}/metrics"
+        cpu_before = process_cpu_seconds(bot_metrics), process_cpu_seconds(calendar_metrics)
+        updates_before = api.next_update_id
+        print(f"{args.users} users ({args.creators} creating events), {args.rounds} round(s), ramp {args.ramp:.0f} s, think {args.think} s")
+        results, elapsed = loop.run_until_complete(
+            drive(api, args.users, args.creators, args.rounds, args.ramp, args.think, args.timeout, args.seed))
+        cpu_after = process_cpu_seconds(bot_metrics), process_cpu_seconds(calendar_metrics)
+        updates = api.next_update_id - updates_before
+        if bot.poll() is not None:
+            raise RuntimeError(f"the bot exited with code {bot.returncode} (see {bot_log})")
+    finally:
+        for process in (bot, calendar):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        loop.close()
+
+    flows = {}
+    print(f"\n{'flow':<13} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for flow in FLOWS:
+        latencies = sorted(seconds * 1000 for seconds in results[flow])
+        flows[flow] = {"count": len(latencies), "latency_ms": {
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99), "max": latencies[-1] if latencies else 0.0}}
+        latency = flows[flow]["latency_ms"]
+        print(f"{flow:<13} {len(latencies):>6} {latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f} {latency['max']:>9.1f}")
+
+    cpu = {name: after - before if before is not None and after is not None else None
+           for name, before, after in zip(("bot", "calendar"), cpu_before, cpu_after)}
+    print(f"\n{updates} updates in {elapsed:.1f} s ({updates / elapsed:.1f}/s); timeouts {results['timeouts']}, errors {results['errors']}, "
+          f"refused by the services {results['refused']}")
+    for name, seconds in cpu.items():
+        if seconds is not None:
+            print(f"{name} CPU: {seconds:.2f} s ({seconds / max(updates, 1) * 1000:.2f} ms per update, {seconds / elapsed:.0%} of a core)")
+    print(f"Bot API calls: {', '.join(f'{method} {count}' for method, count in sorted(api.calls.items()))}")
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "users": args.users, "creators": args.creators, "rounds": args.rounds, "ramp": args.ramp, "think": args.think,
+            "scale": {"events": args.events, "reservations": args.reservations}, "seed": args.seed,
+        },
+        "flows": flows, "updates": updates, "seconds": elapsed, "cpu_seconds": cpu,
+        "timeouts": results["timeouts"], "errors": results["errors"], "refused": results["refused"], "api_calls": api.calls,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output} (bot log: {bot_log})")
+    return 1 if results["timeouts"] or results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
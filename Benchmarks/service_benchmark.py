@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bcrypt
+import httpx
+import psycopg2
+from psycopg2.extras import execute_values
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)  # Allows imports from the project root
+
+# Benchmark of the HTTP services: Calendar, login/registration and payment are started as separate processes
+# (threaded WSGI server, like `app.run`) on a dedicated database seeded at the chosen scale; every scenario is
+# driven at fixed concurrency levels for a fixed time. The results (throughput, latency percentiles) are written
+# to JSON and compared with a stored baseline: a drop of throughput or a rise of p99 beyond the tolerance is
+# reported as a regression (exit code 1).
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "sde_benchmark")
+BASELINE_PATH = os.path.join(ROOT, "Benchmarks", "service_baseline.json")
+BENCH_PASSWORD = "benchmark-password" # Password of all the seeded users
+FIRST_USER_ID = 1_100_000_000
+FIRST_NEW_USER_ID = 1_500_000_000 # Users created by the /register scenario
+MIN_P99_CHANGE_MS = 2.0 # Smaller p99 changes are noise, not regressions
+
+SERVICES = {
+    "calendar": "Calendar.Calendar_service",
+    "login": "Authentication.login_registration_service",
+    "payment": "Payments.payment_service",
+}
+
+# ---- SERVICE PROCESSES ----
+def serve(service, port):
+    """Runs one service (called in the child process started by start_service)."""
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR) # No access log: it would be measured too
+    app = importlib.import_module(SERVICES[service]).app
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_service(service, env):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", service, "--port", str(port)], env=env, cwd=ROOT)
+    return process, f"http://127.0.0.1:{port}"
+
+def wait_ready(base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{base_url}: the service exited with code {process.returncode}")
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{base_url} not ready after {timeout} s")
+
+# ---- FAKE PAYPAL ----
+def start_fake_paypal(latency_ms):
+    """PayPal sandbox replacement answering the token, order creation (bot) and capture (payment service) calls."""
+
+    class FakePayPal(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency_ms / 1000)
+            if self.path == "/v1/oauth2/token":
+                result = {"access_token": "fake-token", "expires_in": 32400}
+            elif self.path == "/v2/checkout/orders":
+                order_id = f"FAKE{threading.get_ident()}{time.perf_counter_ns()}"
+                result = {"id": order_id, "status": "CREATED",
+                          "links": [{"rel": "approve", "href": f"https://www.sandbox.paypal.com/checkoutnow?token={order_id}"}]}
+            else:
+                result = {
+                    "status": "COMPLETED",
+                    "payer": {"name": {"given_name": "Bench", "surname": "Mark"}},
+                    "purchase_units": [{"payments": {"captures": [{"amount": {"value": "20.00"}, "create_time": "2026-01-01T20:00:00Z"}]}}],
+                }
+            data = json.dumps(result).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakePayPal)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+# ---- DATABASE ----
+def admin_connect():
+    conn = psycopg2.connect(host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"), database=os.getenv("BENCH_ADMIN_DB", "postgres"),
+                            user=os.getenv("DB_USER"), password=os.getenv("DB_PASSWORD"))
+    conn.autocommit = True
+    return conn
+
+def create_database():
+    """(Re)creates the benchmark database, with the tables of setup_tables.py and the migrations."""
+    conn = admin_connect()
+    cur = conn.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{BENCH_DB_NAME}" WITH (FORCE);')
+    cur.execute(f'CREATE DATABASE "{BENCH_DB_NAME}";')
+    conn.close()
+
+    from PostgreSQL_DB.migrate import migrate
+    migrate()
+
+def seed_database(events, users, reservations, seed):
+    """Deterministic data set: the same seed and scale give the same rows."""
+    rng = random.Random(seed)
+    from PostgreSQL_DB.setup_tables import connect_db
+    conn = connect_db()
+    cur = conn.cursor()
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8") # One hash: bcrypt is slow
+
+    execute_values(cur, "INSERT INTO users (user_id, name, surname, birthdate, username, password_hash, role) VALUES %s", [
+        (FIRST_USER_ID + i, f"Name{i}", f"Surname{i}", f"{1970 + i % 35}-{1 + i % 12:02d}-{1 + i % 28:02d}",
+         f"bench_user_{i}", password_hash, rng.choice(("leader", "follower")))
+        for i in range(users)
+    ], page_size=1000)
+
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    event_rows = []
+    for i in range(events):
+        start = now + timedelta(days=rng.randint(-30, 365), hours=rng.randint(17, 22))
+        capacity = rng.choice((30, 50, 100, 200))
+        event_rows.append((rng.choice(("serata", "porta_party", "workshop")), f"Event {i}", start, start + timedelta(hours=4),
+                           f"Location {rng.randint(1, 40)}", capacity, capacity, rng.choice((0, 10, 15, 20))))
+    execute_values(cur, """INSERT INTO events (event_type, title, start_date_time, end_date_time, location, capacity,
+                           remaining_seats, cost) VALUES %s""", event_rows, page_size=1000)
+
+    # Partitions of the reservations for the whole range of the events (from last month to one year ahead)
+    from PostgreSQL_DB.partition_maintenance import add_months, current_month, ensure_partitions
+    conn.commit()
+    ensure_partitions(conn, 14, add_months(current_month(), -1))
+
+    cur.execute("SELECT event_id, start_date_time FROM events ORDER BY event_id;")
+    event_starts = dict(cur.fetchall())
+    event_ids = list(event_starts)
+    pairs = set()
+    while len(pairs) < min(reservations, users * events):
+        pairs.add((FIRST_USER_ID + rng.randrange(users), rng.choice(event_ids)))
+    execute_values(cur, "INSERT INTO reservations (user_id, event_id, event_start, payment_status, role) VALUES %s", [
+        (user_id, event_id, event_starts[event_id], rng.choice(("paid", "paid", "pending")), rng.choice(("leader", "follower")))
+        for user_id, event_id in sorted(pairs)
+    ], page_size=1000)
+    # The holds being paid: /success captures the order of a pending reservation (then finds it already paid)
+    cur.execute("UPDATE reservations SET paypal_order_id = 'ORDER' || reservation_id WHERE payment_status = 'pending';")
+    cur.execute("""UPDATE events SET remaining_seats = GREATEST(capacity - r.seats, 0)
+                   FROM (SELECT event_id, COUNT(*) AS seats FROM reservations GROUP BY event_id) r
+                   WHERE events.event_id = r.event_id;""")
+    conn.commit()
+    cur.execute("ANALYZE;")
+    conn.close()
+    return event_ids
+
+# ---- SCENARIOS ----
+class Scenario:
+    def __init__(self, name, service, make_request, ok_statuses=(200,)):
+        self.name = name
+        self.service = service
+        self.make_request = make_request # rng -> (method, path, json body)
+        self.ok_statuses = ok_statuses
+
+def build_scenarios(state):
+    pages = max(1, state["future_events"] // 3)
+    return {scenario.name: scenario for scenario in (
+        Scenario("events_paging", "calendar", lambda rng: ("GET", f"/events?offset={rng.randrange(pages) * 3}", None)),
+        Scenario("event_detail", "calendar", lambda rng: ("GET", f"/events/{rng.choice(state['event_ids'])}", None)),
+        Scenario("register", "login", lambda rng: ("POST", "/register", new_user(state))),
+        Scenario("login", "login", lambda rng: ("POST", "/login", {
+            "username": f"bench_user_{rng.randrange(state['users'])}", "password": BENCH_PASSWORD, "telegram_id": 0})),
+        Scenario("payment_confirm", "payment", lambda rng: ("GET", f"/confirm_order?token=ORDER{rng.randrange(10 ** 6)}", None)),
+        Scenario("payment_success", "payment", lambda rng: ("GET", f"/success?token=ORDER{rng.randint(1, state['last_reservation_id'])}", None)),
+    )}
+
+def new_user(state):
+    state["next_user_id"] += 1
+    user_id = state["next_user_id"]
+    return {"telegram_id": user_id, "name": "New", "surname": "User", "birthdate": "1990-05-05",
+            "username": f"bench_new_{user_id}", "password": BENCH_PASSWORD, "role": "follower"}
+
+# ---- DRIVER ----
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)] # Nearest rank
+
+async def run_level(base_url, scenario, concurrency, duration, warmup, seed):
+    latencies, errors = [], 0
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+
+    async def worker(client):
+        nonlocal errors
+        while True:
+            method, path, body = scenario.make_request(rng)
+            sent = time.perf_counter()
+            if sent >= stop_at:
+                return
+            try:
+                response = await client.request(method, base_url + path, json=body)
+                ok = response.status_code in scenario.ok_statuses
+            except httpx.HTTPError:
+                ok = False
+            if sent >= measure_from:
+                latencies.append(time.perf_counter() - sent)
+                errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "throughput_rps": round(len(ms) / duration, 2),
+        "latency_ms": {
+            "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+            "p50": round(percentile(ms, 50), 3), "p90": round(percentile(ms, 90), 3),
+            "p99": round(percentile(ms, 99), 3), "max": round(ms[-1], 3) if ms else 0.0,
+        },
+    }
+
+# ---- BASELINE ----
+def compare(results, baseline, tolerance):
+    """Returns the regressions of `results` with respect to `baseline` (same scenarios and concurrency levels)."""
+    regressions = []
+    for scenario, levels in results.items():
+        for concurrency, current in levels.items():
+            reference = baseline.get(scenario, {}).get(concurrency)
+            if reference is None:
+                continue
+            if current["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{scenario} c={concurrency}: throughput {current['throughput_rps']} req/s "
+                                   f"(baseline {reference['throughput_rps']})")
+            p99, reference_p99 = current["latency_ms"]["p99"], reference["latency_ms"]["p99"]
+            if p99 > reference_p99 * (1 + tolerance) and p99 - reference_p99 > MIN_P99_CHANGE_MS:
+                regressions.append(f"{scenario} c={concurrency}: p99 {p99} ms (baseline {reference_p99} ms)")
+            if current["errors"] > reference["errors"]:
+                regressions.append(f"{scenario} c={concurrency}: {current['errors']} errors (baseline {reference['errors']})")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the Calendar, login/registration and payment services.")
+    parser.add_argument("--scenarios", nargs="+", help="Scenarios to run (default: all)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds per scenario and concurrency level")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of warm-up (not measured) before every measurement")
+    parser.add_argument("--events", type=int, default=1000, help="Events seeded")
+    parser.add_argument("--users", type=int, default=1000, help="Users seeded")
+    parser.add_argument("--reservations", type=int, default=5000, help="Reservations seeded")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the data set and of the request mix")
+    parser.add_argument("--reuse-db", action="store_true", help=f"Do not recreate and seed the {BENCH_DB_NAME} database")
+    parser.add_argument("--paypal-latency-ms", type=float, default=0, help="Latency of the fake PayPal API")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file of the results")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline to compare with (if the file exists)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Accepted relative change before flagging a regression")
+    parser.add_argument("--serve", choices=SERVICES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    os.environ["DB_NAME"] = BENCH_DB_NAME # Used by setup_tables.connect_db here and by the services
+    if not args.reuse_db:
+        print(f"Seeding {BENCH_DB_NAME}: {args.events} events, {args.users} users, {args.reservations} reservations (seed {args.seed})")
+        create_database()
+        seed_database(args.events, args.users, args.reservations, args.seed)
+
+    from PostgreSQL_DB.setup_tables import connect_db
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("SELECT event_id FROM events ORDER BY event_id;")
+    event_ids = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT COUNT(*) FROM events WHERE start_date_time > NOW();")
+    future_events = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM users WHERE username LIKE 'bench_user_%%';")
+    users = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM reservations;")
+    reservations = cur.fetchone()[0]
+    cur.execute("SELECT COALESCE(MAX(reservation_id), 1) FROM reservations;")
+    last_reservation_id = cur.fetchone()[0]
+    cur.execute("SELECT GREATEST(MAX(user_id), %s) FROM users;", (FIRST_NEW_USER_ID,))
+    state = {"event_ids": event_ids, "future_events": future_events, "users": users, "next_user_id": cur.fetchone()[0],
+             "last_reservation_id": last_reservation_id}
+    conn.close()
+
+    scenarios = build_scenarios(state)
+    selected = [scenarios[name] for name in (args.scenarios or scenarios)]
+    services = sorted({scenario.service for scenario in selected})
+
+    work_dir = tempfile.mkdtemp(prefix="service_benchmark_")
+    env = dict(os.environ, PAYPAL_API_URL=start_fake_paypal(args.paypal_latency_ms), TRACE_EXPORTER="none",
+               SLOW_QUERY_LOG=os.path.join(work_dir, "slow_queries.jsonl"), QUERY_STATS_DIR=os.path.join(work_dir, "query_stats"),
+               WAITING_ROOM_SNAPSHOT=os.path.join(work_dir, "waiting_rooms.json"), PYTHONDONTWRITEBYTECODE="1")
+    processes, base_urls = {}, {}
+    try:
+        for service in services:
+            processes[service], base_urls[service] = start_service(service, env)
+        for service in services:
+            wait_ready(base_urls[service], processes[service])
+
+        results = {}
+        print(f"\n{'scenario':<16} {'clients':>7} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for scenario in selected:
+            results[scenario.name] = {}
+            for concurrency in args.concurrency:
+                level = asyncio.run(run_level(base_urls[scenario.service], scenario, concurrency, args.duration, args.warmup, args.seed))
+                results[scenario.name][str(concurrency)] = level
+                latency = level["latency_ms"]
+                print(f"{scenario.name:<16} {concurrency:>7} {level['throughput_rps']:>9.1f} {latency['p50']:>9.2f} "
+                      f"{latency['p90']:>9.2f} {latency['p99']:>9.2f} {level['errors']:>7}")
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.wait()
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "scale": {"events": len(event_ids), "users": users, "reservations": reservations},
+            "seed": args.seed, "duration": args.duration, "warmup": args.warmup, "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("scale") != report["meta"]["scale"] or baseline["meta"].get("cpu_count") != os.cpu_count():
+            print("Warning: the baseline was recorded with a different scale or machine, the comparison is indicative")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        print(f"Compared with {args.baseline} (commit {baseline['meta'].get('commit')}, tolerance {args.tolerance:.0%}):")
+        print("\n".join(f"  REGRESSION {line}" for line in regressions) or "  no regressions")
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
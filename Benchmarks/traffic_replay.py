@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from urllib.parse import parse_qsl, urlencode
+import httpx
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Benchmarks.service_benchmark import percentile
+from Monitoring.traffic_capture import REDACTED
+
+# Replays the requests captured by the Flask services (TRAFFIC_CAPTURE=1, see Monitoring/traffic_capture.py) against
+# another instance, keeping their original spacing (or compressed by --speed), and compares the server time of every
+# route with the one recorded in the capture. The services return their server time in the Server-Timing header:
+# both sides are measured in the same way, without the network and the client. The capture is read line by line.
+SERVER_TIMING = re.compile(r"(?:^|,)\s*app;dur=([\d.]+)")
+
+def read_capture(path, services, limit):
+    with open(path) as f:
+        count = 0
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if services and record["service"] not in services:
+                continue
+            yield record
+            count += 1
+            if limit and count >= limit:
+                return
+
+def fill_redacted(value, fill):
+    """Puts back the values given with --fill (e.g. the password of the test users) in place of the redacted ones."""
+    if isinstance(value, dict):
+        return {key: fill.get(key, item) if item == REDACTED else fill_redacted(item, fill) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_redacted(item, fill) for item in value]
+    return value
+
+def fill_query(query, fill):
+    return urlencode([(key, fill.get(key, item) if item == REDACTED else item) for key, item in parse_qsl(query, keep_blank_values=True)])
+
+def route_key(record):
+    return f"{record['service']} {record['method']} {record['route'] or record['path']}"
+
+class RouteResult:
+    def __init__(self):
+        self.original_ms = []
+        self.replay_ms = []
+        self.client_ms = []
+        self.status_mismatches = 0
+        self.errors = 0
+
+    def summary(self):
+        original, replay, client = sorted(self.original_ms), sorted(self.replay_ms), sorted(self.client_ms)
+        return {
+            "count": len(self.original_ms), "status_mismatches": self.status_mismatches, "errors": self.errors,
+            "original_ms": {"p50": percentile(original, 50), "p99": percentile(original, 99)},
+            "replay_ms": {"p50": percentile(replay, 50), "p99": percentile(replay, 99)},
+            "client_ms": {"p50": percentile(client, 50), "p99": percentile(client, 99)},
+        }
+
+async def send(client, base_url, record, fill, result):
+    url = base_url + record["path"]
+    query = fill_query(record.get("query") or "", fill)
+    if query:
+        url += "?" + query
+    kwargs = {"headers": record.get("headers", {})}
+    if "json" in record:
+        kwargs["json"] = fill_redacted(record["json"], fill)
+    elif "form" in record:
+        kwargs["content"] = fill_query(record["form"], fill).encode("utf-8")
+
+    start = time.perf_counter()
+    try:
+        response = await client.request(record["method"], url, **kwargs)
+    except httpx.HTTPError:
+        result.errors += 1
+        return
+    client_ms = (time.perf_counter() - start) * 1000
+    match = SERVER_TIMING.search(response.headers.get("Server-Timing", ""))
+    result.original_ms.append(record["duration_ms"])
+    result.client_ms.append(client_ms)
+    result.replay_ms.append(float(match.group(1)) if match else client_ms) # Targets without Server-Timing: client time
+    result.status_mismatches += response.status_code != record["status"]
+
+async def replay(records, targets, speed, max_in_flight, fill, timeout):
+    results, lag_ms, skipped = {}, [], 0
+    semaphore = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+
+    async def run(base_url, record, result):
+        try:
+            await send(client, base_url, record, fill, result)
+        finally:
+            semaphore.release()
+
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=max_in_flight)) as client:
+        first_ts, start = None, time.perf_counter()
+        for record in records:
+            base_url = targets.get(record["service"], targets.get("*"))
+            if base_url is None or "body_size" in record: # No target for the service, or body not captured (uploads)
+                skipped += 1
+                continue
+            if first_ts is None:
+                first_ts = record["ts"]
+            due = (record["ts"] - first_ts) / speed if speed > 0 else 0.0
+            delay = due - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            lag_ms.append(max(0.0, (time.perf_counter() - start - due) * 1000)) # How late the request is sent
+            task = asyncio.create_task(run(base_url, record, results.setdefault(route_key(record), RouteResult())))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return results, sorted(lag_ms), skipped, elapsed
+
+def parse_pairs(values, what):
+    pairs = {}
+    for value in values or ():
+        key, sep, item = value.partition("=")
+        if not sep:
+            sys.exit(f"{what} must be KEY=VALUE: {value}")
+        pairs[key] = item
+    return pairs
+
+def change(new, old):
+    return f"{(new - old) / old:+.0%}" if old else "-"
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays the captured traffic of the Flask services and compares the latencies.")
+    parser.add_argument("capture", nargs="?", default=os.environ.get("TRAFFIC_CAPTURE_FILE", "traffic_capture.jsonl"), help="Capture file (JSON lines)")
+    parser.add_argument("--target", action="append", required=True,
+                        help="Base URL of the instance (http://host:port), or SERVICE=URL to send each service to its own instance")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed: 1 = original spacing, 2 = twice as fast, 0 = as fast as possible")
+    parser.add_argument("--service", action="append", help="Replay only the requests of these services")
+    parser.add_argument("--limit", type=int, help="Replay at most this many requests")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Concurrent requests at most")
+    parser.add_argument("--fill", action="append", help="KEY=VALUE put back in place of a redacted field (e.g. password=...)")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout of every request, in seconds")
+    parser.add_argument("--output", help="JSON file of the results")
+    args = parser.parse_args()
+
+    targets = {}
+    for target in args.target:
+        service, sep, url = target.partition("=")
+        targets[service if sep else "*"] = (url if sep else target).rstrip("/")
+
+    records = read_capture(args.capture, set(args.service or ()), args.limit)
+    results, lag_ms, skipped, elapsed = asyncio.run(
+        replay(records, targets, args.speed, args.max_in_flight, parse_pairs(args.fill, "--fill"), args.timeout))
+    summaries = {key: result.summary() for key, result in sorted(results.items())}
+
+    total = sum(summary["count"] for summary in summaries.values())
+    print(f"{total} requests replayed in {elapsed:.1f} s at speed {args.speed:g} ({skipped} skipped), "
+          f"send lag p99 {percentile(lag_ms, 99):.1f} ms\n")
+    print(f"{'route':<48} {'count':>6} {'orig p50':>9} {'new p50':>9} {'Δp50':>6} {'orig p99':>9} {'new p99':>9} {'Δp99':>6} {'status≠':>8} {'errors':>7}")
+    for key, summary in summaries.items():
+        original, new = summary["original_ms"], summary["replay_ms"]
+        print(f"{key[:48]:<48} {summary['count']:>6} {original['p50']:>9.2f} {new['p50']:>9.2f} {change(new['p50'], original['p50']):>6} "
+              f"{original['p99']:>9.2f} {new['p99']:>9.2f} {change(new['p99'], original['p99']):>6} {summary['status_mismatches']:>8} {summary['errors']:>7}")
+    if percentile(lag_ms, 99) > 100:
+        print("\nWarning: the requests were sent late (the replayer or the target could not keep up), the spacing was not respected")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"capture": args.capture, "speed": args.speed, "seconds": elapsed, "skipped": skipped,
+                       "lag_ms": {"p50": percentile(lag_ms, 50), "p99": percentile(lag_ms, 99)}, "routes": summaries}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
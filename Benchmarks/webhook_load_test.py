@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import httpx
+from telegram.ext import Application, MessageHandler, filters
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Bot_utilities.bot_webhook import WEBHOOK_PATH, run_webhook
+
+# Load test of the webhook mode: a local fake Telegram Bot API receives the replies of the bot, while the driver
+# POSTs updates to the webhook endpoint as Telegram would. Each update costs CPU_WORK_ITERATIONS rounds of PBKDF2
+# in the handler (CPU-bound work, like the password hashing of the login): the throughput should grow almost
+# linearly with the number of worker processes, up to the number of cores.
+FAKE_TOKEN = "123456:LOAD-TEST"
+SECRET = "load-test-secret"
+CPU_WORK_ITERATIONS = int(os.environ.get("LOAD_TEST_CPU_WORK", 20000))
+
+# ---- FAKE TELEGRAM API ----
+def run_fake_api(port, replies, out_of_order, ready):
+    last_sequence = {} # chat_id -> sequence number of the last reply
+
+    class FakeTelegramAPI(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(body or b"{}")
+            else:
+                params = {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+            if method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Load test", "username": "load_test_bot"}
+            elif method == "sendMessage":
+                chat_id = int(params["chat_id"])
+                sequence = int(params["text"])
+                with replies.get_lock():
+                    if sequence < last_sequence.get(chat_id, -1):
+                        out_of_order.value += 1
+                    last_sequence[chat_id] = sequence
+                    replies.value += 1
+                result = {"message_id": sequence + 1, "date": int(time.time()), "text": params["text"],
+                          "chat": {"id": chat_id, "type": "private"}}
+            else:
+                result = True
+
+            data = json.dumps({"ok": True, "result": result}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeTelegramAPI)
+    server.daemon_threads = True
+    ready.set()
+    server.serve_forever()
+
+# ---- BOT UNDER TEST ----
+async def cpu_bound_echo(update, context):
+    hashlib.pbkdf2_hmac("sha256", update.message.text.encode("utf-8"), b"load-test", CPU_WORK_ITERATIONS)
+    await update.message.reply_text(update.message.text)
+
+def build_load_test_application():
+    app = Application.builder().token(FAKE_TOKEN).base_url(f"http://127.0.0.1:{os.environ['FAKE_API_PORT']}/bot").build()
+    app.add_handler(MessageHandler(filters.TEXT, cpu_bound_echo))
+    return app
+
+def run_bot(workers, port):
+    run_webhook(build_load_test_application, workers=workers, host="127.0.0.1", port=port, secret=SECRET)
+
+# ---- DRIVER ----
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_update(update_id, chat_id, sequence):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": sequence + 1, "date": int(time.time()), "text": str(sequence),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"},
+        },
+    }
+
+async def wait_replies(replies, expected, timeout):
+    deadline = time.monotonic() + timeout
+    while replies.value < expected:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"only {replies.value}/{expected} replies received")
+        await asyncio.sleep(0.01)
+
+async def drive(url, replies, workers, n_updates, n_chats, concurrency):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        # Waits for the endpoint, then for every worker to be ready (chat i is handled by worker i)
+        for _ in range(200):
+            try:
+                await client.post(url, content=b"{}", headers={})
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+        for chat_id in range(workers):
+            await client.post(url, json=make_update(chat_id, chat_id, 0), headers=headers)
+        await wait_replies(replies, workers, 60)
+        replies.value = 0
+
+        # Like Telegram, the updates of a chat are sent one after the other (chats in parallel):
+        # the fake API checks that the replies of every chat keep the same order
+        semaphore = asyncio.Semaphore(concurrency)
+        async def send_chat(chat_id, sequences):
+            for sequence in sequences:
+                async with semaphore:
+                    response = await client.post(url, json=make_update(sequence, chat_id, sequence), headers=headers)
+                    response.raise_for_status()
+
+        per_chat = n_updates // n_chats
+        start = time.perf_counter()
+        first_chat = workers * 1000000 # New chats at every run: the fake API remembers the last sequence of every chat
+        await asyncio.gather(*(send_chat(first_chat + c, range(1, per_chat + 1)) for c in range(n_chats)))
+        await wait_replies(replies, per_chat * n_chats, 600)
+        return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the webhook mode against a local fake Telegram API.")
+    parser.add_argument("--workers", type=int, nargs="+", help="Worker counts to test (default: 1, 2, 4, ... up to the CPU cores)")
+    parser.add_argument("--updates", type=int, default=2000, help="Updates sent for every worker count")
+    parser.add_argument("--chats", type=int, default=200, help="Distinct chats sending the updates")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent webhook requests")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+
+    context = multiprocessing.get_context("spawn")
+    replies, out_of_order, ready = context.Value("i", 0), context.Value("i", 0), context.Event()
+    os.environ["FAKE_API_PORT"] = str(free_port()) # Inherited by the bot workers
+    fake_api = context.Process(target=run_fake_api, args=(int(os.environ["FAKE_API_PORT"]), replies, out_of_order, ready), daemon=True)
+    fake_api.start()
+    ready.wait()
+
+    print(f"{args.updates} updates from {args.chats} chats, {cores} CPU cores\n")
+    print(f"{'workers':>8} {'seconds':>9} {'updates/s':>10} {'speedup':>8} {'efficiency':>11}")
+    baseline = None
+    for workers in worker_counts:
+        port = free_port()
+        bot = context.Process(target=run_bot, args=(workers, port))
+        bot.start()
+        try:
+            elapsed = asyncio.run(drive(f"http://127.0.0.1:{port}{WEBHOOK_PATH}", replies, workers, args.updates, args.chats, args.concurrency))
+        finally:
+            bot.terminate()
+            bot.join()
+        throughput = args.updates // args.chats * args.chats / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>8} {elapsed:>9.2f} {throughput:>10.1f} {throughput / baseline:>7.2f}x {throughput / baseline / workers:>10.0%}")
+
+    print(f"\nReplies out of order within a chat: {out_of_order.value}")
+    fake_api.terminate()
+
+
+if __name__ == "__main__":
+    main()
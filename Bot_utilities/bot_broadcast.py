@@ -0,0 +1,242 @@
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+from telegram import Update
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.ext import ContextTypes
+
+from Bot_utilities.bot_auth import *
+from PostgreSQL_DB.setup_tables import connect_db
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Telegram accepts ~30 messages per second overall and ~1 per second in the same chat:
+# the defaults stay a bit below to leave room for the interactive replies of the bot
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))
+PER_CHAT_RATE = 1.0
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", 200))
+MAX_SEND_ATTEMPTS = 3
+NETWORK_RETRY_DELAY = 1.0 # Seconds before the first new attempt after a timeout/network error, doubled at each one
+
+class TokenBucket:
+    """Allows `rate` operations per second on average, with bursts of at most `capacity` operations."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self):
+        """Takes a token and returns how many seconds to wait before using it (0 if one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class RateLimitedSender:
+    """
+    Send queue shared by all the bulk senders of the bot (broadcasts, reminders): every message waits for a token of
+    the global bucket and of the bucket of its chat. A 429 (RetryAfter) pauses the whole queue for the requested time.
+    """
+
+    def __init__(self, rate=BROADCAST_RATE, per_chat_rate=PER_CHAT_RATE):
+        self.global_bucket = TokenBucket(rate)
+        self.per_chat_rate = per_chat_rate
+        self.chat_buckets = {} # chat_id -> TokenBucket
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+        self.retries = 0
+        self.network_retries = 0
+
+    async def acquire(self, chat_id):
+        # The tokens are taken under the lock, in arrival order: the queue is fair and the buckets are never overdrawn
+        async with self.lock:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self.chat_buckets) > 10000:
+                    self.chat_buckets.clear() # Idle buckets are full anyway: dropping them changes nothing
+                bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1.0)
+            wait = max(self.global_bucket.delay(), bucket.delay())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def call(self, chat_id, request):
+        """
+        Runs `request` (a coroutine function making one Bot API call to the chat, e.g. a send_photo) respecting the
+        limits, again after a 429 or a timeout/network error (with a backoff for this recipient only).
+        Returns its result; the other errors and the error of the last attempt are raised.
+        """
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self.acquire(chat_id)
+            try:
+                return await request()
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                self.retries += 1
+                if attempt == MAX_SEND_ATTEMPTS - 1:
+                    raise
+            except BadRequest:
+                raise # A NetworkError too, but retrying it gives the same answer
+            except NetworkError:
+                # A timed out request may have been delivered: at worst the recipient gets it twice
+                if attempt == MAX_SEND_ATTEMPTS - 1:
+                    raise
+                self.network_retries += 1
+                await asyncio.sleep(NETWORK_RETRY_DELAY * 2 ** attempt)
+
+    async def send(self, bot, chat_id, text, **kwargs):
+        """Sends a message respecting the limits. Returns True if delivered, False if the chat cannot be reached."""
+        try:
+            await self.call(chat_id, lambda: bot.send_message(chat_id, text, **kwargs))
+            return True
+        except (Forbidden, BadRequest):
+            return False # The user blocked the bot or the chat does not exist: retrying is useless
+        except (RetryAfter, NetworkError):
+            return False # Still limited or unreachable after MAX_SEND_ATTEMPTS attempts: the broadcast goes on
+
+broadcast_sender = None
+
+def get_broadcast_sender():
+    global broadcast_sender
+    if broadcast_sender is None:
+        broadcast_sender = RateLimitedSender()
+    return broadcast_sender
+
+running_broadcasts = set() # Broadcasts being delivered by this process
+
+# ---- PERSISTENCE ----
+# The progress of a broadcast (last user reached, in user_id order) is saved after every batch:
+# after a crash the broadcast restarts from there and at most one batch is sent twice.
+def create_broadcast(message, created_by):
+    conn = connect_db()
+    try:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO broadcasts (message, created_by) VALUES (%s, %s) RETURNING broadcast_id;", (message, created_by))
+        broadcast_id = cur.fetchone()[0]
+        conn.commit()
+        return broadcast_id
+    finally:
+        conn.close()
+
+def load_broadcast(broadcast_id):
+    conn = connect_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT message, status, last_user_id, sent_count, failed_count FROM broadcasts WHERE broadcast_id = %s;",
+            (broadcast_id,)
+        )
+        return cur.fetchone()
+    finally:
+        conn.close()
+
+def save_progress(conn, broadcast_id, last_user_id, sent, failed, status="running"):
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE broadcasts SET last_user_id = %s, sent_count = sent_count + %s, failed_count = failed_count + %s,
+               status = %s, finished_at = CASE WHEN %s = 'running' THEN NULL ELSE NOW() END
+        WHERE broadcast_id = %s;
+        """, (last_user_id, sent, failed, status, status, broadcast_id))
+    conn.commit()
+
+async def run_broadcast(bot, broadcast_id, report_chat_id=None):
+    """Delivers the broadcast to all the users after its saved progress, then reports the throughput."""
+    message, status, last_user_id, sent_total, failed_total = await asyncio.to_thread(load_broadcast, broadcast_id)
+    if status != "running" or broadcast_id in running_broadcasts:
+        return
+
+    running_broadcasts.add(broadcast_id)
+    sender = get_broadcast_sender()
+    # The sender lives as long as the bot: its counters are cumulative, the report shows the retries of this run
+    retries_before, network_retries_before = sender.retries, sender.network_retries
+    start = time.monotonic()
+    sent = failed = 0
+    conn = progress_conn = None
+    try:
+        conn = await asyncio.to_thread(connect_db)
+        # The progress is saved on a second connection: committing on the first one would close the named cursor
+        progress_conn = await asyncio.to_thread(connect_db)
+        # Named cursor: the recipients are streamed from the server, never loaded all at once
+        recipients = conn.cursor(name=f"broadcast_{broadcast_id}_recipients")
+        recipients.execute("SELECT user_id FROM users WHERE user_id > %s ORDER BY user_id;", (last_user_id,))
+
+        while True:
+            batch = await asyncio.to_thread(recipients.fetchmany, BROADCAST_BATCH_SIZE)
+            if not batch:
+                break
+            # The user_id of a registered user is its Telegram id, which is also the id of its private chat with the bot
+            results = await asyncio.gather(*(sender.send(bot, user_id, message) for (user_id,) in batch))
+            batch_sent = sum(results)
+            sent += batch_sent
+            failed += len(results) - batch_sent
+            last_user_id = batch[-1][0]
+            await asyncio.to_thread(save_progress, progress_conn, broadcast_id, last_user_id, batch_sent, len(results) - batch_sent)
+
+        await asyncio.to_thread(save_progress, progress_conn, broadcast_id, last_user_id, 0, 0, "completed")
+    finally:
+        running_broadcasts.discard(broadcast_id)
+        for c in (conn, progress_conn):
+            if c:
+                c.close()
+
+    elapsed = time.monotonic() - start
+    report = (
+        f"📣 Broadcast {broadcast_id} completed: {sent_total + sent} delivered, {failed_total + failed} failed. "
+        f"This run: {sent + failed} messages in {elapsed:.1f}s ({(sent + failed) / elapsed if elapsed else 0:.1f} msg/s, "
+        f"{sender.retries - retries_before} rate-limit retries, {sender.network_retries - network_retries_before} network retries)."
+    )
+    print(report)
+    if report_chat_id:
+        await bot.send_message(report_chat_id, report)
+
+# Command usage: /broadcast <message>
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await IsUserAuthorized(update, context):
+        await update.message.reply_text("You are not authorized to perform this action.")
+        return
+
+    message = update.message.text.partition(" ")[2].strip() # Keeps the line breaks of the announcement
+    if not message:
+        await update.message.reply_text("Usage: /broadcast <message>")
+        return
+
+    broadcast_id = await asyncio.to_thread(create_broadcast, message, update.message.from_user.id)
+    await update.message.reply_text(f"Broadcast {broadcast_id} started: you will receive a report when it is completed.")
+    # Runs in background: the bot keeps answering the other users in the meantime
+    context.application.create_task(run_broadcast(context.bot, broadcast_id, update.message.chat_id))
+
+# Command usage: /resumeBroadcast <broadcast_id>
+# Continues a broadcast interrupted by a crash or a restart of the bot
+async def resume_broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await IsUserAuthorized(update, context):
+        await update.message.reply_text("You are not authorized to perform this action.")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /resumeBroadcast <broadcast_id>")
+        return
+
+    broadcast_id = int(context.args[0])
+    broadcast = await asyncio.to_thread(load_broadcast, broadcast_id)
+    if broadcast is None:
+        await update.message.reply_text("Broadcast not found.")
+        return
+    if broadcast[1] != "running":
+        await update.message.reply_text(f"Broadcast {broadcast_id} is already {broadcast[1]}.")
+        return
+    if broadcast_id in running_broadcasts:
+        await update.message.reply_text(f"Broadcast {broadcast_id} is still being delivered.")
+        return
+
+    await update.message.reply_text(f"Broadcast {broadcast_id} resumed after {broadcast[3] + broadcast[4]} messages.")
+    context.application.create_task(run_broadcast(context.bot, broadcast_id, update.message.chat_id))
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor, ContextTypes
+
+from Bot_utilities.bot_auth import *
+from Monitoring.profiler import LoopLagMonitor
+from Monitoring.tracing import start_span
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Updates handled at the same time (a slow handler, e.g. a Calendar service call or a PayPal order, blocks only its chat)
+BOT_CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", 32))
+# Updates accepted by the processor, waiting for their chat or for a free slot
+BOT_MAX_QUEUED_UPDATES = int(os.environ.get("BOT_MAX_QUEUED_UPDATES", 10000))
+
+update_metrics = {
+    "in_flight": 0, # Handlers running now
+    "max_in_flight": 0,
+    "waiting": 0, # Updates waiting for their chat or for a free slot
+    "processed": 0,
+    "queue_wait_total": 0.0, # Seconds between the arrival of the updates and the start of their handlers
+    "queue_wait_max": 0.0,
+}
+recent_queue_waits = deque(maxlen=1000) # For the percentiles
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Handles the updates of different chats concurrently (at most BOT_CONCURRENT_UPDATES at a time), while the updates
+    of the same chat are handled one after the other, in arrival order: the ConversationHandler states and the
+    user_data of a chat are never modified by two handlers at once.
+
+    The semaphore of BaseUpdateProcessor is taken before do_process_update: it only limits the updates waiting.
+    The concurrency limit is applied after the lock of the chat, so that many updates of a single chat waiting
+    for their turn do not take the slots of the other chats.
+    """
+
+    def __init__(self, max_concurrent_updates=BOT_CONCURRENT_UPDATES, max_queued_updates=BOT_MAX_QUEUED_UPDATES):
+        super().__init__(max(max_queued_updates, max_concurrent_updates))
+        self.workers = asyncio.Semaphore(max_concurrent_updates)
+        self.chat_locks = {} # chat id -> [lock, number of updates holding or waiting for it]
+        self.lag_monitor = None
+
+    @staticmethod
+    def chat_key(update):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None # Not related to a chat (e.g. a poll): no ordering needed
+
+    @staticmethod
+    def span_attributes(update, chat_id, wait):
+        attributes = {"chat_id": chat_id, "queue_wait_ms": round(wait * 1000, 3)}
+        if isinstance(update, Update):
+            attributes["update_id"] = update.update_id
+            attributes["update_type"] = next((field for field in Update.ALL_TYPES if getattr(update, field, None)), "unknown")
+        return attributes
+
+    async def do_process_update(self, update, coroutine):
+        arrived = time.monotonic()
+        key = self.chat_key(update)
+        entry = None
+        if key is not None:
+            entry = self.chat_locks.get(key)
+            if entry is None:
+                entry = self.chat_locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        update_metrics["waiting"] += 1
+        started = False
+        try:
+            # asyncio.Lock is fair: the updates of the chat get it in the order they arrived
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self.workers:
+                    started = True
+                    wait = time.monotonic() - arrived
+                    update_metrics["waiting"] -= 1
+                    update_metrics["queue_wait_total"] += wait
+                    update_metrics["queue_wait_max"] = max(update_metrics["queue_wait_max"], wait)
+                    recent_queue_waits.append(wait)
+                    update_metrics["in_flight"] += 1
+                    update_metrics["max_in_flight"] = max(update_metrics["max_in_flight"], update_metrics["in_flight"])
+                    try:
+                        # Root span of the trace of the update: the handlers, the Bot API calls and the requests
+                        # to the Calendar/login services (down to their SQL statements) are its children
+                        with start_span("telegram update", kind="consumer", **self.span_attributes(update, key, wait)):
+                            await coroutine
+                    finally:
+                        update_metrics["in_flight"] -= 1
+                        update_metrics["processed"] += 1
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if not started:
+                update_metrics["waiting"] -= 1 # Cancelled while waiting
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.chat_locks[key]
+
+    # Every process of the bots (polling, webhook workers) initializes its update processor in the event loop
+    # handling the updates: the lag of that loop is watched from here
+    async def initialize(self):
+        self.lag_monitor = LoopLagMonitor()
+        self.lag_monitor.start()
+
+    async def shutdown(self):
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
+
+def queue_wait_percentile(p):
+    waits = sorted(recent_queue_waits)
+    return waits[min(int(len(waits) * p / 100), len(waits) - 1)] if waits else 0.0
+
+# Command usage: /botStats
+async def bot_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await IsUserAuthorized(update, context):
+        await update.message.reply_text("You are not authorized to perform this action.")
+        return
+
+    m = update_metrics
+    await update.message.reply_text(
+        f"Handlers running: {m['in_flight']} (max {m['max_in_flight']}), waiting: {m['waiting']}\n"
+        f"Updates processed: {m['processed']}\n"
+        f"Queue wait: p50 {queue_wait_percentile(50) * 1000:.0f} ms, p99 {queue_wait_percentile(99) * 1000:.0f} ms, "
+        f"max {m['queue_wait_max'] * 1000:.0f} ms"
+    )
@@ -203,4 +203,5 @@ async def get_is_active(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
         else:
             print(f"Failed to create event. Please try later (HTTP code: {response.status_code})")
+            await update.callback_query.message.edit_text(f"Failed to create the event. Please try later (HTTP code: {response.status_code})")
             return ConversationHandler.END
\ No newline at end of file
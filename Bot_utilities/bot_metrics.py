@@ -0,0 +1,110 @@
+import inspect
+import os
+import sys
+import time
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+import Bot_utilities.bot_tickets as bot_tickets
+from Bot_utilities.bot_broadcast import running_broadcasts
+from Bot_utilities.bot_concurrency import update_metrics
+from Bot_utilities.bot_view_events import poster_cache
+from Monitoring.metrics import counter, gauge, histogram
+from Monitoring.http_metrics import install_http_metrics
+from Monitoring.tracing import child_span, set_service_name
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Port of the /metrics endpoint of the bot (in webhook mode, worker i uses the next port + i)
+BOT_METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", 9100))
+
+handler_duration = histogram(
+    "bot_handler_duration_seconds", "Time spent in the handler callbacks, by callback and conversation state.",
+    ("handler", "conversation", "state"),
+)
+handler_errors = counter(
+    "bot_handler_errors_total", "Handler callbacks that raised an exception.",
+    ("handler", "conversation", "state"),
+)
+api_request_duration = histogram(
+    "telegram_api_request_duration_seconds", "Time spent on the Bot API requests, by API method.",
+    ("api_method", "status"),
+)
+
+# ---- BOT API REQUESTS ----
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """Request object of the bot timing every Bot API call (sendMessage, sendPhoto, getUpdates...)."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        start = time.perf_counter()
+        api_method = url.rsplit("/", 1)[-1]
+        with child_span(f"telegram {api_method}", "client"):
+            try:
+                code, payload = await super().do_request(url, method, *args, **kwargs)
+            except Exception:
+                api_request_duration.observe(time.perf_counter() - start, api_method, "error")
+                raise
+        api_request_duration.observe(time.perf_counter() - start, api_method, str(code))
+        return code, payload
+
+# ---- HANDLERS ----
+def timed_callback(callback, conversation, state):
+    labels = (getattr(callback, "__qualname__", type(callback).__name__), conversation, state)
+
+    async def timed(update, context):
+        start = time.perf_counter()
+        try:
+            with child_span(f"handler {labels[0]}", conversation=conversation, state=state):
+                result = callback(update, context)
+                if inspect.isawaitable(result): # Some callbacks are lambdas returning a coroutine
+                    result = await result
+                return result
+        except Exception:
+            handler_errors.inc(*labels)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - start, *labels)
+
+    return timed
+
+def instrument_handler(handler, conversation="", state=""):
+    if isinstance(handler, ConversationHandler):
+        name = handler.name or "conversation"
+        for entry_point in handler.entry_points:
+            instrument_handler(entry_point, name, "entry")
+        for conversation_state, handlers in handler.states.items():
+            for state_handler in handlers:
+                instrument_handler(state_handler, name, str(conversation_state))
+        for fallback in handler.fallbacks:
+            instrument_handler(fallback, name, "fallback")
+    else:
+        handler.callback = timed_callback(handler.callback, conversation, state)
+
+def instrument_application(app, service="bot"):
+    """
+    Times (and traces) all the handlers registered on the Application and the outbound HTTP requests,
+    and publishes the gauges of the bot.
+    """
+    set_service_name(service)
+    install_http_metrics()
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler)
+
+    gauge("bot_updates_in_flight", "Handlers running now.").set_function(lambda: update_metrics["in_flight"])
+    gauge("bot_updates_waiting", "Updates waiting for their chat or for a free slot.").set_function(lambda: update_metrics["waiting"])
+    counter("bot_updates_processed_total", "Updates handled.").set_function(lambda: update_metrics["processed"])
+    counter("bot_update_queue_wait_seconds_total", "Time spent by the updates waiting before their handler.").set_function(
+        lambda: update_metrics["queue_wait_total"])
+
+    gauge("bot_poster_cache_entries", "Posters whose Telegram file_id is cached.").set_function(lambda: len(poster_cache))
+    gauge("bot_broadcasts_running", "Broadcasts being delivered by this process.").set_function(lambda: len(running_broadcasts))
+    # Private attribute of ProcessPoolExecutor: the pool exposes no public queue size
+    gauge("bot_ticket_render_pending", "Ticket images waiting for the render pool.").set_function(
+        lambda: len(bot_tickets.ticket_renderer._pending_work_items))
+
+    persistence = app.persistence
+    if persistence is not None:
+        gauge("bot_persistence_cached_users", "user_data kept in memory.").set_function(lambda: len(persistence.loaded_users))
+        gauge("bot_persistence_pending_writes", "Changed user_data and conversations not yet written.").set_function(
+            lambda: len(persistence.dirty_user_data) + len(persistence.dirty_conversations))
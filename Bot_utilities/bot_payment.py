@@ -1,36 +1,97 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+import httpx
 from telegram import Update,InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes,ContextTypes
-from Payments.payment_functions import test_paypal
+from Payments.payment_functions import create_order
 
 async def pay_button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    if query.data == "pay":
-        # IMPORTANT: pay_function expects an Update containing a .message
-        # but button presses come as a callback_query.
-        # So we call it manually using the callback's message.
-        fake_update = Update(
-            update.update_id,
-            message=query.message
-        )
-        return await pay_function(fake_update, context)
+    # Button data is "pay:<event_id>"
+    event_id = int(query.data.split(":")[1])
+    return await start_payment(context, query.message.chat_id, query.from_user.id, event_id)
 
 async def pay_function(update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = None
-    if update.message:
-        tg_id = update.message.from_user.id
-        chat_id = update.message.chat_id
-    elif update.callback_query:
-        tg_id = update.callback_query.from_user.id
-        chat_id = update.callback_query.message.chat_id
-
-    linkToBeReturned = test_paypal()
-    keyboard = [[InlineKeyboardButton("🔗 Complete the payment", url=linkToBeReturned)]]
+    # Command usage: /pay <event_id>
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /pay <event_id> (or press 'Book' on an event)")
+        return
+
+    tg_id = update.message.from_user.id
+    chat_id = update.message.chat_id
+    return await start_payment(context, chat_id, tg_id, int(context.args[0]))
+
+# Holds a seat of the event (reservation in 'pending' state) and sends the PayPal link to complete the payment.
+# The hold is released by the Calendar service if the payment is not completed within HOLD_TTL_MINUTES.
+async def start_payment(context: ContextTypes.DEFAULT_TYPE, chat_id, tg_id, event_id):
+    async with httpx.AsyncClient() as client:
+        load_dotenv()  # Loads variables from .env into environment
+        CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+        HOLD_TTL_MINUTES = os.environ.get("HOLD_TTL_MINUTES", 15)
+
+        response = await client.post(f"{CALENDAR_SERVICE_URL}/events/{event_id}/reservations", json={"user_id": tg_id})
+
+        # The event has a waiting room and the user has not been admitted yet
+        if response.status_code == 429:
+            queue_status = response.json()
+            keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Try again", callback_data=f"pay:{event_id}")]])
+            await context.bot.send_message(
+                chat_id,
+                f"Many people are booking this event right now. You are number {queue_status['position']} in the queue, "
+                f"estimated wait: {queue_status['estimated_wait']} seconds.",
+                reply_markup=keyboard
+            )
+            return
+
+        if response.status_code == 201:
+            reservation_id = response.json()["reservation_id"]
+
+        elif response.status_code == 409:
+            # A user that abandoned the checkout can get a new link as long as the seat is still held
+            reservation_response = await client.get(f"{CALENDAR_SERVICE_URL}/events/{event_id}/reservations/{tg_id}")
+            if reservation_response.status_code != 200:
+                await context.bot.send_message(chat_id, f"Impossible to reserve a seat: {response.text}.")
+                return
+            reservation = reservation_response.json()
+            if reservation["payment_status"] != "pending":
+                await context.bot.send_message(chat_id, "You already have a reservation for this event.")
+                return
+            reservation_id = reservation["reservation_id"]
+
+        elif response.status_code == 404:
+            await context.bot.send_message(chat_id, f"Impossible to reserve a seat: {response.text}.")
+            return
+
+        else:
+            await context.bot.send_message(chat_id, f"Failed to reserve a seat. Please try later (HTTP code: {response.status_code})")
+            return
+
+        response = await client.get(f"{CALENDAR_SERVICE_URL}/events/{event_id}")
+        if response.status_code != 200:
+            # No order can be created without the title and the price: the seat is given back at once
+            await client.delete(f"{CALENDAR_SERVICE_URL}/events/{event_id}/reservations/{tg_id}")
+            await context.bot.send_message(chat_id, f"Failed to start the payment, your seat was released. Please try later (HTTP code: {response.status_code})")
+            return
+        event = response.json()[0]
+
+        # The PayPal client is synchronous: run it in a thread so that other users are not blocked
+        order_id, link_to_be_returned = await asyncio.to_thread(create_order, event["title"], event["cost"])
+        response = await client.put(f"{CALENDAR_SERVICE_URL}/reservations/{reservation_id}/order", json={"paypal_order_id": order_id, "event_id": event_id})
+        if response.status_code != 200:
+            # Without its order the payment could not be matched to the reservation: no payment link
+            if response.status_code == 404:
+                await context.bot.send_message(chat_id, "Your seat hold has expired. Please book again.")
+            else:
+                await context.bot.send_message(chat_id, f"Failed to start the payment. Please try later (HTTP code: {response.status_code})")
+            return
+
+    keyboard = [[InlineKeyboardButton("🔗 Complete the payment", url=link_to_be_returned)]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    #print("RETURNED LINK: "+linkToBeReturned)
     await context.bot.send_message(
         chat_id=chat_id,
-        text="Please click here to complete the payment:",
+        text=f"Your seat is held for {HOLD_TTL_MINUTES} minutes. Please click here to complete the payment:",
         reply_markup=reply_markup,
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from psycopg2.extras import execute_values
+from telegram.ext import BasePersistence, PersistenceInput
+
+from PostgreSQL_DB.setup_tables import connect_db
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# How often the Application hands the changed user_data/conversations to the persistence (then written in one batch)
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get("PERSISTENCE_FLUSH_INTERVAL", 5))
+# Users whose user_data stays in memory; the idle ones beyond this limit are evicted and reloaded on their next update
+MAX_CACHED_USERS = int(os.environ.get("PERSISTENCE_MAX_CACHED_USERS", 10000))
+
+UPSERT_USER_DATA_QUERY = """
+    INSERT INTO bot_user_data (bot, user_id, data) VALUES %s
+    ON CONFLICT (bot, user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW();
+"""
+UPSERT_CONVERSATIONS_QUERY = """
+    INSERT INTO bot_conversations (bot, name, key, state) VALUES %s
+    ON CONFLICT (bot, name, key) DO UPDATE SET state = EXCLUDED.state, updated_at = NOW();
+"""
+
+class PostgresPersistence(BasePersistence):
+    """
+    Stores the states of the persistent ConversationHandlers and the user_data in PostgreSQL, so that
+    half-finished conversations survive a restart and can be continued by another instance of the bot.
+
+    * Writes are coalesced: the changed keys are kept in memory (last value wins) and written in one
+      transaction with batched upserts, at most every PERSISTENCE_FLUSH_INTERVAL seconds.
+    * user_data is loaded lazily, the first time an update of the user is handled, and the users idle
+      for a while are evicted from memory beyond MAX_CACHED_USERS.
+    * Conversation states (only the conversations in progress are stored) are loaded once, at startup: the
+      Application asks for them only when it is initialized. A conversation started or moved on by another
+      instance afterwards is not seen by this one until it restarts: route the updates of a chat to one instance.
+    * Every bot has its own rows: `name` (e.g. the service name of the bot) is part of the key of both tables.
+    Values are pickled, like PicklePersistence does: user_data contains dates and other Python objects.
+    """
+
+    def __init__(self, name, flush_interval=PERSISTENCE_FLUSH_INTERVAL, max_cached_users=MAX_CACHED_USERS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval,
+        )
+        self.name = name
+        self.max_cached_users = max_cached_users
+        self.conn = None
+        self.db_lock = threading.Lock() # The connection is used by one thread at a time
+        self.write_lock = asyncio.Lock()
+        self.flush_task = None
+        self.dirty_user_data = {} # user_id -> pickled data, or None to delete it
+        self.dirty_conversations = {} # (name, key) -> pickled state, or None to delete it
+        self.loaded_users = OrderedDict() # user_id -> (user_data dict of the Application, last access), LRU order
+        self.writes = 0
+        self.flushes = 0
+
+    # ---- DATABASE ----
+    def get_connection(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = connect_db()
+        return self.conn
+
+    def fetch_all(self, query, params):
+        with self.db_lock:
+            conn = self.get_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute(query, params)
+                rows = cur.fetchall()
+                cur.close()
+                return rows
+            finally:
+                conn.rollback() # Ends the read-only transaction
+
+    def write_batch(self, user_data, conversations):
+        with self.db_lock:
+            self.write_batch_locked(user_data, conversations)
+
+    def write_batch_locked(self, user_data, conversations):
+        conn = self.get_connection()
+        try:
+            cur = conn.cursor()
+            upserts = [(self.name, user_id, data) for user_id, data in user_data.items() if data is not None]
+            deletes = [user_id for user_id, data in user_data.items() if data is None]
+            if upserts:
+                execute_values(cur, UPSERT_USER_DATA_QUERY, upserts)
+            if deletes:
+                cur.execute("DELETE FROM bot_user_data WHERE bot = %s AND user_id = ANY(%s);", (self.name, deletes))
+
+            upserts = [(self.name, name, key, state) for (name, key), state in conversations.items() if state is not None]
+            deletes = [(self.name, name, key) for (name, key), state in conversations.items() if state is None]
+            if upserts:
+                execute_values(cur, UPSERT_CONVERSATIONS_QUERY, upserts)
+            if deletes:
+                execute_values(cur, "DELETE FROM bot_conversations WHERE (bot, name, key) IN (VALUES %s);", deletes)
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # ---- COALESCED WRITES ----
+    def schedule_flush(self):
+        # The Application calls update_* for all the changed keys at once: a short delay gathers them in one batch
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(0.1)
+        try:
+            await self.write_dirty()
+        except Exception as e:
+            print(f"Persistence write failed, retrying at the next flush: {e}")
+
+    async def write_dirty(self):
+        async with self.write_lock:
+            if not self.dirty_user_data and not self.dirty_conversations:
+                return
+            user_data, self.dirty_user_data = self.dirty_user_data, {}
+            conversations, self.dirty_conversations = self.dirty_conversations, {}
+            try:
+                await asyncio.to_thread(self.write_batch, user_data, conversations)
+            except Exception:
+                # Keeps the values for the next flush, unless they were changed again in the meantime
+                self.dirty_user_data = {**user_data, **self.dirty_user_data}
+                self.dirty_conversations = {**conversations, **self.dirty_conversations}
+                raise
+            self.writes += len(user_data) + len(conversations)
+            self.flushes += 1
+        self.evict_idle_users()
+
+    async def flush(self) -> None:
+        """Called by the Application when it stops: writes everything still pending."""
+        await self.write_dirty()
+        if self.conn is not None:
+            self.conn.close()
+
+    # ---- USER DATA (lazy) ----
+    async def get_user_data(self):
+        return {} # Nothing is loaded at startup: see refresh_user_data
+
+    async def refresh_user_data(self, user_id, user_data):
+        """Called before every handler callback: loads the stored user_data the first time the user is seen."""
+        if user_id in self.loaded_users:
+            self.loaded_users.move_to_end(user_id)
+        elif user_id in self.dirty_user_data:
+            pass # A write of the user is pending: the Application already has the current values
+        else:
+            rows = await asyncio.to_thread(self.fetch_all, "SELECT data FROM bot_user_data WHERE bot = %s AND user_id = %s;", (self.name, user_id))
+            if rows:
+                for key, value in pickle.loads(rows[0][0]).items():
+                    user_data.setdefault(key, value)
+        self.loaded_users[user_id] = (user_data, time.monotonic())
+
+    async def update_user_data(self, user_id, data):
+        self.dirty_user_data[user_id] = pickle.dumps(data) if data else None # An empty user_data is not stored
+        self.schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self.dirty_user_data[user_id] = None
+        self.loaded_users.pop(user_id, None)
+        self.schedule_flush()
+
+    def evict_idle_users(self):
+        # A user accessed recently may have changes not yet handed over by the Application: only the users idle
+        # for two persistence intervals, with nothing pending, are evicted (their user_data is emptied in place)
+        idle_since = time.monotonic() - 2 * self.update_interval
+        while len(self.loaded_users) > self.max_cached_users:
+            user_id, (user_data, last_access) = next(iter(self.loaded_users.items()))
+            if last_access > idle_since or user_id in self.dirty_user_data:
+                break
+            del self.loaded_users[user_id]
+            user_data.clear()
+
+    # ---- CONVERSATIONS ----
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(self.fetch_all, "SELECT key, state FROM bot_conversations WHERE bot = %s AND name = %s;", (self.name, name))
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        # new_state is None when the conversation ends: its row is deleted
+        self.dirty_conversations[(name, json.dumps(list(key)))] = pickle.dumps(new_state) if new_state is not None else None
+        self.schedule_flush()
+
+    # ---- NOT STORED (see store_data) ----
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from Monitoring.profiler import PROFILE_MAX_SECONDS, format_collapsed, sample_stacks, top_functions
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+DEFAULT_PROFILE_SECONDS = 10
+# Telegram user ids allowed to profile the bot (comma separated): the stacks show the code and data being handled.
+# Nobody if not set: IsUserAuthorized does not check the role yet.
+PROFILE_ADMIN_IDS = {int(user_id) for user_id in os.environ.get("PROFILE_ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Command usage: /profile [seconds]
+# Samples the stacks of this bot process while it keeps handling the other chats, then sends the collapsed stacks
+# (open them with speedscope.app or flamegraph.pl) and the functions where the event loop spends its time.
+# In webhook mode only the worker process handling this chat is profiled.
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user is None or update.effective_user.id not in PROFILE_ADMIN_IDS:
+        await update.message.reply_text("You are not authorized to perform this action.")
+        return
+
+    try:
+        seconds = float(context.args[0]) if context.args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text(f"Usage: /profile [seconds] (at most {PROFILE_MAX_SECONDS:g})")
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+
+    await update.message.reply_text(f"Profiling the bot (process {os.getpid()}) for {seconds:g} seconds...")
+    try:
+        # In a thread: the event loop being profiled keeps running
+        stacks, samples = await asyncio.to_thread(sample_stacks, seconds)
+    except RuntimeError as e:
+        await update.message.reply_text(f"Profile not started: {e}.")
+        return
+
+    summary = "\n".join(top_functions(stacks, samples, limit=8, thread="MainThread"))
+    await update.message.reply_document(
+        document=format_collapsed(stacks).encode("utf-8"),
+        filename=f"bot-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded",
+        caption=f"{samples} samples. Event loop thread, innermost functions:\n{summary}"[:1024], # Telegram limit of captions
+    )
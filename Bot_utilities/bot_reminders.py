@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from psycopg2.extras import execute_values
+
+from Bot_utilities.bot_broadcast import get_broadcast_sender
+from PostgreSQL_DB.setup_tables import connect_db
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Reminders sent before the start of every paid reservation: kind -> how long before the start
+REMINDER_OFFSETS = {
+    "24h": timedelta(hours=24),
+    "1h": timedelta(hours=1),
+}
+REMINDER_WINDOW_HOURS = float(os.environ.get("REMINDER_WINDOW_HOURS", 6))
+REMINDER_REFRESH_SECONDS = float(os.environ.get("REMINDER_REFRESH_SECONDS", 60))
+
+# Reminders to fire within the window (or already due), excluding the ones already sent.
+# The range on start_date_time keeps the scan on the upcoming events only, the same range on event_start keeps it
+# on the partitions of the reservations of the next months.
+UPCOMING_REMINDERS_QUERY = """
+    SELECT r.reservation_id, k.kind, r.user_id, e.event_id, e.title, e.start_date_time,
+           e.start_date_time - k.time_before AS fire_at
+    FROM reservations r
+    JOIN events e ON e.event_id = r.event_id
+    CROSS JOIN unnest(%(kinds)s::varchar[], %(offsets)s::interval[]) AS k(kind, time_before)
+    WHERE r.payment_status = 'paid'
+      AND e.start_date_time > NOW() AND e.start_date_time <= NOW() + %(horizon)s
+      AND r.event_start > NOW() AND r.event_start <= NOW() + %(horizon)s
+      AND e.start_date_time - k.time_before <= NOW() + %(window)s
+      AND (%(paid_since)s::timestamptz IS NULL OR r.paid_at > %(paid_since)s::timestamptz)
+      AND NOT EXISTS (SELECT 1 FROM reminders_sent s WHERE s.reservation_id = r.reservation_id AND s.kind = k.kind);
+"""
+
+# Marks the reminders as sent before sending them: only the rows returned (not already claimed, reservation still
+# paid, event not started) are sent, so a restart or a second bot process never sends a reminder twice
+CLAIM_REMINDERS_QUERY = """
+    INSERT INTO reminders_sent (reservation_id, kind)
+    SELECT v.reservation_id, v.kind FROM (VALUES %s) AS v(reservation_id, kind)
+    JOIN reservations r ON r.reservation_id = v.reservation_id AND r.payment_status = 'paid' AND r.event_start > NOW()
+    JOIN events e ON e.event_id = r.event_id AND e.start_date_time > NOW()
+    ON CONFLICT DO NOTHING
+    RETURNING reservation_id, kind;
+"""
+
+def format_time_left(delta):
+    # The actual time left, not the kind of reminder: a reservation paid 3 hours before the start gets "3h", not "24h"
+    minutes = max(int(delta.total_seconds() // 60), 1)
+    return f"{minutes // 60}h {minutes % 60:02d}m" if minutes >= 60 else f"{minutes} minutes"
+
+class ReminderScheduler:
+    """
+    Keeps in a heap, ordered by firing time, only the reminders of the next REMINDER_WINDOW_HOURS.
+    The window is reloaded when half of it has elapsed; in between only the reservations paid since the
+    previous refresh are added (index range scan on paid_at), instead of polling all the reservations for due reminders.
+    """
+
+    def __init__(self, window_hours=REMINDER_WINDOW_HOURS, refresh_seconds=REMINDER_REFRESH_SECONDS):
+        self.window = timedelta(hours=window_hours)
+        self.refresh_seconds = refresh_seconds
+        self.heap = [] # (fire_at, reservation_id, kind, user_id, event_id, title, start)
+        self.scheduled = set() # (reservation_id, kind) present in the heap
+        self.paid_watermark = None # DB time of the last refresh
+        self.next_full_load = 0.0
+        self.sent = 0
+
+    def load(self, paid_since=None):
+        """Adds the upcoming reminders to the heap (all of them, or those of the reservations paid after `paid_since`)."""
+        conn = connect_db()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT NOW();") # Database clock: same value for the whole transaction
+            db_now = cur.fetchone()[0]
+            cur.execute(UPCOMING_REMINDERS_QUERY, {
+                "kinds": list(REMINDER_OFFSETS),
+                "offsets": list(REMINDER_OFFSETS.values()),
+                "horizon": self.window + max(REMINDER_OFFSETS.values()),
+                "window": self.window,
+                "paid_since": paid_since,
+            })
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+
+        for reservation_id, kind, user_id, event_id, title, start, fire_at in rows:
+            if (reservation_id, kind) not in self.scheduled:
+                self.scheduled.add((reservation_id, kind))
+                heapq.heappush(self.heap, (fire_at, reservation_id, kind, user_id, event_id, title, start))
+        self.paid_watermark = db_now
+        return len(rows)
+
+    def refresh(self):
+        if time.monotonic() >= self.next_full_load:
+            self.load()
+            self.next_full_load = time.monotonic() + self.window.total_seconds() / 2
+        else:
+            # Overlap with the previous refresh: a payment committed late with an earlier paid_at is not missed
+            self.load(self.paid_watermark - timedelta(seconds=self.refresh_seconds))
+
+    def pop_due(self, now):
+        """Removes from the heap the reminders due at `now`; if several reminders of a reservation are due, keeps the latest."""
+        due = {}
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            self.scheduled.discard((entry[1], entry[2]))
+            due.setdefault(entry[1], []).append(entry)
+        # After a downtime both the 24h and the 1h reminders can be due: only the closest to the start is sent
+        return [max(entries) for entries in due.values()], [e for entries in due.values() for e in entries]
+
+    def claim(self, entries):
+        conn = connect_db()
+        try:
+            cur = conn.cursor()
+            claimed = execute_values(cur, CLAIM_REMINDERS_QUERY, [(e[1], e[2]) for e in entries], fetch=True)
+            conn.commit()
+            return set(claimed)
+        finally:
+            conn.close()
+
+    async def fire(self, bot, now):
+        to_send, to_claim = self.pop_due(now)
+        if not to_claim:
+            return
+        claimed = await asyncio.to_thread(self.claim, to_claim)
+        sender = get_broadcast_sender() # Same rate limits as the broadcasts
+        to_send = [e for e in to_send if (e[1], e[2]) in claimed]
+        results = await asyncio.gather(*(
+            sender.send(bot, user_id, f"⏰ Reminder: {title} starts in {format_time_left(start - now)} ({start.astimezone():%d/%m/%Y %H:%M}).")
+            for fire_at, reservation_id, kind, user_id, event_id, title, start in to_send
+        ))
+        self.sent += sum(results)
+
+    async def run(self, bot):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+                refresh_at = time.monotonic() + self.refresh_seconds
+                # Fires the reminders as they become due until the next refresh
+                while True:
+                    now = datetime.now(timezone.utc)
+                    await self.fire(bot, now)
+                    until_next = (self.heap[0][0] - now).total_seconds() if self.heap else self.refresh_seconds
+                    until_refresh = refresh_at - time.monotonic()
+                    if until_refresh <= 0:
+                        break
+                    await asyncio.sleep(max(0.0, min(until_next, until_refresh)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Reminder scheduler error: {e}")
+                await asyncio.sleep(self.refresh_seconds)
+
+reminder_scheduler = None
+
+async def start_reminder_scheduler(app):
+    """Executed at bot startup: starts the reminder scheduler as a background task of the bot."""
+    global reminder_scheduler
+    reminder_scheduler = ReminderScheduler()
+    app.create_task(reminder_scheduler.run(app.bot))
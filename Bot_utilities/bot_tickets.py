@@ -0,0 +1,129 @@
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+import httpx
+import qrcode
+from telegram import Update
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+from Bot_utilities.bot_auth import *
+from Bot_utilities.bot_broadcast import get_broadcast_sender
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Worker processes rendering the QR images: rendering is CPU-bound and must not block the event loop
+ticket_renderer = None
+
+def get_ticket_renderer():
+    global ticket_renderer
+    if ticket_renderer is None:
+        ticket_renderer = ProcessPoolExecutor(max_workers=int(os.environ.get("TICKET_RENDER_WORKERS", os.cpu_count() or 2)))
+    return ticket_renderer
+
+def render_ticket_png(ticket):
+    """Renders the QR code of a ticket as PNG bytes (executed in a worker process)."""
+    image = qrcode.make(ticket, box_size=8, border=2)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+async def send_ticket(context: ContextTypes.DEFAULT_TYPE, client, chat_id, event_id, ticket_info, png=None, sender=None):
+    """
+    Sends the ticket image to the chat. Once uploaded, the image is resent through its Telegram file_id
+    (stored by the Calendar service), so it is rendered and uploaded only once per reservation.
+    In bulk deliveries the photos go through `sender` (a RateLimitedSender) to respect the Telegram limits.
+    """
+    CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+    caption = f"🎟 Your ticket for event {event_id}. Show this QR code at the entrance."
+
+    async def send_photo(photo):
+        if sender is None:
+            return await context.bot.send_photo(chat_id, photo, caption=caption)
+        return await sender.call(chat_id, lambda: context.bot.send_photo(chat_id, photo, caption=caption))
+
+    if ticket_info["ticket_file_id"]:
+        try:
+            await send_photo(ticket_info["ticket_file_id"])
+            return
+        except BadRequest:
+            pass # The file is not available anymore (e.g. the bot token changed): upload it again
+
+    if png is None:
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(get_ticket_renderer(), render_ticket_png, ticket_info["ticket"])
+
+    message = await send_photo(png)
+    file_id = message.photo[-1].file_id # Largest size of the uploaded photo
+    await client.put(f"{CALENDAR_SERVICE_URL}/reservations/{ticket_info['reservation_id']}/ticket_file_id", json={"file_id": file_id, "event_id": event_id})
+
+# Command usage: /ticket <event_id>
+async def ticket_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /ticket <event_id>")
+        return
+
+    event_id = int(context.args[0])
+    tg_id = update.message.from_user.id
+    chat_id = update.message.chat_id
+
+    async with httpx.AsyncClient() as client:
+        load_dotenv()  # Loads variables from .env into environment
+        CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+        response = await client.get(f"{CALENDAR_SERVICE_URL}/events/{event_id}/reservations/{tg_id}/ticket")
+
+        if response.status_code == 200:
+            await send_ticket(context, client, chat_id, event_id, response.json())
+        elif response.status_code == 404:
+            await update.message.reply_text("You have no reservation for this event.")
+        elif response.status_code == 409:
+            await update.message.reply_text("Your reservation is not paid yet: use /pay to complete it.")
+        else:
+            await update.message.reply_text(f"Failed to fetch the ticket. Please try later (HTTP code: {response.status_code})")
+
+# Command usage: /closeSales <event_id>
+# Renders in bulk the tickets of all the paid reservations of the event and delivers them to their owners
+async def close_sales_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await IsUserAuthorized(update, context):
+        await update.message.reply_text("You are not authorized to perform this action.")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /closeSales <event_id>")
+        return
+
+    event_id = int(context.args[0])
+    async with httpx.AsyncClient(timeout=60) as client:
+        load_dotenv()  # Loads variables from .env into environment
+        CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+        response = await client.get(f"{CALENDAR_SERVICE_URL}/events/{event_id}/tickets")
+        if response.status_code != 200:
+            await update.message.reply_text(f"Failed to fetch the tickets (HTTP code: {response.status_code})")
+            return
+        tickets = response.json()
+
+        # Render all the images that were never uploaded in one pass over the worker pool
+        to_render = [t for t in tickets if not t["ticket_file_id"]]
+        loop = asyncio.get_running_loop()
+        pngs = await loop.run_in_executor(
+            None, lambda: list(get_ticket_renderer().map(render_ticket_png, [t["ticket"] for t in to_render], chunksize=16))
+        )
+        rendered = {t["reservation_id"]: png for t, png in zip(to_render, pngs)}
+
+        delivered = 0
+        sender = get_broadcast_sender() # Same rate limits as the broadcasts
+        for ticket_info in tickets:
+            try:
+                # The Telegram id of the user is also the id of the private chat with the bot
+                await send_ticket(context, client, ticket_info["user_id"], event_id, ticket_info,
+                                  rendered.get(ticket_info["reservation_id"]), sender)
+                delivered += 1
+            except Exception as e:
+                print(f"Impossible to deliver the ticket of reservation {ticket_info['reservation_id']}: {e}")
+
+    await update.message.reply_text(
+        f"Sales closed: {delivered}/{len(tickets)} tickets delivered ({len(to_render)} images rendered)."
+    )
@@ -4,6 +4,7 @@ import sys
 from dotenv import load_dotenv
 import httpx
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CallbackQueryHandler
 import psycopg2
 from Bot_utilities.bot_auth import *
@@ -11,6 +12,100 @@ from Bot_utilities.bot_auth import *
 sys.dont_write_bytecode = True  # Prevent .pyc files generation
 
 PAGE_SIZE = 3 # Number of events to fetch at every request
+POSTERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "posters")
+
+# ---- POSTER DELIVERY ----
+# Every poster is uploaded to Telegram only once: the returned file_id is kept here and stored against the event
+# by the Calendar service, then every "See more" resends the poster by file_id (no download, no upload).
+poster_cache = {} # event_id -> (poster_image_url, file_id)
+
+def poster_source(poster_image_url):
+    """Returns what has to be uploaded for a poster: the local file in posters/ if present, otherwise a direct URL."""
+    local_path = os.path.join(POSTERS_DIR, os.path.basename(poster_image_url))
+    if os.path.isfile(local_path):
+        return open(local_path, "rb")
+    # GitHub "blob" pages are HTML: Telegram needs the raw image
+    if poster_image_url.startswith("https://github.com/") and "/blob/" in poster_image_url:
+        return poster_image_url.replace("https://github.com/", "https://raw.githubusercontent.com/", 1).replace("/blob/", "/", 1)
+    return poster_image_url
+
+def cached_poster_file_id(event):
+    """Returns the file_id of the current poster of the event, or None if it was never uploaded or the poster changed."""
+    url = event.get("poster_image_url")
+    cached = poster_cache.get(event["event_id"])
+    if cached and cached[0] == url:
+        return cached[1]
+    if event.get("poster_file_id") and event.get("poster_file_source") == url:
+        poster_cache[event["event_id"]] = (url, event["poster_file_id"])
+        return event["poster_file_id"]
+    return None
+
+async def send_poster(bot, chat_id, event, client):
+    """Sends the poster of the event (if any), uploading it only if there is no valid file_id. Returns the message."""
+    url = event.get("poster_image_url")
+    if not url:
+        return None
+
+    file_id = cached_poster_file_id(event)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id, file_id)
+        except BadRequest:
+            poster_cache.pop(event["event_id"], None) # The file is not available anymore: upload it again
+
+    CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+    if url.startswith("/posters/"):
+        # Posters of the Calendar service store (stored as a path of the service) are not reachable by Telegram:
+        # upload the medium variant ourselves
+        response = await client.get(f"{CALENDAR_SERVICE_URL}{url}", params={"variant": "medium"})
+        response.raise_for_status()
+        source = response.content
+    else:
+        source = poster_source(url)
+    try:
+        message = await bot.send_photo(chat_id, source)
+    finally:
+        if hasattr(source, "close"):
+            source.close()
+
+    file_id = message.photo[-1].file_id # Largest size of the uploaded photo
+    poster_cache[event["event_id"]] = (url, file_id)
+    await client.put(f"{CALENDAR_SERVICE_URL}/events/{event['event_id']}/poster_file_id", json={"file_id": file_id, "source": url})
+    return message
+
+async def warm_poster_cache(app):
+    """
+    Executed at bot startup: uploads the posters of the upcoming events that have no valid file_id yet
+    to POSTER_CACHE_CHAT_ID (e.g. a private channel of the admins), so that the first user does not wait for the upload.
+    """
+    load_dotenv()  # Loads variables from .env into environment
+    CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+    POSTER_CACHE_CHAT_ID = os.environ.get("POSTER_CACHE_CHAT_ID")
+    MAX_PAGES = int(os.environ.get("POSTER_WARMUP_PAGES", 10))
+
+    warmed = 0
+    try:
+        async with httpx.AsyncClient() as client:
+            for page in range(MAX_PAGES):
+                response = await client.get(f"{CALENDAR_SERVICE_URL}/events", params={"offset": page * PAGE_SIZE})
+                if response.status_code != 200:
+                    break
+                events_json = response.json()
+
+                for event in events_json:
+                    if not event.get("poster_image_url") or cached_poster_file_id(event):
+                        continue
+                    if POSTER_CACHE_CHAT_ID:
+                        message = await send_poster(app.bot, POSTER_CACHE_CHAT_ID, event, client)
+                        await message.delete()
+                        warmed += 1
+
+                if len(events_json) < PAGE_SIZE:
+                    break
+    except Exception as e:
+        print(f"Poster cache warm-up interrupted: {e}")
+
+    print(f"Poster cache ready: {len(poster_cache)} posters cached ({warmed} uploaded at startup).")
 
 from datetime import datetime
 
@@ -114,9 +209,16 @@ async def see_more_callback(update, context):
             events_json = response.json()  
             # There should be only one event in the response
             for event in events_json:
+                try:
+                    await send_poster(context.bot, chat_id, event, client)
+                except Exception as e:
+                    # A poster that cannot be downloaded or sent must not hide the event and its Book button
+                    print(f"Impossible to send the poster of event {event['event_id']}: {e}")
                 formatted_text = format_event(event)
-                formatted_text += event['description']
-                await context.bot.send_message(chat_id, formatted_text, parse_mode="Markdown")
+                formatted_text += f"Leaders: {event['leaders_count']} - Followers: {event['followers_count']}\n"
+                formatted_text += event['description'] or ""
+                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Book", callback_data=f"pay:{event['event_id']}")]])
+                await context.bot.send_message(chat_id, formatted_text, parse_mode="Markdown", reply_markup=keyboard)
 
         elif response.status_code == 404:
             await context.bot.send_message(chat_id, "Impossible to find the requested event.")
@@ -0,0 +1,68 @@
+import math
+import os
+import sys
+from dotenv import load_dotenv
+import httpx
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from Bot_utilities.bot_auth import *
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Command usage: /openQueue <event_id> [admitted users per second]
+async def open_queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await IsUserAuthorized(update, context):
+        await update.message.reply_text("You are not authorized to perform this action.")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /openQueue <event_id> [admitted users per second]")
+        return
+
+    event_id = int(context.args[0])
+    payload = {}
+    if len(context.args) > 1:
+        try:
+            rate = float(context.args[1])
+        except ValueError:
+            rate = 0.0 # Not a number: answered with the usage below
+        if not math.isfinite(rate) or rate <= 0:
+            await update.message.reply_text("Usage: /openQueue <event_id> [admitted users per second]")
+            return
+        payload["rate"] = rate
+
+    async with httpx.AsyncClient() as client:
+        load_dotenv()  # Loads variables from .env into environment
+        CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+        headers = {"X-Admin-Token": os.environ.get("ADMIN_API_TOKEN", "")}
+        response = await client.put(f"{CALENDAR_SERVICE_URL}/events/{event_id}/waiting_room", json=payload, headers=headers)
+
+    if response.status_code == 200:
+        room = response.json()
+        await update.message.reply_text(
+            f"Waiting room open: {room['rate']} users admitted per second ({room['queued']} in the queue)."
+        )
+    else:
+        await update.message.reply_text(f"Failed to open the waiting room (HTTP code: {response.status_code})")
+
+# Command usage: /closeQueue <event_id>
+async def close_queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await IsUserAuthorized(update, context):
+        await update.message.reply_text("You are not authorized to perform this action.")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /closeQueue <event_id>")
+        return
+
+    async with httpx.AsyncClient() as client:
+        load_dotenv()  # Loads variables from .env into environment
+        CALENDAR_SERVICE_URL = os.environ.get("CALENDAR_SERVICE_URL")
+        headers = {"X-Admin-Token": os.environ.get("ADMIN_API_TOKEN", "")}
+        response = await client.delete(f"{CALENDAR_SERVICE_URL}/events/{context.args[0]}/waiting_room", headers=headers)
+
+    if response.status_code == 200:
+        await update.message.reply_text("Waiting room closed: everybody can book directly.")
+    else:
+        await update.message.reply_text(f"Failed to close the waiting room (HTTP code: {response.status_code})")
@@ -0,0 +1,159 @@
+import asyncio
+import hmac
+import json
+import multiprocessing
+import os
+import queue
+import secrets
+import sys
+from telegram import Update
+
+from Monitoring.metrics import counter, start_metrics_server
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# ---- WEBHOOK MODE ----
+# Telegram POSTs every update to a local ASGI endpoint (exposed through the tunnel, like the payment service).
+# The endpoint only checks the secret token and forwards the raw update to one of the worker processes,
+# chosen from the chat id: all the updates of a chat are handled by the same worker, in arrival order,
+# so the conversations stay consistent while the chats are spread over all the CPU cores.
+WEBHOOK_PATH = "/telegram/webhook"
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+MAX_UPDATE_BYTES = 1024 * 1024
+WORKER_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 10000))
+
+# Fields of an update that carry a message (whose chat is the shard key)
+MESSAGE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "business_message", "edited_business_message")
+
+def shard_key(data):
+    """Returns the id used to choose the worker of an update: its chat, or its user if it has no chat."""
+    for field in MESSAGE_FIELDS:
+        if field in data:
+            return data[field]["chat"]["id"]
+    callback_query = data.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message")
+        return message["chat"]["id"] if message else callback_query["from"]["id"]
+    for value in data.values():
+        if isinstance(value, dict):
+            if "chat" in value:
+                return value["chat"]["id"]
+            if "from" in value:
+                return value["from"]["id"]
+            if "user" in value:
+                return value["user"]["id"]
+    return data.get("update_id", 0)
+
+class WebhookApp:
+    """Minimal ASGI application receiving the updates and dispatching them to the worker queues."""
+
+    def __init__(self, queues, secret, path=WEBHOOK_PATH):
+        self.queues = queues
+        self.secret = secret.encode("utf-8")
+        self.path = path
+        self.received = 0
+        self.rejected = 0
+        counter("webhook_updates_received_total", "Updates accepted and dispatched to a worker.").set_function(lambda: self.received)
+        counter("webhook_updates_rejected_total", "Requests refused because of a wrong secret token.").set_function(lambda: self.rejected)
+
+    async def respond(self, send, status, body=b""):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["path"] != self.path or scope["method"] != "POST":
+            return await self.respond(send, 404, b"Not found")
+
+        token = dict(scope["headers"]).get(SECRET_HEADER, b"")
+        if not hmac.compare_digest(token, self.secret):
+            self.rejected += 1
+            return await self.respond(send, 403, b"Forbidden")
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) > MAX_UPDATE_BYTES:
+                return await self.respond(send, 413, b"Update too large")
+
+        try:
+            key = shard_key(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            return await self.respond(send, 400, b"Malformed update")
+
+        try:
+            self.queues[key % len(self.queues)].put_nowait(body)
+        except queue.Full:
+            # Telegram delivers the update again later
+            return await self.respond(send, 503, b"Busy")
+        self.received += 1
+        await self.respond(send, 200)
+
+def worker_main(build_application, updates, run_post_init, metrics_port=None):
+    asyncio.run(serve_updates(build_application, updates, run_post_init, metrics_port))
+
+async def serve_updates(build_application, updates, run_post_init, metrics_port=None):
+    """Runs a bot Application fed by the updates of its queue until it receives None."""
+    app = build_application()
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    loop = asyncio.get_running_loop()
+    async with app: # initialize() / shutdown()
+        # Startup jobs (poster warm-up, reminders) run only once, in the first worker
+        if run_post_init and app.post_init:
+            await app.post_init(app)
+        await app.start()
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(json.loads(data), app.bot))
+        await app.stop() # Handles the pending updates before returning
+
+def run_webhook(build_application, workers=None, host="0.0.0.0", port=8080, webhook_url=None, secret=None, path=WEBHOOK_PATH,
+                metrics_port=None):
+    """
+    Serves the bot in webhook mode: `build_application` (a module-level function, executed in every worker)
+    returns the Application with its handlers. If `webhook_url` is given, the webhook is registered on Telegram.
+    With `metrics_port`, the dispatcher exposes /metrics on that port and worker i on metrics_port + 1 + i.
+    """
+    try:
+        import uvicorn # Optional dependency, needed only in webhook mode
+    except ImportError:
+        sys.exit("Webhook mode requires uvicorn: pip install uvicorn")
+
+    workers = workers or os.cpu_count() or 1
+    secret = secret or secrets.token_urlsafe(32)
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(workers)]
+    processes = [
+        context.Process(target=worker_main, args=(build_application, queues[i], i == 0, metrics_port and metrics_port + 1 + i),
+                        name=f"bot-worker-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    if webhook_url:
+        async def register():
+            bot = build_application().bot
+            async with bot:
+                await bot.set_webhook(url=webhook_url.rstrip("/") + path, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+        asyncio.run(register())
+        print(f"Webhook registered: {webhook_url.rstrip('/') + path} ({workers} workers)")
+
+    webhook_app = WebhookApp(queues, secret, path)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    try:
+        uvicorn.run(webhook_app, host=host, port=port, lifespan="off", log_level="warning")
+    finally:
+        for updates in queues:
+            updates.put(None)
+        for process in processes:
+            process.join(timeout=30)
@@ -1,11 +1,46 @@
+import hmac
 import json
+import math
 import os
+import sys
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from flask import Flask, request
+from flask import Flask, Response, request, send_file
 import psycopg2
+from psycopg2.extras import execute_values
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Calendar.reservation_engine import *
+from Calendar.hold_sweeper import hold_metrics, start_sweeper_thread
+from Calendar.waiting_room import WaitingRooms
+from Calendar.tickets import InvalidTicket, get_secret, ticket_for_reservation, verify_ticket
+from Calendar.door_bundle import build_bundle
+from Calendar.poster_store import InvalidPoster, MAX_POSTER_BYTES, VARIANTS, ingest_poster, poster_path, variant_worker
+from PostgreSQL_DB.partition_maintenance import start_partition_thread
+from Monitoring.db_metrics import InstrumentedCursor
+from Monitoring.flask_metrics import instrument_flask
+from Monitoring.http_metrics import install_http_metrics
+from Monitoring.metrics import gauge
 
 app = Flask(__name__)
 
+# Admission queues of the high-demand events (kept in memory, saved periodically to the snapshot file)
+waiting_rooms = WaitingRooms(os.environ.get("WAITING_ROOM_SNAPSHOT", "waiting_rooms.json"))
+
+# ---- METRICS ----
+# Route latencies, DB and outbound HTTP timings on /metrics; the gauges below are computed only when scraped
+instrument_flask(app, "calendar")
+install_http_metrics()
+gauge("waiting_rooms_open", "Waiting rooms of high-demand events currently open.").set_function(lambda: len(waiting_rooms.rooms))
+gauge("waiting_room_users", "Users in the waiting rooms not yet admitted.").set_function(
+    lambda: sum(len(room.queue) - int(room.admitted) for room in list(waiting_rooms.rooms.values())))
+gauge("holds_outstanding", "Seats held by pending reservations (last sweep).").set_function(lambda: hold_metrics["holds_outstanding"])
+gauge("holds_expired", "Expired holds released by the sweeper since startup.").set_function(lambda: hold_metrics["holds_expired_total"])
+gauge("holds_orders_closed", "Expired holds with a PayPal order paid or released by the sweeper since startup.").set_function(
+    lambda: hold_metrics["orders_closed_total"])
+# Private attribute of ThreadPoolExecutor: the executor exposes no public queue size
+gauge("poster_variants_pending", "Posters waiting for their resized variants.").set_function(lambda: variant_worker._work_queue.qsize())
+
 # This function performs the connection to the database
 def connect_db():
     """Establishes a connection to the PostgreSQL database."""
@@ -15,13 +50,26 @@ def connect_db():
             port=os.getenv("DB_PORT"),
             database=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
+            password=os.getenv("DB_PASSWORD"),
+            cursor_factory=InstrumentedCursor, # Times every query (see Monitoring/db_metrics.py)
         )
         return conn
     except psycopg2.Error as e:
         print(f"DB connection error: {e}")
         return None
 
+# The door devices send DOOR_DEVICE_TOKEN in the X-Door-Token header: nobody else checks tickets in or downloads
+# the bundles. If DOOR_DEVICE_TOKEN is not set the door endpoints refuse every request.
+def door_device_authorized():
+    token = os.environ.get("DOOR_DEVICE_TOKEN")
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Door-Token", ""), token)
+
+# The admin commands of the bot and tools send ADMIN_API_TOKEN in the X-Admin-Token header (waiting rooms, posters).
+# If ADMIN_API_TOKEN is not set the admin endpoints refuse every request.
+def admin_authorized():
+    token = os.environ.get("ADMIN_API_TOKEN")
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
 # Root endpoint to verify service is running
 @app.route("/")
 def root():
@@ -50,6 +98,7 @@ def event_create():
     Capacity = event_data.get("capacity")
     Cost = event_data.get("cost")
     Is_Active = event_data.get("is_active")
+    Max_Role_Imbalance = event_data.get("max_role_imbalance") # Optional: maximum difference between leaders and followers
 
     # Connect to the database
     conn = connect_db()
@@ -60,10 +109,10 @@ def event_create():
     try:
         cur = conn.cursor()
         sql_command = """
-        INSERT INTO events (event_type, title, start_date_time, end_date_time, location, capacity, cost, is_active)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+        INSERT INTO events (event_type, title, start_date_time, end_date_time, location, capacity, remaining_seats, cost, is_active, max_role_imbalance)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
         """
-        parameters = (Event_Type, Title, f"{Start_Date} {Start_Time}", f"{End_Date} {End_Time}", Location, Capacity, Cost, Is_Active)
+        parameters = (Event_Type, Title, f"{Start_Date} {Start_Time}", f"{End_Date} {End_Time}", Location, Capacity, Capacity, Cost, Is_Active, Max_Role_Imbalance)
         cur.execute(sql_command, parameters)
         conn.commit()
  
@@ -92,13 +141,15 @@ def fetch_events():
         cur = conn.cursor()
         if 0==0: # TODO: check if user is authorized
             query =f"""
-                SELECT event_id, event_type, title, start_date_time, end_date_time, location, capacity, cost
+                SELECT event_id, event_type, title, start_date_time, end_date_time, location, capacity, cost,
+                       poster_image_url, poster_file_id, poster_file_source
                 FROM events WHERE start_date_time > NOW()
                 ORDER BY start_date_time ASC LIMIT {PAGE_SIZE} OFFSET {offset}
                 """
         else:
             query = f"""
-                SELECT event_id, event_type, title, start_date_time, end_date_time, location, capacity, cost
+                SELECT event_id, event_type, title, start_date_time, end_date_time, location, capacity, cost,
+                       poster_image_url, poster_file_id, poster_file_source
                 FROM events WHERE start_date_time > NOW() AND is_active = TRUE
                 ORDER BY start_date_time ASC LIMIT {PAGE_SIZE} OFFSET {offset}
                 """
@@ -157,9 +208,575 @@ def fetch_single_event(event_id):
         conn.rollback()
         return "Generic error during DB insertion",500
 
-    
+
+# Endpoint to store the Telegram file_id of the uploaded poster of an event.
+# `source` is the poster_image_url that was uploaded: if the poster has changed in the meantime nothing is stored,
+# and a stored file_id is considered stale as soon as poster_file_source differs from poster_image_url.
+@app.route("/events/<int:event_id>/poster_file_id", methods=['PUT'])
+def store_poster_file_id(event_id):
+    file_data = request.get_json()
+    if not file_data or not file_data.get("file_id") or not file_data.get("source"):
+        return "Missing file_id or source", 400
+
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE events SET poster_file_id = %s, poster_file_source = %s WHERE event_id = %s AND poster_image_url = %s",
+            (file_data["file_id"], file_data["source"], event_id, file_data["source"])
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return "Event not found or poster changed", 409
+        conn.commit()
+        return "Updated", 200
+
+    except Exception as e:
+        conn.rollback()
+        return "Generic error during DB update",500
+
+    finally:
+        conn.close()
+
+# Endpoint to upload a poster (raw JPEG/PNG body). The poster id is the SHA-256 of the content:
+# uploading the same image twice returns the same id and stores nothing new.
+@app.route("/posters", methods=['POST'])
+def upload_poster():
+    if not admin_authorized():
+        return "Forbidden", 403
+    if request.content_length is not None and request.content_length > MAX_POSTER_BYTES:
+        return f"The image exceeds {MAX_POSTER_BYTES} bytes", 413
+    try:
+        poster_id, created = ingest_poster(request.stream) # Streamed to disk, never fully in memory
+    except InvalidPoster as e:
+        return str(e), 400
+    except Exception as e:
+        return "Generic error while storing the poster",500
+
+    data = {"poster_id": poster_id, "url": f"{request.host_url}posters/{poster_id}"}
+    return json.dumps(data), 201 if created else 200
+
+# Endpoint to download a poster, or one of its variants (?variant=thumb|medium).
+# The content of a poster URL never changes, so it can be cached forever; Range requests are supported.
+@app.route("/posters/<poster_id>", methods=['GET'])
+def fetch_poster(poster_id):
+    variant = request.args.get('variant')
+    if variant is not None and variant not in VARIANTS:
+        return f"Unknown variant: choose one of {', '.join(VARIANTS)}", 400
+
+    path = poster_path(poster_id, variant)
+    immutable = path is not None
+    if path is None and variant is not None:
+        path = poster_path(poster_id) # The variant is still being generated: serve the original meanwhile
+    if path is None:
+        return "Poster not found", 404
+
+    etag = f"{poster_id}-{variant}" if variant else poster_id
+    response = send_file(path, conditional=True, etag=etag, max_age=31536000 if immutable else 60)
+    response.cache_control.immutable = immutable
+    return response
+
+# Endpoint to set the poster of an event (a poster uploaded through POST /posters)
+@app.route("/events/<int:event_id>/poster", methods=['PUT'])
+def set_event_poster(event_id):
+    if not admin_authorized():
+        return "Forbidden", 403
+    poster_data = request.get_json()
+    if not poster_data or not poster_data.get("poster_id"):
+        return "Missing poster_id", 400
+    if poster_path(poster_data["poster_id"]) is None:
+        return "Poster not found", 404
+
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        # A new poster invalidates the Telegram file_id of the previous one. The poster is stored as a path of this
+        # service: the clients prefix it with their own CALENDAR_SERVICE_URL (the host seen here may be a proxy)
+        cur.execute(
+            "UPDATE events SET poster_image_url = %s, poster_file_id = NULL, poster_file_source = NULL WHERE event_id = %s",
+            (f"/posters/{poster_data['poster_id']}", event_id)
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return "Event not found", 404
+        conn.commit()
+        return "Updated", 200
+
+    except Exception as e:
+        conn.rollback()
+        return "Generic error during DB update",500
+
+    finally:
+        conn.close()
+
+# Endpoint to reserve a seat of an event
+@app.route("/events/<int:event_id>/reservations", methods=['POST'])
+def reserve_seat(event_id):
+    reservation_data = request.get_json(silent=True)
+    if not isinstance(reservation_data, dict) or "user_id" not in reservation_data:
+        return "Missing user_id", 400
+    user_id = reservation_data["user_id"]
+    # Telegram user id: the waiting room keeps it in a 64-bit array
+    if not isinstance(user_id, int) or isinstance(user_id, bool) or not 0 < user_id < 2**63:
+        return "user_id must be a positive integer", 400
+
+    # High-demand launches: only the users admitted by the waiting room reach the database
+    queue_status = waiting_rooms.check_in(event_id, user_id)
+    if queue_status is not None and not queue_status[0]:
+        _, position, estimated_wait = queue_status
+        data = {"position": position, "estimated_wait": math.ceil(estimated_wait)}
+        return json.dumps(data), 429, {"Retry-After": str(max(1, math.ceil(estimated_wait)))}
+
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        outcome, reservation_id, remaining_seats = book_seat(conn, user_id, event_id)
+    except Exception as e:
+        return "Generic error during the reservation",500
+    finally:
+        conn.close()
+
+    if outcome == EVENT_NOT_FOUND:
+        return "Event not found", 404
+    if outcome == USER_NOT_FOUND:
+        return "User not registered", 404
+    if outcome == ALREADY_RESERVED:
+        return "Seat already reserved", 409
+    if outcome == SOLD_OUT:
+        return "Event sold out", 409
+    if outcome == ROLE_IMBALANCE:
+        return "Too many participants with your role, please wait for a partner to book", 409
+
+    data = {"reservation_id": reservation_id, "remaining_seats": remaining_seats}
+    return json.dumps(data), 201
+
+# Endpoint to cancel the reservation of a user
+@app.route("/events/<int:event_id>/reservations/<int:user_id>", methods=['DELETE'])
+def cancel_reservation(event_id, user_id):
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        remaining_seats = cancel_seat(conn, user_id, event_id)
+    except Exception as e:
+        return "Generic error during the cancellation",500
+    finally:
+        conn.close()
+
+    if remaining_seats is None:
+        return "Reservation not found", 404
+
+    return json.dumps({"remaining_seats": remaining_seats}), 200
+
+# Endpoint to fetch the reservation of a user for an event
+@app.route("/events/<int:event_id>/reservations/<int:user_id>", methods=['GET'])
+def fetch_reservation(event_id, user_id):
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT reservation_id, user_id, event_id, payment_status, paypal_order_id, created_at
+            FROM reservations WHERE user_id = %s AND event_id = %s
+              AND event_start = (SELECT start_date_time FROM events WHERE event_id = %s)
+            """, (user_id, event_id, event_id))
+        row = cur.fetchone()
+        if row is None:
+            return "Reservation not found", 404
+
+        colnames = [desc[0] for desc in cur.description]
+        return json.dumps(dict(zip(colnames, row)), default=str), 200
+
+    except Exception as e:
+        return "Generic error during DB query",500
+
+    finally:
+        conn.close()
+
+# Endpoint to get the signed ticket (QR code content) of a paid reservation
+@app.route("/events/<int:event_id>/reservations/<int:user_id>/ticket", methods=['GET'])
+def fetch_ticket(event_id, user_id):
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT r.reservation_id, r.payment_status, r.qr_code_value, r.ticket_file_id, e.end_date_time, e.start_date_time
+            FROM reservations r JOIN events e ON e.event_id = r.event_id
+            WHERE r.user_id = %s AND r.event_id = %s
+              AND r.event_start = (SELECT start_date_time FROM events WHERE event_id = %s)
+            """, (user_id, event_id, event_id))
+        row = cur.fetchone()
+        if row is None:
+            return "Reservation not found", 404
+
+        reservation_id, payment_status, qr_code_value, ticket_file_id, event_end, event_start = row
+        if payment_status != "paid":
+            return "Reservation not paid", 409
+
+        # Tickets are deterministic: they are stored only the first time (or if the event end has changed)
+        ticket = ticket_for_reservation(reservation_id, event_id, event_end)
+        if qr_code_value != ticket:
+            # A new ticket also needs a new image: the cached Telegram file is dropped
+            cur.execute(
+                "UPDATE reservations SET qr_code_value = %s, ticket_file_id = NULL WHERE reservation_id = %s AND event_start = %s",
+                (ticket, reservation_id, event_start)
+            )
+            conn.commit()
+            ticket_file_id = None
+
+        data = {"reservation_id": reservation_id, "ticket": ticket, "ticket_file_id": ticket_file_id}
+        return json.dumps(data), 200
+
+    except Exception as e:
+        conn.rollback()
+        return "Generic error during ticket generation",500
+
+    finally:
+        conn.close()
+
+# Endpoint to get the tickets of all the paid reservations of an event (used to deliver them in bulk at sales close)
+@app.route("/events/<int:event_id>/tickets", methods=['GET'])
+def fetch_event_tickets(event_id):
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT r.reservation_id, r.user_id, r.qr_code_value, r.ticket_file_id, e.end_date_time, e.start_date_time
+            FROM reservations r JOIN events e ON e.event_id = r.event_id
+            WHERE r.event_id = %s AND r.payment_status = 'paid'
+              AND r.event_start = (SELECT start_date_time FROM events WHERE event_id = %s)
+            ORDER BY r.reservation_id
+            """, (event_id, event_id))
+
+        tickets = []
+        new_tickets = []
+        for reservation_id, user_id, qr_code_value, ticket_file_id, event_end, event_start in cur.fetchall():
+            ticket = ticket_for_reservation(reservation_id, event_id, event_end)
+            if qr_code_value != ticket:
+                new_tickets.append((reservation_id, event_start, ticket))
+                ticket_file_id = None
+            tickets.append({"reservation_id": reservation_id, "user_id": user_id, "ticket": ticket, "ticket_file_id": ticket_file_id})
+
+        # All the tickets issued for the first time are stored with a single statement
+        if new_tickets:
+            execute_values(cur, """
+                UPDATE reservations AS r SET qr_code_value = t.ticket, ticket_file_id = NULL
+                FROM (VALUES %s) AS t (reservation_id, event_start, ticket)
+                WHERE r.reservation_id = t.reservation_id AND r.event_start = t.event_start
+                """, new_tickets)
+        conn.commit()
+
+        return json.dumps(tickets), 200
+
+    except Exception as e:
+        conn.rollback()
+        return "Generic error during ticket generation",500
+
+    finally:
+        conn.close()
+
+# Endpoint to store the Telegram file_id of the uploaded ticket image, so that resends need no upload
+@app.route("/reservations/<int:reservation_id>/ticket_file_id", methods=['PUT'])
+def store_ticket_file_id(reservation_id):
+    file_data = request.get_json()
+    if not file_data or not file_data.get("file_id"):
+        return "Missing file_id", 400
+    if not isinstance(file_data.get("event_id"), int):
+        return "Missing event_id", 400 # Selects the partition of the reservation
+
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """UPDATE reservations SET ticket_file_id = %s WHERE reservation_id = %s AND event_id = %s
+               AND event_start = (SELECT start_date_time FROM events WHERE event_id = %s)""",
+            (file_data["file_id"], reservation_id, file_data["event_id"], file_data["event_id"])
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return "Reservation not found", 404
+        conn.commit()
+        return "Updated", 200
+
+    except Exception as e:
+        conn.rollback()
+        return "Generic error during DB update",500
+
+    finally:
+        conn.close()
+
+# Marks the attendance of a paid reservation with a single conditional UPDATE (no previous read)
+CHECK_IN_QUERY = """
+    UPDATE reservations SET is_checked_in = TRUE, check_in_time = COALESCE(%s::timestamptz, NOW())
+    WHERE reservation_id = %s AND event_id = %s AND payment_status = 'paid' AND is_checked_in IS NOT TRUE
+      AND event_start = (SELECT start_date_time FROM events WHERE event_id = %s)
+    RETURNING reservation_id;
+"""
+
+# Same as CHECK_IN_QUERY for a whole batch of scans
+CHECK_IN_BATCH_QUERY = """
+    UPDATE reservations AS r SET is_checked_in = TRUE, check_in_time = COALESCE(s.scanned_at, NOW())
+    FROM (VALUES %s) AS s (reservation_id, event_id, scanned_at) JOIN events e ON e.event_id = s.event_id
+    WHERE r.reservation_id = s.reservation_id AND r.event_id = s.event_id AND r.event_start = e.start_date_time
+      AND r.payment_status = 'paid' AND r.is_checked_in IS NOT TRUE
+    RETURNING r.reservation_id;
+"""
+
+# Time of a scan sent by a door device: an ISO 8601 string (UTC if it has no offset), or None when the device did not
+# record it (the check-in time is then the time of the upload). Raises ValueError for anything else.
+def parse_scan_time(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError("scanned_at must be an ISO 8601 string")
+    scanned_at = datetime.fromisoformat(value)
+    if scanned_at.tzinfo is None:
+        scanned_at = scanned_at.replace(tzinfo=timezone.utc)
+    return scanned_at
+
+# Endpoint used by the door devices to check in a single ticket
+@app.route("/events/<int:event_id>/checkin", methods=['POST'])
+def check_in(event_id):
+    if not door_device_authorized():
+        return "Forbidden", 403
+    scan = request.get_json(silent=True)
+    if not isinstance(scan, dict) or "ticket" not in scan:
+        return "Missing ticket", 400
+    try:
+        scanned_at = parse_scan_time(scan.get("scanned_at"))
+    except ValueError:
+        return "Invalid scanned_at: expected an ISO 8601 date and time", 400
+
+    # The signature is verified before touching the database: forged tickets cost no query
+    try:
+        reservation_id, ticket_event_id, _ = verify_ticket(scan["ticket"])
+    except InvalidTicket as e:
+        return f"Invalid ticket: {e}", 403
+    if ticket_event_id != event_id:
+        return "Invalid ticket: the ticket is for another event", 403
+
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        cur.execute(CHECK_IN_QUERY, (scanned_at, reservation_id, event_id, event_id))
+        checked_in = cur.fetchone() is not None
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        return "Generic error during check-in",500
+
+    finally:
+        conn.close()
+
+    if not checked_in:
+        return "Ticket already used or reservation not paid", 409
+    return json.dumps({"reservation_id": reservation_id}), 200
+
+# Endpoint used by the door devices to upload the scans collected while offline
+@app.route("/events/<int:event_id>/checkin/batch", methods=['POST'])
+def check_in_batch(event_id):
+    if not door_device_authorized():
+        return "Forbidden", 403
+    batch = request.get_json(silent=True)
+    if not isinstance(batch, dict) or not isinstance(batch.get("scans"), list):
+        return "Missing scans", 400
+
+    rejected = []
+    scans = {} # reservation_id -> earliest scan time (a ticket may be scanned more than once)
+    for scan in batch["scans"]:
+        # A malformed scan is rejected on its own: the other scans of the batch are still checked in
+        if not isinstance(scan, dict):
+            rejected.append({"ticket": None, "reason": "Malformed scan"})
+            continue
+        ticket = scan.get("ticket")
+        try:
+            reservation_id, ticket_event_id, _ = verify_ticket(ticket)
+        except InvalidTicket as e:
+            rejected.append({"ticket": ticket, "reason": str(e)})
+            continue
+        if ticket_event_id != event_id:
+            rejected.append({"ticket": ticket, "reason": "The ticket is for another event"})
+            continue
+        try:
+            scanned_at = parse_scan_time(scan.get("scanned_at"))
+        except ValueError:
+            rejected.append({"ticket": ticket, "reason": "Invalid scanned_at"})
+            continue
+        if reservation_id not in scans or (scanned_at and (scans[reservation_id] is None or scanned_at < scans[reservation_id])):
+            scans[reservation_id] = scanned_at
+
+    checked_in = []
+    if scans:
+        # Connect to the database
+        conn = connect_db()
+        if conn is None:
+            return "Internal Server Error: impossible to connect to the database",500
+
+        try:
+            cur = conn.cursor()
+            rows = execute_values(
+                cur, CHECK_IN_BATCH_QUERY,
+                [(reservation_id, event_id, scanned_at) for reservation_id, scanned_at in scans.items()],
+                template="(%s, %s, %s::timestamptz)", fetch=True
+            )
+            checked_in = [row[0] for row in rows]
+            conn.commit()
+
+        except Exception as e:
+            conn.rollback()
+            return "Generic error during check-in",500
+
+        finally:
+            conn.close()
+
+    # Valid tickets that were not updated: already checked in or reservation not paid
+    not_checked_in = sorted(set(scans) - set(checked_in))
+    data = {"checked_in": checked_in, "already_used_or_not_paid": not_checked_in, "rejected": rejected}
+    return json.dumps(data), 200
+
+# Endpoint used by the door devices to download the tickets of an event (full bundle, or delta if `since` is given)
+@app.route("/events/<int:event_id>/door_bundle", methods=['GET'])
+def fetch_door_bundle(event_id):
+    if not door_device_authorized():
+        return "Forbidden", 403
+    since = request.args.get('since', default=None, type=float) # generated_at of the bundle already on the device
+
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        data = build_bundle(conn, event_id, since)
+    except Exception as e:
+        return "Generic error during the bundle export",500
+    finally:
+        conn.close()
+
+    if data is None:
+        return "Event not found", 404
+    return Response(data, mimetype="application/octet-stream")
+
+# Endpoint to attach the PayPal order to a held (pending) reservation
+@app.route("/reservations/<int:reservation_id>/order", methods=['PUT'])
+def attach_order(reservation_id):
+    order_data = request.get_json()
+    if not order_data or not order_data.get("paypal_order_id"):
+        return "Missing paypal_order_id", 400
+    if not isinstance(order_data.get("event_id"), int):
+        return "Missing event_id", 400 # Selects the partition of the reservation
+
+    # Connect to the database
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database",500
+
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """UPDATE reservations SET paypal_order_id = %s WHERE reservation_id = %s AND event_id = %s AND payment_status = 'pending'
+               AND event_start = (SELECT start_date_time FROM events WHERE event_id = %s)""",
+            (order_data["paypal_order_id"], reservation_id, order_data["event_id"], order_data["event_id"])
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return "Pending reservation not found", 404
+        conn.commit()
+        return "Updated", 200
+
+    except Exception as e:
+        conn.rollback()
+        return "Generic error during DB update",500
+
+    finally:
+        conn.close()
+
+# Endpoint to open a waiting room (or change its admission rate) in front of the booking of an event
+@app.route("/events/<int:event_id>/waiting_room", methods=['PUT'])
+def open_waiting_room(event_id):
+    if not admin_authorized():
+        return "Forbidden", 403
+    room_data = request.get_json(silent=True) or {}
+    try:
+        rate = float(room_data.get("rate", os.environ.get("WAITING_ROOM_RATE", 1))) # Admitted users per second
+    except (TypeError, ValueError):
+        return "The admission rate must be a number", 400
+    if not math.isfinite(rate) or rate <= 0:
+        return "The admission rate must be positive", 400
+
+    waiting_rooms.open(event_id, rate)
+    return json.dumps(waiting_rooms.info(event_id)), 200
+
+# Endpoint to get the status of the waiting room of an event
+@app.route("/events/<int:event_id>/waiting_room", methods=['GET'])
+def fetch_waiting_room(event_id):
+    info = waiting_rooms.info(event_id)
+    if info is None:
+        return "Waiting room not found", 404
+    return json.dumps(info), 200
+
+# Endpoint to close the waiting room of an event (everybody can book directly again)
+@app.route("/events/<int:event_id>/waiting_room", methods=['DELETE'])
+def close_waiting_room(event_id):
+    if not admin_authorized():
+        return "Forbidden", 403
+    if not waiting_rooms.close(event_id):
+        return "Waiting room not found", 404
+    return "Closed", 200
+
+# Endpoint to monitor the seats held by unfinished checkouts
+@app.route("/metrics/holds", methods=['GET'])
+def holds_metrics():
+    return json.dumps(hold_metrics), 200
 
 if __name__ == "__main__":
     load_dotenv()  # Loads variables from .env into environment
+    # Checked once here: without the secret every ticket route would fail (tickets are signed at each request)
+    try:
+        get_secret()
+    except RuntimeError as e:
+        sys.exit(f"{e}: set it in .env (see README)")
+    if not os.environ.get("DOOR_DEVICE_TOKEN"):
+        print("DOOR_DEVICE_TOKEN is not set: the check-in and door bundle endpoints refuse every request.")
+    if not os.environ.get("ADMIN_API_TOKEN"):
+        print("ADMIN_API_TOKEN is not set: the waiting room and poster upload endpoints refuse every request.")
     CALENDAR_SERVICE_PORT = os.environ.get("CALENDAR_SERVICE_PORT")
+    # The debug reloader runs this file twice: the sweeper is started only in the process serving the requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_sweeper_thread(int(os.environ.get("HOLD_SWEEP_INTERVAL", 30)))
+        start_partition_thread()
+        waiting_rooms.start_snapshot_thread()
     app.run(host="0.0.0.0", port=CALENDAR_SERVICE_PORT, debug=True)
\ No newline at end of file
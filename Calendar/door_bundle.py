@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from dotenv import load_dotenv
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Calendar.tickets import ticket_for_reservation
+from Monitoring.db_metrics import InstrumentedCursor
+
+# Binary layout of a bundle:
+#   header: magic, event id, flags (1 = delta), generated at and since (unix time), number of valid and revoked hashes
+#   body:   the valid hashes, then the revoked hashes, both sorted, 8 bytes each (big-endian)
+# A hash is the first 8 bytes of SHA-256(ticket): the door device never needs TICKET_SECRET.
+BUNDLE_MAGIC = b"DBN1"
+HEADER_FORMAT = ">4sIIddII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FLAG_DELTA = 1
+
+# Deltas overlap the previous bundle by this margin: a payment committed just after the previous export,
+# but with an earlier paid_at, is still included (duplicates are harmless)
+DELTA_OVERLAP_SECONDS = 60
+
+def ticket_hash(ticket):
+    """Returns the 64-bit hash stored in the bundles for the given ticket."""
+    return int.from_bytes(hashlib.sha256(ticket.encode("utf-8")).digest()[:8], "big")
+
+def build_bundle(conn, event_id, since=None, batch_size=1000):
+    """
+    Exports the tickets of the event as bundle bytes: a full bundle, or the changes after `since` (unix time).
+    Returns None if the event does not exist.
+    """
+    # A single snapshot for the whole export: the generation time matches the exported rows
+    conn.set_isolation_level(ISOLATION_LEVEL_REPEATABLE_READ)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT end_date_time, EXTRACT(EPOCH FROM NOW()), start_date_time FROM events WHERE event_id = %s;", (event_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        event_end, generated_at, event_start = row[0], float(row[1]), row[2]
+        since_condition = "AND {column} > to_timestamp(%(since)s)" if since is not None else ""
+        params = {"event_id": event_id, "event_start": event_start, "since": (since or 0) - DELTA_OVERLAP_SECONDS}
+
+        # Named cursor: the paid reservations are streamed from the server in batches
+        valid = array("Q")
+        stream = conn.cursor(name="door_bundle_tickets")
+        stream.itersize = batch_size
+        stream.execute(f"""
+            SELECT reservation_id FROM reservations
+            WHERE event_id = %(event_id)s AND event_start = %(event_start)s AND payment_status = 'paid' {since_condition.format(column="paid_at")}
+            """, params)
+        for (reservation_id,) in stream:
+            valid.append(ticket_hash(ticket_for_reservation(reservation_id, event_id, event_end)))
+        stream.close()
+
+        revoked = array("Q")
+        cur.execute(f"""
+            SELECT reservation_id FROM ticket_revocations
+            WHERE event_id = %(event_id)s {since_condition.format(column="revoked_at")}
+            """, params)
+        for (reservation_id,) in cur:
+            revoked.append(ticket_hash(ticket_for_reservation(reservation_id, event_id, event_end)))
+        cur.close()
+    finally:
+        conn.rollback()
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_DEFAULT)
+
+    flags = FLAG_DELTA if since is not None else 0
+    header = struct.pack(HEADER_FORMAT, BUNDLE_MAGIC, event_id, flags, generated_at, since or 0.0, len(valid), len(revoked))
+    body = array("Q", sorted(valid)) + array("Q", sorted(revoked))
+    if sys.byteorder == "little":
+        body.byteswap()
+    return header + body.tobytes()
+
+class DoorBundle:
+    """
+    In-memory view of a bundle, used by the door devices to validate the scans without the network:
+    lookups are a binary search over the sorted hashes (O(log n)) plus a set lookup for the revocations.
+    """
+
+    def __init__(self, data):
+        magic, self.event_id, flags, self.generated_at, self.since, n_valid, n_revoked = struct.unpack_from(HEADER_FORMAT, data)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError("Not a door bundle")
+        self.is_delta = bool(flags & FLAG_DELTA)
+
+        hashes = array("Q")
+        hashes.frombytes(data[HEADER_SIZE:HEADER_SIZE + 8 * (n_valid + n_revoked)])
+        if sys.byteorder == "little":
+            hashes.byteswap()
+        self.valid = hashes[:n_valid]
+        self.revoked = set(hashes[n_valid:])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    def is_valid(self, ticket):
+        """Returns True if the scanned ticket belongs to the bundle and has not been revoked."""
+        h = ticket_hash(ticket)
+        if h in self.revoked:
+            return False
+        i = bisect_left(self.valid, h)
+        return i < len(self.valid) and self.valid[i] == h
+
+    def apply_delta(self, delta):
+        """Merges a delta bundle (exported with since <= self.generated_at) into this bundle."""
+        if delta.event_id != self.event_id or not delta.is_delta:
+            raise ValueError("The bundle is not a delta of the same event")
+        removed = delta.revoked
+        self.valid = array("Q", sorted((set(self.valid) | set(delta.valid)) - removed))
+        self.revoked |= removed
+        self.generated_at = delta.generated_at
+
+
+# This function performs the connection to the database
+def connect_db():
+    """Establishes a connection to the PostgreSQL database."""
+    try:
+        conn = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            cursor_factory=InstrumentedCursor, # Times every query (see Monitoring/db_metrics.py)
+        )
+        return conn
+    except psycopg2.Error as e:
+        print(f"DB connection error: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    load_dotenv()  # Loads variables from .env into environment
+
+    parser = argparse.ArgumentParser(description="Export the tickets of an event for the offline door devices.")
+    parser.add_argument("event_id", type=int, help="Event to export")
+    parser.add_argument("--since", help="Export only the changes after this bundle (path of the previous bundle)")
+    parser.add_argument("--output", help="Output file (default: door_bundle_<event>_<time>.bin)")
+    args = parser.parse_args()
+
+    since = DoorBundle.load(args.since).generated_at if args.since else None
+
+    conn = connect_db()
+    if conn is None:
+        sys.exit(1)
+    start = time.monotonic()
+    data = build_bundle(conn, args.event_id, since)
+    conn.close()
+    if data is None:
+        print(f"Event {args.event_id} not found.")
+        sys.exit(1)
+
+    bundle = DoorBundle(data)
+    output = args.output or f"door_bundle_{args.event_id}_{datetime.fromtimestamp(bundle.generated_at):%Y%m%d_%H%M%S}.bin"
+    with open(output, "wb") as f:
+        f.write(data)
+    print(f"{'Delta' if bundle.is_delta else 'Full'} bundle written to {output} in {time.monotonic() - start:.2f}s: "
+          f"{len(bundle.valid)} valid tickets, {len(bundle.revoked)} revoked ({len(data)} bytes).")
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import psycopg2
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Monitoring.db_metrics import InstrumentedCursor
+from Payments.payment_reconciliation import reconcile
+load_dotenv()  # Loads variables from .env into environment
+
+# How long a seat stays held while the user completes the payment
+HOLD_TTL_MINUTES = int(os.environ.get("HOLD_TTL_MINUTES", 15))
+
+# Counters published by the Calendar service (see /metrics/holds)
+hold_metrics = {
+    "holds_outstanding": None,
+    "holds_expired_total": 0,
+    "orders_closed_total": 0,
+    "last_sweep_time": None,
+}
+
+# Deletes a small batch of expired holds and gives their seats (and role counters) back.
+# SKIP LOCKED lets the sweeper ignore the holds that are being paid/cancelled right now,
+# and the small LIMIT keeps every transaction (and the locks on the events rows) short.
+# The holds with a PayPal order are left to release_ordered_holds(): the user may have paid it.
+RELEASE_EXPIRED_HOLDS_QUERY = """
+    WITH expired AS (
+        SELECT reservation_id, event_start FROM reservations
+        WHERE payment_status = 'pending' AND paypal_order_id IS NULL
+          AND created_at < NOW() - make_interval(mins => %(ttl_minutes)s)
+        ORDER BY created_at
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ), released AS (
+        DELETE FROM reservations USING expired
+        WHERE reservations.reservation_id = expired.reservation_id AND reservations.event_start = expired.event_start
+        RETURNING reservations.event_id, reservations.role
+    ), freed AS (
+        SELECT event_id, COUNT(*) AS seats,
+               COUNT(*) FILTER (WHERE role = 'leader') AS leaders,
+               COUNT(*) FILTER (WHERE role = 'follower') AS followers
+        FROM released GROUP BY event_id
+    )
+    UPDATE events SET
+        remaining_seats = remaining_seats + freed.seats,
+        leaders_count = leaders_count - freed.leaders,
+        followers_count = followers_count - freed.followers
+    FROM freed WHERE events.event_id = freed.event_id
+    RETURNING freed.seats;
+"""
+
+# This function performs the connection to the database
+def connect_db():
+    """Establishes a connection to the PostgreSQL database."""
+    try:
+        conn = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            cursor_factory=InstrumentedCursor, # Times every query (see Monitoring/db_metrics.py)
+        )
+        return conn
+    except psycopg2.Error as e:
+        print(f"DB connection error: {e}")
+        return None
+
+def release_expired_holds(conn, ttl_minutes=HOLD_TTL_MINUTES, batch_size=100):
+    """
+    Releases all the holds older than `ttl_minutes`, one batch (and one transaction) at a time.
+    Returns the number of released holds.
+    """
+    released = 0
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute(RELEASE_EXPIRED_HOLDS_QUERY, {"ttl_minutes": ttl_minutes, "batch_size": batch_size})
+            batch = sum(row[0] for row in cur.fetchall())
+            conn.commit()
+            released += batch
+            if batch < batch_size:
+                return released
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+def release_ordered_holds(ttl_minutes=HOLD_TTL_MINUTES, batch_size=100):
+    """
+    Asks PayPal for the order of every expired hold that has one: paid orders mark their reservation as paid,
+    voided or abandoned ones release it. Returns the number of closed holds (0 if PayPal could not be reached).
+    """
+    try:
+        summary = asyncio.run(reconcile(batch_size=batch_size, min_age_minutes=ttl_minutes, release_abandoned=True))
+    except Exception as e:
+        print(f"Error while checking the PayPal orders of expired holds: {e}")
+        return 0
+    return summary["fixed"]
+
+def count_outstanding_holds(conn):
+    """Returns the number of pending reservations (answered by the partial index on pending reservations)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COUNT(*) FROM reservations WHERE payment_status = 'pending';")
+        return cur.fetchone()[0]
+    finally:
+        conn.rollback()
+        cur.close()
+
+def sweep_once(ttl_minutes=HOLD_TTL_MINUTES, batch_size=100):
+    """Runs one sweep and updates the published metrics. Returns the number of released holds."""
+    conn = connect_db()
+    if conn is None:
+        return 0
+    try:
+        released = release_expired_holds(conn, ttl_minutes, batch_size)
+        hold_metrics["holds_expired_total"] += released
+        hold_metrics["orders_closed_total"] += release_ordered_holds(ttl_minutes, batch_size)
+        hold_metrics["holds_outstanding"] = count_outstanding_holds(conn)
+        hold_metrics["last_sweep_time"] = datetime.now(timezone.utc).isoformat()
+        return released
+    except psycopg2.Error as e:
+        print(f"Error while releasing expired holds: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def run_sweeper(interval_seconds=30, ttl_minutes=HOLD_TTL_MINUTES, batch_size=100):
+    """Sweeps the expired holds every `interval_seconds` (never returns)."""
+    while True:
+        released = sweep_once(ttl_minutes, batch_size)
+        if released:
+            print(f"Released {released} expired holds.")
+        time.sleep(interval_seconds)
+
+def start_sweeper_thread(interval_seconds=30, ttl_minutes=HOLD_TTL_MINUTES, batch_size=100):
+    """Starts the sweeper in a background (daemon) thread of the current process."""
+    thread = threading.Thread(
+        target=run_sweeper, args=(interval_seconds, ttl_minutes, batch_size), name="hold-sweeper", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Release the seats held by abandoned checkouts.")
+    parser.add_argument("--ttl", type=int, default=HOLD_TTL_MINUTES, help="Minutes after which a pending hold expires")
+    parser.add_argument("--batch-size", type=int, default=100, help="Holds released per transaction")
+    parser.add_argument("--interval", type=int, default=30, help="Seconds between two sweeps")
+    parser.add_argument("--once", action="store_true", help="Run a single sweep and exit")
+    args = parser.parse_args()
+
+    if args.once:
+        print(f"Released {sweep_once(args.ttl, args.batch_size)} expired holds, "
+              f"{hold_metrics['holds_outstanding']} still outstanding.")
+    else:
+        run_sweeper(args.interval, args.ttl, args.batch_size)
@@ -0,0 +1,139 @@
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Posters are stored as <sha256 of the content>.<ext>: identical uploads end up in the same file,
+# and since a path never changes content the files can be cached forever by the clients.
+POSTER_STORE_DIR = os.environ.get(
+    "POSTER_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "posters")
+)
+VARIANTS_DIR = os.path.join(POSTER_STORE_DIR, "variants")
+MAX_POSTER_BYTES = int(os.environ.get("MAX_POSTER_BYTES", 10 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+
+# Resized and recompressed versions generated once, at ingest: name -> maximum width in pixels
+VARIANTS = {
+    "thumb": 320,
+    "medium": 1080,
+}
+
+# Accepted formats, recognized from the first bytes of the content
+FORMATS = {
+    b"\xff\xd8\xff": "jpg",
+    b"\x89PNG\r\n\x1a\n": "png",
+}
+
+class InvalidPoster(ValueError):
+    """Raised when an upload is not a JPEG/PNG image or is too large."""
+
+# Background worker generating the variants (Pillow releases the GIL while decoding and resizing)
+variant_worker = ThreadPoolExecutor(max_workers=int(os.environ.get("POSTER_VARIANT_WORKERS", 2)), thread_name_prefix="poster-variants")
+
+def detect_format(head):
+    for magic, extension in FORMATS.items():
+        if head.startswith(magic):
+            return extension
+    return None
+
+def poster_path(poster_id, variant=None):
+    """Returns the path of the poster (or of one of its variants) or None if it does not exist."""
+    if len(poster_id) != 64 or any(c not in "0123456789abcdef" for c in poster_id):
+        return None
+    if variant:
+        path = os.path.join(VARIANTS_DIR, f"{poster_id}_{variant}.jpg")
+        return path if os.path.isfile(path) else None
+    for extension in FORMATS.values():
+        path = os.path.join(POSTER_STORE_DIR, f"{poster_id}.{extension}")
+        if os.path.isfile(path):
+            return path
+    return None
+
+def ingest_poster(stream):
+    """
+    Stores the image read from the file-like `stream` chunk by chunk (never fully in memory), hashing it on the way.
+    Returns (poster_id, created): created is False if the same image was already stored.
+    The variants of a new poster are generated in background.
+    """
+    os.makedirs(POSTER_STORE_DIR, exist_ok=True)
+    sha256 = hashlib.sha256()
+    size = 0
+    extension = None
+
+    fd, temporary_path = tempfile.mkstemp(dir=POSTER_STORE_DIR, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if extension is None:
+                    extension = detect_format(chunk)
+                    if extension is None:
+                        raise InvalidPoster("Only JPEG and PNG images are accepted")
+                size += len(chunk)
+                if size > MAX_POSTER_BYTES:
+                    raise InvalidPoster(f"The image exceeds {MAX_POSTER_BYTES} bytes")
+                sha256.update(chunk)
+                f.write(chunk)
+
+        if extension is None:
+            raise InvalidPoster("Empty upload")
+
+        poster_id = sha256.hexdigest()
+        final_path = os.path.join(POSTER_STORE_DIR, f"{poster_id}.{extension}")
+        if os.path.exists(final_path):
+            os.remove(temporary_path) # Duplicate: the content is already stored
+            return poster_id, False
+
+        os.replace(temporary_path, final_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    variant_worker.submit(generate_variants, poster_id, final_path)
+    return poster_id, True
+
+def generate_variants(poster_id, path):
+    """Writes the resized/recompressed JPEG variants of the poster (skipping the ones that already exist)."""
+    from PIL import Image # Optional dependency, needed only by the Calendar service
+
+    os.makedirs(VARIANTS_DIR, exist_ok=True)
+    try:
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+            for variant, max_width in VARIANTS.items():
+                variant_path = os.path.join(VARIANTS_DIR, f"{poster_id}_{variant}.jpg")
+                if os.path.exists(variant_path):
+                    continue
+                resized = image.copy()
+                resized.thumbnail((max_width, max_width * 4)) # Keeps the aspect ratio, never upscales
+                # Unique temporary file: two generations of the same poster (e.g. two processes) never share it
+                fd, temporary_path = tempfile.mkstemp(dir=VARIANTS_DIR, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        resized.save(f, format="JPEG", quality=80, optimize=True, progressive=True)
+                    os.replace(temporary_path, variant_path)
+                except BaseException:
+                    if os.path.exists(temporary_path):
+                        os.remove(temporary_path)
+                    raise
+    except Exception as e:
+        print(f"Impossible to generate the variants of poster {poster_id}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import existing images into the content-addressed poster store.")
+    parser.add_argument("files", nargs="+", help="Images to import (e.g. the old posters/*.jpg)")
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        with open(file_name, "rb") as f:
+            poster_id, created = ingest_poster(f)
+        print(f"{file_name} -> {poster_id} ({'stored' if created else 'duplicate'})")
+    variant_worker.shutdown(wait=True)
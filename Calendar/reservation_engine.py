@@ -0,0 +1,145 @@
+import sys
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Possible outcomes of a booking attempt
+BOOKED = "booked"
+ALREADY_RESERVED = "already_reserved"
+SOLD_OUT = "sold_out"
+ROLE_IMBALANCE = "role_imbalance"
+EVENT_NOT_FOUND = "event_not_found"
+USER_NOT_FOUND = "user_not_found"
+
+# Takes one seat and inserts the reservation in a single statement.
+# The seat counter is decremented only if a seat is left, so concurrent bookers never oversell:
+# the row lock on the event is held just for the duration of this statement and its commit.
+# The leader/follower counters are updated by the same UPDATE, so the optional maximum imbalance
+# is enforced atomically too (a booking that reduces the imbalance is always accepted).
+# The NOT EXISTS probe (served by idx_unique_reservation) avoids locking the event row for duplicates,
+# while ON CONFLICT catches the duplicates that race with each other (the seat is then given back by the rollback).
+# The reservations are partitioned by the start of their event (event_start): the probes give it, so that only
+# the partition of the event is searched.
+BOOK_SEAT_QUERY = """
+    WITH booker AS (
+        SELECT role FROM users WHERE user_id = %(user_id)s
+    ), seat AS (
+        UPDATE events SET
+            remaining_seats = remaining_seats - 1,
+            leaders_count = leaders_count + (booker.role = 'leader')::int,
+            followers_count = followers_count + (booker.role = 'follower')::int
+        FROM booker
+        WHERE event_id = %(event_id)s AND is_active = TRUE AND remaining_seats > 0
+          AND NOT EXISTS (
+              SELECT 1 FROM reservations
+              WHERE user_id = %(user_id)s AND event_id = %(event_id)s AND event_start = events.start_date_time
+          )
+          AND (
+              max_role_imbalance IS NULL
+              OR booker.role NOT IN ('leader', 'follower')
+              OR (booker.role = 'leader' AND leaders_count + 1 - followers_count <= max_role_imbalance)
+              OR (booker.role = 'follower' AND followers_count + 1 - leaders_count <= max_role_imbalance)
+          )
+        RETURNING events.event_id, events.start_date_time, events.remaining_seats, booker.role
+    ), reservation AS (
+        INSERT INTO reservations (user_id, event_id, event_start, payment_status, role)
+        SELECT %(user_id)s, event_id, start_date_time, %(payment_status)s, role FROM seat
+        ON CONFLICT (user_id, event_id, event_start) DO NOTHING
+        RETURNING reservation_id
+    )
+    SELECT seat.remaining_seats, reservation.reservation_id FROM seat LEFT JOIN reservation ON TRUE;
+"""
+
+# Finds out why a booking attempt did not take a seat (only executed when the booking fails)
+BOOKING_FAILURE_QUERY = """
+    SELECT events.remaining_seats, events.is_active,
+           EXISTS (SELECT 1 FROM reservations
+                   WHERE user_id = %(user_id)s AND event_id = %(event_id)s AND event_start = events.start_date_time),
+           users.role,
+           CASE users.role
+               WHEN 'leader' THEN events.leaders_count + 1 - events.followers_count
+               WHEN 'follower' THEN events.followers_count + 1 - events.leaders_count
+           END > events.max_role_imbalance
+    FROM events LEFT JOIN users ON users.user_id = %(user_id)s
+    WHERE events.event_id = %(event_id)s;
+"""
+
+# Deletes the reservation and gives its seat (and its place in the role balance) back in a single statement.
+# If the reservation was paid its ticket is revoked, so that the door bundles stop accepting it.
+CANCEL_SEAT_QUERY = """
+    WITH cancelled AS (
+        DELETE FROM reservations
+        WHERE user_id = %(user_id)s AND event_id = %(event_id)s
+          AND event_start = (SELECT start_date_time FROM events WHERE event_id = %(event_id)s)
+        RETURNING reservation_id, event_id, role, payment_status
+    ), revoked AS (
+        INSERT INTO ticket_revocations (reservation_id, event_id)
+        SELECT reservation_id, event_id FROM cancelled WHERE payment_status = 'paid'
+        ON CONFLICT (reservation_id) DO NOTHING
+    )
+    UPDATE events SET
+        remaining_seats = remaining_seats + 1,
+        leaders_count = leaders_count - (CASE WHEN cancelled.role = 'leader' THEN 1 ELSE 0 END),
+        followers_count = followers_count - (CASE WHEN cancelled.role = 'follower' THEN 1 ELSE 0 END)
+    FROM cancelled WHERE events.event_id = cancelled.event_id
+    RETURNING events.remaining_seats;
+"""
+
+def book_seat(conn, user_id, event_id, payment_status="pending"):
+    """
+    Reserves one seat of the event for the user.
+    Returns a tuple (outcome, reservation_id, remaining_seats) where outcome is one of BOOKED, ALREADY_RESERVED,
+    SOLD_OUT, ROLE_IMBALANCE, EVENT_NOT_FOUND or USER_NOT_FOUND (reservation_id is None unless BOOKED).
+    The transaction is committed on success and rolled back otherwise.
+    """
+    cur = conn.cursor()
+    try:
+        params = {"user_id": user_id, "event_id": event_id, "payment_status": payment_status}
+        cur.execute(BOOK_SEAT_QUERY, params)
+        row = cur.fetchone()
+
+        if row is not None and row[1] is not None:
+            conn.commit()
+            return BOOKED, row[1], row[0]
+
+        # Slow path (no seat taken or duplicate booking): find out why the booking failed
+        conn.rollback()
+        cur.execute(BOOKING_FAILURE_QUERY, params)
+        row = cur.fetchone()
+        conn.rollback()
+
+        if row is None or not row[1]:
+            return EVENT_NOT_FOUND, None, None
+        remaining_seats, _, already_reserved, role, unbalanced = row
+        if already_reserved:
+            return ALREADY_RESERVED, None, remaining_seats
+        if role is None:
+            return USER_NOT_FOUND, None, remaining_seats
+        if unbalanced and (remaining_seats or 0) > 0:
+            return ROLE_IMBALANCE, None, remaining_seats
+        return SOLD_OUT, None, remaining_seats
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        cur.close()
+
+def cancel_seat(conn, user_id, event_id):
+    """
+    Cancels the reservation of the user and releases its seat.
+    Returns the number of seats left after the cancellation, or None if there was nothing to cancel.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(CANCEL_SEAT_QUERY, {"user_id": user_id, "event_id": event_id})
+        row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        cur.close()
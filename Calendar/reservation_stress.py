@@ -0,0 +1,149 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dotenv import load_dotenv
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Calendar.reservation_engine import *
+
+# Ids of the temporary users created by the stress test (far away from real Telegram ids)
+FIRST_USER_ID = 2000000000
+
+def create_fixtures(conn, bookers, capacity, max_role_imbalance=None):
+    """
+    Creates a temporary event and the users that will try to book it. Returns the event id.
+    With max_role_imbalance one booker out of three is a leader, the others followers: the followers compete for the
+    places left by the leaders and the imbalance limit is reached quickly.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO events (event_type, title, start_date_time, end_date_time, location, capacity, remaining_seats, max_role_imbalance)
+        VALUES ('workshop', 'Stress test event', NOW() + INTERVAL '1 day', NOW() + INTERVAL '1 day 2 hours', 'Nowhere', %s, %s, %s)
+        RETURNING event_id;
+        """, (capacity, capacity, max_role_imbalance))
+    event_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO users (user_id, name, surname, birthdate, username, password_hash, role)
+        SELECT id, 'stress', 'test', '2000-01-01', 'stress_test_' || id, 'not-a-hash',
+               CASE WHEN %s AND id %% 3 = 0 THEN 'leader' ELSE 'follower' END
+        FROM generate_series(%s, %s) AS id
+        ON CONFLICT (user_id) DO NOTHING;
+        """, (max_role_imbalance is not None, FIRST_USER_ID, FIRST_USER_ID + bookers - 1))
+    conn.commit()
+    cur.close()
+    return event_id
+
+def drop_fixtures(conn, event_id, bookers):
+    """Removes the temporary event, users and reservations (reservations are deleted on cascade)."""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM events WHERE event_id = %s;", (event_id,))
+    cur.execute("DELETE FROM users WHERE user_id BETWEEN %s AND %s;", (FIRST_USER_ID, FIRST_USER_ID + bookers - 1))
+    conn.commit()
+    cur.close()
+
+def run_stress_test(bookers=1000, capacity=50, attempts=2, pool_size=50, max_role_imbalance=None):
+    """
+    Starts `bookers` threads that try to book the same event at the same time (each one `attempts` times,
+    to exercise the duplicate protection) and checks that no seat is oversold and, with max_role_imbalance,
+    that the leaders and followers never differ by more than the limit.
+    Returns a dict with the outcomes, the final counters and `consistent`, True if the final state of the
+    database is consistent.
+    """
+    pool = ThreadedConnectionPool(1, pool_size,
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD")
+    )
+    setup_conn = pool.getconn()
+    event_id = create_fixtures(setup_conn, bookers, capacity, max_role_imbalance)
+
+    outcomes = Counter()
+    outcomes_lock = threading.Lock()
+    # The pool raises an error instead of waiting when exhausted; setup_conn keeps one of its connections
+    connections = threading.BoundedSemaphore(pool_size - 1)
+    start = threading.Event()
+
+    def booker(user_id):
+        start.wait()
+        for _ in range(attempts):
+            with connections:
+                conn = pool.getconn()
+                try:
+                    outcome = book_seat(conn, user_id, event_id)[0]
+                except psycopg2.Error as e:
+                    outcome = f"error: {e.pgcode}"
+                finally:
+                    pool.putconn(conn)
+            with outcomes_lock:
+                outcomes[outcome] += 1
+
+    threads = [threading.Thread(target=booker, args=(FIRST_USER_ID + i,)) for i in range(bookers)]
+    for thread in threads:
+        thread.start()
+
+    begin = time.monotonic()
+    start.set()  # All the bookers are released at the same moment
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - begin
+
+    cur = setup_conn.cursor()
+    cur.execute("SELECT remaining_seats, leaders_count, followers_count FROM events WHERE event_id = %s;", (event_id,))
+    remaining_seats, leaders_count, followers_count = cur.fetchone()
+    cur.execute("""
+        SELECT COUNT(*), COUNT(DISTINCT user_id), COUNT(*) FILTER (WHERE role = 'leader'), COUNT(*) FILTER (WHERE role = 'follower')
+        FROM reservations WHERE event_id = %s;
+        """, (event_id,))
+    reservations, distinct_users, leaders, followers = cur.fetchone()
+    setup_conn.rollback()
+    cur.close()
+
+    drop_fixtures(setup_conn, event_id, bookers)
+    pool.putconn(setup_conn)
+    pool.closeall()
+
+    print(f"{bookers} bookers x {attempts} attempts on a {capacity}-seat event in {elapsed:.2f}s "
+          f"({bookers * attempts / elapsed:.0f} attempts/s)")
+    for outcome, count in sorted(outcomes.items()):
+        print(f"  {outcome}: {count}")
+    print(f"Reservations stored: {reservations} (distinct users: {distinct_users}, {leaders} leaders, {followers} followers), "
+          f"remaining seats: {remaining_seats}")
+
+    consistent = (
+        sum(outcomes.values()) == bookers * attempts
+        and reservations <= capacity
+        and reservations == distinct_users
+        and reservations == outcomes[BOOKED]
+        and reservations + remaining_seats == capacity
+        and (leaders, followers) == (leaders_count, followers_count)
+        and (max_role_imbalance is None or abs(leaders - followers) <= max_role_imbalance)
+    )
+    print("OK: no oversell" if consistent else "FAILED: seat accounting is inconsistent")
+    return {
+        "outcomes": outcomes, "reservations": reservations, "distinct_users": distinct_users, "remaining_seats": remaining_seats,
+        "leaders": leaders, "followers": followers, "leaders_count": leaders_count, "followers_count": followers_count,
+        "consistent": consistent,
+    }
+
+
+if __name__ == "__main__":
+    load_dotenv()  # Loads variables from .env into environment
+
+    parser = argparse.ArgumentParser(description="Concurrent booking stress test for the reservation engine.")
+    parser.add_argument("--bookers", type=int, default=1000, help="Number of concurrent bookers")
+    parser.add_argument("--capacity", type=int, default=50, help="Capacity of the test event")
+    parser.add_argument("--attempts", type=int, default=2, help="Booking attempts of every booker")
+    parser.add_argument("--pool-size", type=int, default=50, help="Number of database connections")
+    parser.add_argument("--max-role-imbalance", type=int, default=None, help="Mixes leaders and followers with this imbalance limit")
+    args = parser.parse_args()
+
+    results = run_stress_test(args.bookers, args.capacity, args.attempts, args.pool_size, args.max_role_imbalance)
+    sys.exit(0 if results["consistent"] else 1)
@@ -0,0 +1,67 @@
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import sys
+import time
+from datetime import timedelta
+from dotenv import load_dotenv
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+load_dotenv()  # Loads variables from .env into environment
+
+# Tickets are "T1." followed by base64url(payload + signature), e.g. "T1.AAAAKgAAAANpVbkA36rXEiC7vQM1uA" (33 chars).
+# The payload packs reservation id, event id and expiry (unix time) in 12 bytes, the signature is a
+# truncated HMAC-SHA256 of the payload: a door scanner that knows TICKET_SECRET verifies it without the database.
+TICKET_PREFIX = "T1."
+PAYLOAD_FORMAT = ">III"
+PAYLOAD_SIZE = struct.calcsize(PAYLOAD_FORMAT)
+SIGNATURE_SIZE = 10
+
+# Tickets stay valid for a few hours after the end of the event (late check-ins, re-entries)
+TICKET_GRACE = timedelta(hours=6)
+
+class InvalidTicket(ValueError):
+    """Raised when a ticket is malformed, forged or expired."""
+
+def get_secret():
+    secret = os.environ.get("TICKET_SECRET")
+    if not secret:
+        raise RuntimeError("TICKET_SECRET is not set")
+    return secret.encode("utf-8")
+
+def sign_ticket(reservation_id, event_id, expires_at, secret=None):
+    """Returns the ticket of the reservation; `expires_at` is a unix timestamp."""
+    payload = struct.pack(PAYLOAD_FORMAT, reservation_id, event_id, int(expires_at))
+    signature = hmac.new(secret or get_secret(), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    return TICKET_PREFIX + base64.urlsafe_b64encode(payload + signature).decode("ascii").rstrip("=")
+
+def ticket_for_reservation(reservation_id, event_id, event_end, secret=None):
+    """Returns the ticket of a reservation of an event ending at `event_end` (timezone-aware datetime)."""
+    return sign_ticket(reservation_id, event_id, (event_end + TICKET_GRACE).timestamp(), secret)
+
+def verify_ticket(ticket, secret=None, now=None):
+    """
+    Checks signature and expiry of the ticket without any database access.
+    Returns (reservation_id, event_id, expires_at) or raises InvalidTicket.
+    """
+    if not isinstance(ticket, str) or not ticket.startswith(TICKET_PREFIX):
+        raise InvalidTicket("Unknown ticket format")
+    try:
+        encoded = ticket[len(TICKET_PREFIX):]
+        raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except (ValueError, TypeError):
+        raise InvalidTicket("Malformed ticket")
+    if len(raw) != PAYLOAD_SIZE + SIGNATURE_SIZE:
+        raise InvalidTicket("Malformed ticket")
+
+    payload, signature = raw[:PAYLOAD_SIZE], raw[PAYLOAD_SIZE:]
+    expected = hmac.new(secret or get_secret(), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidTicket("Invalid signature")
+
+    reservation_id, event_id, expires_at = struct.unpack(PAYLOAD_FORMAT, payload)
+    if expires_at < (now if now is not None else time.time()):
+        raise InvalidTicket("Expired ticket")
+    return reservation_id, event_id, expires_at
@@ -0,0 +1,154 @@
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+class WaitingRoom:
+    """
+    Admission queue of a single event.
+    Users are admitted in arrival order at `rate` users per second; the admission front only moves
+    when somebody is waiting, so an idle room does not accumulate a burst of free admissions.
+    """
+    __slots__ = ("rate", "queue", "tickets", "admitted", "last_update")
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.queue = array("q")  # Telegram ids in arrival order (8 bytes per user)
+        self.tickets = {}        # Telegram id -> index in the queue
+        self.admitted = 0.0      # Number of users at the head of the queue that have been admitted
+        self.last_update = time.monotonic()
+
+    def advance(self):
+        now = time.monotonic()
+        self.admitted = min(float(len(self.queue)), self.admitted + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+    def join(self, user_id):
+        """Adds the user to the queue (if not already there) and returns the user's ticket."""
+        ticket = self.tickets.get(user_id)
+        if ticket is None:
+            ticket = len(self.queue)
+            self.queue.append(user_id)
+            self.tickets[user_id] = ticket
+        return ticket
+
+    def status(self, ticket):
+        """Returns (admitted, position, estimated wait in seconds) of the given ticket."""
+        self.advance()
+        position = ticket - int(self.admitted)
+        if position < 0:
+            return True, 0, 0
+        return False, position + 1, (ticket + 1 - self.admitted) / self.rate
+
+class WaitingRooms:
+    """
+    In-memory waiting rooms of the events with a high-demand launch, shared by all the request threads.
+    The state is periodically saved to `snapshot_path`, so a restart does not reset the queues.
+    NB: the state lives in the process memory, the Calendar service must run as a single process.
+    """
+
+    def __init__(self, snapshot_path=None):
+        self.rooms = {}
+        self.lock = threading.Lock()
+        self.snapshot_path = snapshot_path
+        self.dirty = False
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot()
+
+    def open(self, event_id, rate):
+        """Opens (or updates the admission rate of) the waiting room of the event."""
+        with self.lock:
+            room = self.rooms.get(event_id)
+            if room is None:
+                self.rooms[event_id] = WaitingRoom(rate)
+            else:
+                room.advance()
+                room.rate = rate
+            self.dirty = True
+
+    def close(self, event_id):
+        """Removes the waiting room: every user can book directly. Returns False if there was no room."""
+        with self.lock:
+            self.dirty = True
+            return self.rooms.pop(event_id, None) is not None
+
+    def check_in(self, event_id, user_id):
+        """
+        Puts the user in the queue of the event (if the event has a waiting room).
+        Returns None if the event has no waiting room, otherwise (admitted, position, estimated wait in seconds).
+        """
+        with self.lock:
+            room = self.rooms.get(event_id)
+            if room is None:
+                return None
+            queue_length = len(room.queue)
+            ticket = room.join(user_id)
+            self.dirty = self.dirty or len(room.queue) != queue_length
+            return room.status(ticket)
+
+    def info(self, event_id):
+        """Returns a summary of the waiting room of the event, or None if there is no room."""
+        with self.lock:
+            room = self.rooms.get(event_id)
+            if room is None:
+                return None
+            room.advance()
+            return {"rate": room.rate, "queued": len(room.queue), "admitted": int(room.admitted)}
+
+    # ---- PERSISTENCE ----
+    def save_snapshot(self):
+        """Writes the state of all the rooms to the snapshot file (atomically, through a temporary file)."""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {}
+            for event_id, room in self.rooms.items():
+                room.advance()
+                data[str(event_id)] = {
+                    "rate": room.rate,
+                    "admitted": room.admitted,
+                    "queue": base64.b64encode(room.queue.tobytes()).decode("ascii"),
+                }
+            self.dirty = False
+
+        temporary_path = f"{self.snapshot_path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary_path, self.snapshot_path)
+
+    def load_snapshot(self):
+        """Restores the rooms saved by save_snapshot(). An unreadable snapshot is ignored: the rooms start empty."""
+        rooms = {}
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+            for event_id, saved in data.items():
+                room = WaitingRoom(saved["rate"])
+                room.queue.frombytes(base64.b64decode(saved["queue"]))
+                room.tickets = {user_id: ticket for ticket, user_id in enumerate(room.queue)}
+                room.admitted = saved["admitted"]
+                rooms[int(event_id)] = room
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+            print(f"Impossible to restore the waiting rooms from {self.snapshot_path}, starting with no room: {e}")
+            return
+        with self.lock:
+            self.rooms.update(rooms)
+
+    def start_snapshot_thread(self, interval_seconds=5):
+        """Saves the snapshot every `interval_seconds` in a background (daemon) thread."""
+        def snapshot_loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.save_snapshot()
+                except OSError as e:
+                    print(f"Impossible to save the waiting rooms snapshot: {e}")
+
+        thread = threading.Thread(target=snapshot_loop, name="waiting-room-snapshot", daemon=True)
+        thread.start()
+        return thread
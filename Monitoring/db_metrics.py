@@ -0,0 +1,77 @@
+import sys
+import time
+from contextlib import nullcontext
+from psycopg2.extensions import cursor
+
+from Monitoring.metrics import counter, histogram
+from Monitoring.slow_queries import record_query
+from Monitoring.tracing import child_span, tracing_active
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+query_duration = histogram(
+    "db_query_duration_seconds", "Time spent executing the SQL statements, by kind of statement.",
+    ("operation",),
+)
+query_errors = counter(
+    "db_query_errors_total", "SQL statements that raised an error, by kind of statement.",
+    ("operation",),
+)
+
+def statement_operation(query):
+    """Returns the first keyword of the statement (SELECT, INSERT, WITH...), used as label."""
+    if isinstance(query, bytes):
+        query = query[:64].decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        return "OTHER" # psycopg2.sql.Composed
+    words = query[:64].split(None, 1)
+    return words[0].upper() if words else "OTHER"
+
+def statement_text(query, limit=500):
+    # The statement before the parameters are bound: no user data ends up in the traces
+    if isinstance(query, bytes):
+        query = query[:limit].decode("utf-8", "replace")
+    return " ".join(str(query)[:limit].split())
+
+def query_span(query, operation):
+    if not tracing_active():
+        return nullcontext() # Outside a trace the SQL text is not even formatted
+    return child_span(f"db {operation}", "client", **{"db.statement": statement_text(query)})
+
+class InstrumentedCursor(cursor):
+    """
+    Cursor timing every statement it executes: passed as cursor_factory to psycopg2.connect, it is
+    used by all the cursors of the connection (execute_values and the named cursors included).
+    Inside a trace, every statement is also a span with its (parameterless) SQL text.
+    The statements are also aggregated per normalized SQL, and the slow ones logged (see Monitoring/slow_queries.py).
+    """
+
+    def execute(self, query, vars=None):
+        operation = statement_operation(query)
+        start = time.perf_counter()
+        try:
+            with query_span(query, operation):
+                result = super().execute(query, vars)
+        except Exception:
+            query_errors.inc(operation)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            query_duration.observe(elapsed, operation)
+        record_query(self, query, vars, elapsed)
+        return result
+
+    def executemany(self, query, vars_list):
+        operation = statement_operation(query)
+        start = time.perf_counter()
+        try:
+            with query_span(query, operation):
+                result = super().executemany(query, vars_list)
+        except Exception:
+            query_errors.inc(operation)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            query_duration.observe(elapsed, operation)
+        record_query(self, query, None, elapsed, explain=False) # The plan of a single execution would be misleading
+        return result
@@ -0,0 +1,136 @@
+import cProfile
+import hmac
+import os
+import re
+import sys
+import time
+from flask import Response, g, request
+
+from Monitoring.metrics import CONTENT_TYPE, counter, histogram, render_metrics
+from Monitoring.profiler import PROFILE_INTERVAL_MS, format_collapsed, sample_stacks
+from Monitoring.tracing import Span, current_span, parse_traceparent, set_service_name
+from Monitoring.traffic_capture import install_capture
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# /debug/profile is registered only if PROFILE_TOKEN is set (the callers send it in the X-Profile-Token header)
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+# Requests slower than this are profiled with cProfile, one .prof file each in SLOW_REQUEST_PROFILE_DIR (0 = off)
+SLOW_REQUEST_PROFILE_MS = float(os.environ.get("SLOW_REQUEST_PROFILE_MS", 0))
+SLOW_REQUEST_PROFILE_DIR = os.environ.get("SLOW_REQUEST_PROFILE_DIR", "profiles")
+UNPROFILED_PATHS = ("/metrics", "/debug/profile")
+
+# Labelled by the route pattern (/events/<int:event_id>), never by the actual path: one series per endpoint
+request_duration = histogram(
+    "http_server_request_duration_seconds", "Time spent handling the HTTP requests, by route.",
+    ("service", "route", "method", "status"),
+)
+request_exceptions = counter(
+    "http_server_exceptions_total", "Requests that ended with an unhandled exception, by route.",
+    ("service", "route", "method"),
+)
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+def instrument_flask(app, service):
+    """
+    Times every request of the Flask app and exposes all the metrics of the process on /metrics.
+    Every request is also a span, continuing the trace of the caller when it sends a traceparent header.
+    The server time is returned in the Server-Timing header (compared by the traffic replay), and a sample
+    of the requests is captured when TRAFFIC_CAPTURE=1.
+    """
+    set_service_name(service)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        if request.path == "/metrics":
+            return # The scrapes are not traced
+        span = Span(f"{request.method} {route_label()}", parse_traceparent(request.headers.get("traceparent")), "server",
+                    {"http.method": request.method, "http.route": route_label(), "http.target": request.path})
+        g.trace_span, g.trace_token = span, current_span.set(span)
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            elapsed = time.perf_counter() - start
+            request_duration.observe(elapsed, service, route_label(), request.method, str(response.status_code))
+            response.headers["Server-Timing"] = f"app;dur={elapsed * 1000:.3f}"
+        span = g.get("trace_span")
+        if span is not None:
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.status = "error"
+        return response
+
+    @app.teardown_request
+    def observe_exception(exception):
+        # after_request is skipped when the view raises: the request is counted here as a 500
+        start = g.pop("metrics_start", None)
+        if exception is not None and start is not None:
+            request_duration.observe(time.perf_counter() - start, service, route_label(), request.method, "500")
+            request_exceptions.inc(service, route_label(), request.method)
+        span = g.pop("trace_span", None)
+        if span is not None:
+            if exception is not None:
+                span.record_error(exception)
+            current_span.reset(g.pop("trace_token"))
+            span.end()
+
+    install_capture(app, service)
+    install_profiling(app, service)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+    return app
+
+def install_profiling(app, service):
+    """
+    On-demand sampling profile of the whole process (GET /debug/profile?seconds=10, collapsed stacks for a flame graph),
+    and cProfile of the slow requests. cProfile has to run before knowing how long the request will take: when
+    SLOW_REQUEST_PROFILE_MS is set every request pays its overhead, and only the profiles of the slow ones are kept.
+    """
+    if SLOW_REQUEST_PROFILE_MS > 0:
+        @app.before_request
+        def start_request_profile():
+            if request.path in UNPROFILED_PATHS:
+                return
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return # Python 3.12+ allows one profiler per process: another request is being profiled
+            g.request_profiler = (profiler, time.perf_counter())
+
+        @app.teardown_request
+        def stop_request_profile(exception):
+            entry = g.pop("request_profiler", None)
+            if entry is None:
+                return
+            profiler, start = entry
+            profiler.disable()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms < SLOW_REQUEST_PROFILE_MS:
+                return
+            name = re.sub(r"[^\w.-]+", "_", f"{service}-{request.method}-{route_label()}").strip("_")
+            os.makedirs(SLOW_REQUEST_PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(SLOW_REQUEST_PROFILE_DIR, f"{name}-{time.time_ns() // 1000000}-{elapsed_ms:.0f}ms.prof"))
+
+    if PROFILE_TOKEN:
+        @app.route("/debug/profile")
+        def debug_profile():
+            if not hmac.compare_digest(request.headers.get("X-Profile-Token", ""), PROFILE_TOKEN):
+                return "Forbidden", 403
+            seconds = request.args.get("seconds", 10, type=float)
+            interval_ms = request.args.get("interval_ms", PROFILE_INTERVAL_MS, type=float)
+            try:
+                stacks, samples = sample_stacks(seconds, max(interval_ms, 1) / 1000)
+            except RuntimeError as e:
+                return str(e), 409
+            response = Response(format_collapsed(stacks), content_type="text/plain; charset=utf-8")
+            response.headers["X-Profile-Samples"] = str(samples)
+            return response
@@ -0,0 +1,96 @@
+import sys
+import time
+
+from Monitoring.metrics import histogram
+from Monitoring.tracing import child_span, inject_headers
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Outbound calls (PayPal, Google, Telegram, the Calendar service) labelled by host: the paths contain ids and tokens
+client_request_duration = histogram(
+    "http_client_request_duration_seconds", "Time spent on the outbound HTTP requests, by remote host.",
+    ("host", "method", "status"),
+)
+
+installed = False
+
+def observe(host, method, start, status):
+    client_request_duration.observe(time.perf_counter() - start, host or "unknown", method, status)
+
+def client_span(host, method):
+    return child_span(f"HTTP {method} {host}", "client", **{"http.method": method, "http.host": host})
+
+def install_http_metrics():
+    """
+    Times all the requests sent with `requests` and `httpx` in this process. The clients are created
+    ad hoc all over the code (requests.post, `async with httpx.AsyncClient()`), so the `send` method
+    shared by all of them is wrapped once, instead of passing hooks to every client.
+    Inside a trace, every request is a span, and the calls to our own services carry the traceparent header.
+    """
+    global installed
+    if installed:
+        return
+    installed = True
+
+    try:
+        import requests
+    except ImportError:
+        requests = None
+    if requests is not None:
+        requests_send = requests.Session.send
+
+        def send(self, request, **kwargs):
+            start = time.perf_counter()
+            host = requests.utils.urlparse(request.url).hostname
+            with client_span(host, request.method) as span:
+                inject_headers(request.headers, request.url)
+                try:
+                    response = requests_send(self, request, **kwargs)
+                except Exception:
+                    observe(host, request.method, start, "error")
+                    raise
+                observe(host, request.method, start, str(response.status_code))
+                if span is not None:
+                    span.set_attribute("http.status_code", response.status_code)
+            return response
+
+        requests.Session.send = send
+
+    try:
+        import httpx
+    except ImportError:
+        httpx = None
+    if httpx is not None:
+        client_send = httpx.Client.send
+        async_client_send = httpx.AsyncClient.send
+
+        def sync_send(self, request, **kwargs):
+            start = time.perf_counter()
+            with client_span(request.url.host, request.method) as span:
+                inject_headers(request.headers, request.url)
+                try:
+                    response = client_send(self, request, **kwargs)
+                except Exception:
+                    observe(request.url.host, request.method, start, "error")
+                    raise
+                observe(request.url.host, request.method, start, str(response.status_code))
+                if span is not None:
+                    span.set_attribute("http.status_code", response.status_code)
+            return response
+
+        async def async_send(self, request, **kwargs):
+            start = time.perf_counter()
+            with client_span(request.url.host, request.method) as span:
+                inject_headers(request.headers, request.url)
+                try:
+                    response = await async_client_send(self, request, **kwargs)
+                except Exception:
+                    observe(request.url.host, request.method, start, "error")
+                    raise
+                observe(request.url.host, request.method, start, str(response.status_code))
+                if span is not None:
+                    span.set_attribute("http.status_code", response.status_code)
+            return response
+
+        httpx.Client.send = sync_send
+        httpx.AsyncClient.send = async_send
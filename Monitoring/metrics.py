@@ -0,0 +1,194 @@
+import sys
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Minimal implementation of the Prometheus metric types and of their text exposition format
+# (https://prometheus.io/docs/instrumenting/exposition_formats/), without external dependencies.
+# Recording a value is a dictionary lookup plus a few additions under a lock: the rendering work
+# (cumulative buckets, formatting) is done only when /metrics is scraped.
+
+# Latency buckets in seconds, from 1 ms (a cached DB query) to 30 s (a slow PayPal call)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {} # label values -> value of the child
+        self.functions = {} # label values -> function returning the current value
+
+    def set_function(self, function, *labels):
+        """Exposes the value returned by `function` at scrape time (e.g. a counter kept by another module)."""
+        self.functions[labels] = function
+
+    def samples(self):
+        """Returns the (name suffix, label names, label values, value) to expose."""
+        with self.lock:
+            samples = [("", self.labelnames, labels, value) for labels, value in self.values.items()]
+        for labels, function in list(self.functions.items()):
+            try:
+                value = function()
+            except Exception:
+                continue # The object measured is not available (e.g. the pool is not created yet)
+            if value is not None:
+                samples.append(("", self.labelnames, labels, value))
+        return samples
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(names, values)} {format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    """A value that goes up and down. Gauges of caches and pools use set_function: they cost nothing until scraped."""
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value) # Only the bucket of the value: cumulated when rendered
+        with self.lock:
+            child = self.values.get(labels)
+            if child is None:
+                child = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            child[0][index] += 1
+            child[1] += value
+            child[2] += 1
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            children = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.values.items()]
+        samples = []
+        names = self.labelnames + ("le",)
+        for labels, counts, total, count in children:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", names, labels + (format_value(float(bound)),), cumulative))
+            samples.append(("_sum", self.labelnames, labels, total))
+            samples.append(("_count", self.labelnames, labels, count))
+        return samples
+
+class Timer:
+    """Context manager observing the elapsed time in a histogram."""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        # Modules imported by several services declare their metrics once: the existing one is returned
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+# Standard metric of every process (same name as in the official client libraries): the load tests read it before and after a run
+counter("process_cpu_seconds_total", "Total user and system CPU time spent in seconds.").set_function(time.process_time)
+
+def render_metrics():
+    return REGISTRY.render()
+
+# ---- /metrics ENDPOINT (processes without a web framework: the bots) ----
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serves /metrics from a daemon thread: the scrapes never wait for the event loop of the bot."""
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
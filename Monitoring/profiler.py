@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from Monitoring.metrics import counter, histogram
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# On-demand profiling of a running process, without restarting it or installing anything:
+# - a sampling profiler: every PROFILE_INTERVAL_MS the stacks of all the threads are read (sys._current_frames)
+#   and counted, for a bounded time. The result is in the "collapsed stacks" format of flamegraph.pl and speedscope
+#   (one line per stack: frames separated by ';', then the number of samples). It measures wall-clock time: the
+#   threads waiting (select, locks, sockets) appear too, which is what shows a blocked event loop. The sampler is a
+#   Python thread: it runs when the others release the GIL or at the switch interval (5 ms), so under CPU load it
+#   takes fewer samples, and code releasing the GIL very often (I/O polling) is somewhat over-represented.
+# - the event-loop lag of the bots: how late the loop runs a callback that should run every LOOP_LAG_INTERVAL_MS.
+#   A watchdog thread logs the stack of the loop while it is blocked (synchronous DB calls, bcrypt...).
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 60))
+LOOP_LAG_INTERVAL_MS = float(os.environ.get("LOOP_LAG_INTERVAL_MS", 100))
+LOOP_LAG_THRESHOLD_MS = float(os.environ.get("LOOP_LAG_THRESHOLD_MS", 200)) # Blocked longer than this: the stack is logged
+LOOP_LAG_STACK_DEPTH = 12 # Innermost frames logged
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+loop_lag = histogram("event_loop_lag_seconds", "Delay of the event loop in running a callback that was due.", buckets=LAG_BUCKETS)
+loop_blocked = counter("event_loop_blocked_total", "Times the event loop was blocked for more than LOOP_LAG_THRESHOLD_MS.")
+
+logger = logging.getLogger(__name__)
+
+# ---- SAMPLING PROFILER ----
+profile_lock = threading.Lock() # One profile at a time in a process
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def collapse(frame, thread_name):
+    """Stack of a thread as 'thread;outermost function;...;innermost function'."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL_MS / 1000):
+    """
+    Samples the stacks of all the threads (except the calling one) for `seconds` (at most PROFILE_MAX_SECONDS).
+    Returns (Counter collapsed stack -> samples, number of samples). Raises RuntimeError if a profile is already running.
+    """
+    if not profile_lock.acquire(blocking=False):
+        raise RuntimeError("a profile of this process is already running")
+    try:
+        own_thread = threading.get_ident()
+        stacks, samples = Counter(), 0
+        names, names_refreshed = {}, 0.0
+        deadline = time.perf_counter() + min(max(seconds, 0.0), PROFILE_MAX_SECONDS)
+        while True:
+            now = time.perf_counter()
+            if now - names_refreshed > 1.0:
+                names, names_refreshed = {thread.ident: thread.name for thread in threading.enumerate()}, now
+            for ident, frame in sys._current_frames().items():
+                if ident != own_thread:
+                    stacks[collapse(frame, names.get(ident, f"Thread-{ident}"))] += 1
+            samples += 1
+            if now >= deadline:
+                return stacks, samples
+            time.sleep(interval)
+    finally:
+        profile_lock.release()
+
+def format_collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+def top_functions(stacks, samples, limit=10, thread=None):
+    """Innermost functions by number of samples (of one thread if given), as text lines with the share of the samples."""
+    leaves = Counter()
+    for stack, count in stacks.items():
+        if thread is None or stack.startswith(thread + ";"):
+            leaves[stack.rsplit(";", 1)[-1]] += count
+    return [f"{count / samples:>5.0%} {function}" for function, count in leaves.most_common(limit)]
+
+# ---- EVENT LOOP LAG ----
+class LoopLagMonitor:
+    """
+    Measures the lag of the running event loop, and logs the stack of the loop thread when it stays blocked for
+    more than LOOP_LAG_THRESHOLD_MS. The lag measured by the loop itself is only known once the loop is free again,
+    so the stack is taken by a watchdog thread that sees the heartbeat of the loop stop while the blocking call runs.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL_MS / 1000, threshold=LOOP_LAG_THRESHOLD_MS / 1000):
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.max_lag = 0.0
+        self.stopped = threading.Event()
+        self.task = None
+
+    def start(self):
+        """Called from a coroutine running in the loop to watch."""
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self.measure())
+        threading.Thread(target=self.watch, name="loop-lag-watchdog", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def measure(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+            self.heartbeat = now
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag.observe(lag)
+
+    def watch(self):
+        reported = None # Heartbeat of the stall already reported: one log per stall
+        while not self.stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            loop_blocked.inc()
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)[-LOOP_LAG_STACK_DEPTH:]) if frame is not None else "(stack not available)\n"
+            logger.warning("Event loop blocked for %.0f ms so far, in:\n%s", blocked * 1000, stack)
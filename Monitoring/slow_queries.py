@@ -0,0 +1,325 @@
+import argparse
+import atexit
+import glob
+import hashlib
+import json
+import math
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extensions import cursor
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+import Monitoring.tracing as tracing
+
+load_dotenv()  # The settings below are read at import, before the services load the .env themselves
+
+# ---- SETTINGS ----
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100)) # Statements slower than this are logged
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "slow_queries.jsonl")
+# Share of the slow statements whose plan is captured, at most once per statement every EXPLAIN_INTERVAL seconds
+EXPLAIN_SAMPLE_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+EXPLAIN_INTERVAL = float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", 300))
+EXPLAIN_TIMEOUT_MS = float(os.environ.get("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 5000)) # statement_timeout of a plan capture
+EXPLAIN_QUEUE_SIZE = 100 # Slow statements waiting for their plan; beyond that they are logged without it
+# Every process saves its per-statement statistics here; the report merges the files of all the processes
+QUERY_STATS_DIR = os.environ.get("QUERY_STATS_DIR", "query_stats")
+QUERY_STATS_FLUSH_SECONDS = float(os.environ.get("QUERY_STATS_FLUSH_SECONDS", 60))
+MAX_STATEMENTS = 2000 # Distinct normalized statements tracked by a process
+
+# Latency histogram with geometric buckets (+20% each, from 10 µs): percentiles within 10%, and the histograms
+# of different processes can be merged by adding the counts
+BUCKET_BASE_MS = 0.01
+BUCKET_GROWTH = 1.2
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+# SELECTs that lock rows or take advisory locks are not executed again by EXPLAIN ANALYZE
+ANALYZE_UNSAFE = re.compile(r"\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(?:KEY\s+)?SHARE\b|\bpg_advisory|\bpg_sleep|\bnextval|\bsetval", re.I)
+
+# ---- NORMALIZATION ----
+COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+STRING_LITERALS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?(?![\w.])")
+PLACEHOLDERS = re.compile(r"%\(\w+\)s|%s")
+VALUE_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)") # IN (?, ?, ?) and VALUES (?, ?), (?, ?)...
+REPEATED_LISTS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+WHITESPACE = re.compile(r"\s+")
+
+normalized_cache = {} # raw statement -> (normalized statement, fingerprint)
+
+def normalize_sql(query):
+    """Returns the statement with the literals and the parameters replaced by ?, and its fingerprint."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)
+    cached = normalized_cache.get(query)
+    if cached is not None:
+        return cached
+
+    normalized = COMMENTS.sub(" ", query)
+    normalized = STRING_LITERALS.sub("?", normalized)
+    normalized = PLACEHOLDERS.sub("?", normalized)
+    normalized = NUMBERS.sub("?", normalized)
+    normalized = WHITESPACE.sub(" ", normalized).strip().rstrip(";").strip()
+    normalized = REPEATED_LISTS.sub("(?)", VALUE_LISTS.sub("(?)", normalized))
+    result = (normalized, hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16])
+
+    if len(normalized_cache) >= 4096:
+        normalized_cache.clear() # The statements built with f-strings (LIMIT/OFFSET values) would fill it
+    normalized_cache[query] = result
+    return result
+
+def redact_params(vars):
+    """Only the types of the parameters are logged (they contain passwords, names, e-mails)."""
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {key: type(value).__name__ for key, value in vars.items()}
+    return [type(value).__name__ for value in vars]
+
+def redact_plan(plan):
+    # The plans show the values bound in the conditions, e.g. Filter: (username = 'alice')
+    return STRING_LITERALS.sub("'?'", plan)
+
+# ---- STATISTICS ----
+class StatementStats:
+    __slots__ = ("statement", "calls", "total_ms", "max_ms", "buckets")
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = {} # bucket index -> count
+
+    def add(self, elapsed_ms):
+        index = max(0, math.ceil(math.log(max(elapsed_ms, BUCKET_BASE_MS) / BUCKET_BASE_MS, BUCKET_GROWTH)))
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def to_dict(self):
+        return {"statement": self.statement, "calls": self.calls, "total_ms": self.total_ms, "max_ms": self.max_ms, "buckets": self.buckets}
+
+stats_lock = threading.Lock()
+statement_stats = {} # fingerprint -> StatementStats
+last_explain = {} # fingerprint -> time of the last EXPLAIN
+flusher_started = False
+
+def record_query(cur, query, vars, elapsed, explain=True):
+    """Called by the instrumented cursor after every successful statement."""
+    normalized, fingerprint = normalize_sql(query)
+    elapsed_ms = elapsed * 1000
+    with stats_lock:
+        stats = statement_stats.get(fingerprint)
+        if stats is None:
+            if len(statement_stats) >= MAX_STATEMENTS:
+                stats = statement_stats.setdefault("other", StatementStats("(other statements)"))
+            else:
+                stats = statement_stats[fingerprint] = StatementStats(normalized)
+        stats.add(elapsed_ms)
+    start_stats_flusher()
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        log_slow_query(cur, query, vars, normalized, fingerprint, elapsed_ms, explain)
+
+def log_slow_query(cur, query, vars, normalized, fingerprint, elapsed_ms, explain_allowed=True):
+    span = tracing.current_span.get()
+    record = {
+        "time": round(time.time(), 3), "service": tracing.service_name, "fingerprint": fingerprint,
+        "duration_ms": round(elapsed_ms, 3), "statement": normalized, "params": redact_params(vars),
+        "rows": cur.rowcount, "trace_id": span.trace_id if span is not None else None,
+    }
+    if explain_allowed and should_explain(normalized, fingerprint):
+        try:
+            statement = cur.mogrify(query, vars)
+        except Exception:
+            statement = None
+        if statement is not None and queue_explain(cur.connection, record, statement, analyze_allowed(normalized)):
+            return # The worker appends the record once the plan is captured
+    append_line(SLOW_QUERY_LOG, record)
+
+def should_explain(normalized, fingerprint):
+    if not normalized.upper().startswith(EXPLAINABLE) or random.random() >= EXPLAIN_SAMPLE_RATE:
+        return False
+    now = time.monotonic()
+    with stats_lock:
+        if now - last_explain.get(fingerprint, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+            return False
+        last_explain[fingerprint] = now
+    return True
+
+def analyze_allowed(normalized):
+    """Only the plain SELECTs are executed again by EXPLAIN ANALYZE: the other statements get the estimated plan."""
+    return normalized.upper().startswith("SELECT") and not ANALYZE_UNSAFE.search(normalized)
+
+# ---- EXPLAIN ----
+# The plans are captured by a worker thread on its own connection: the request that ran the slow statement
+# does not wait for them, and nothing runs on its connection (its transaction and its session are untouched).
+# The worker does not see the uncommitted changes of that transaction: the plan is the one of the committed data.
+explain_queue = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+explain_worker_started = False
+
+def queue_explain(conn, record, statement, analyze):
+    """Hands the statement to the EXPLAIN worker; returns False when the queue is full (the plan is skipped)."""
+    global explain_worker_started
+    if not explain_worker_started:
+        with stats_lock:
+            if not explain_worker_started:
+                threading.Thread(target=explain_worker, daemon=True, name="slow-query-explain").start()
+                explain_worker_started = True
+    info = conn.info
+    params = {"host": info.host, "port": info.port, "dbname": info.dbname, "user": info.user, "password": info.password}
+    try:
+        explain_queue.put_nowait((params, record, statement, analyze))
+        return True
+    except queue.Full:
+        return False
+
+def explain_worker():
+    connections = {} # Connection parameters -> connection of the worker
+    while True:
+        params, record, statement, analyze = explain_queue.get()
+        key = tuple(sorted(params.items()))
+        try:
+            conn = connections.get(key)
+            if conn is None or conn.closed:
+                conn = connections[key] = psycopg2.connect(**params, cursor_factory=cursor) # Plain cursors: the EXPLAINs are not recorded
+            record["plan"] = explain(conn, statement, analyze)
+        except Exception as e:
+            record["plan"] = f"EXPLAIN failed: {type(e).__name__}"
+            conn = connections.pop(key, None)
+            if conn is not None:
+                conn.close()
+        append_line(SLOW_QUERY_LOG, record)
+
+def explain(conn, statement, analyze):
+    """
+    Returns the plan of the statement (already bound with cursor.mogrify), with EXPLAIN (ANALYZE, BUFFERS) for the
+    SELECTs accepted by analyze_allowed() and with a plain EXPLAIN, which executes nothing, for the others.
+    The statement runs in a read-only transaction that is rolled back, under EXPLAIN_TIMEOUT_MS.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN READ ONLY")
+        cur.execute("SET LOCAL statement_timeout = %s", (int(EXPLAIN_TIMEOUT_MS),))
+        try:
+            cur.execute((b"EXPLAIN (ANALYZE, BUFFERS) " if analyze else b"EXPLAIN ") + statement)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+        except psycopg2.Error as e:
+            plan = f"EXPLAIN failed: {type(e).__name__}"
+        cur.execute("ROLLBACK")
+        return redact_plan(plan)
+    finally:
+        cur.close()
+
+# ---- FILES ----
+append_lock = threading.Lock()
+append_fds = {}
+
+def append_line(path, record):
+    line = (json.dumps(record, default=str, separators=(",", ":")) + "\n").encode("utf-8")
+    with append_lock:
+        fd = append_fds.get(path)
+        if fd is None:
+            fd = append_fds[path] = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(fd, line) # One write per line: the processes can share the log
+
+def save_stats():
+    with stats_lock:
+        snapshot = {fingerprint: stats.to_dict() for fingerprint, stats in statement_stats.items()}
+    if not snapshot:
+        return
+    os.makedirs(QUERY_STATS_DIR, exist_ok=True)
+    path = os.path.join(QUERY_STATS_DIR, f"{tracing.service_name}-{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"service": tracing.service_name, "pid": os.getpid(), "saved_at": time.time(), "statements": snapshot}, f)
+    os.replace(path + ".tmp", path)
+
+def start_stats_flusher():
+    global flusher_started
+    if flusher_started:
+        return
+    with stats_lock:
+        if flusher_started:
+            return
+        flusher_started = True
+
+    def flush_periodically():
+        while True:
+            time.sleep(QUERY_STATS_FLUSH_SECONDS)
+            try:
+                save_stats()
+            except OSError as e:
+                print(f"Query statistics not saved: {e}")
+
+    threading.Thread(target=flush_periodically, name="query-stats", daemon=True).start()
+    atexit.register(save_stats)
+
+# ---- REPORT ----
+def bucket_upper_ms(index):
+    return BUCKET_BASE_MS * BUCKET_GROWTH ** index
+
+def percentile_ms(entry, p):
+    rank = max(1, math.ceil(entry["calls"] * p / 100))
+    seen = 0
+    for index in sorted(entry["buckets"]):
+        seen += entry["buckets"][index]
+        if seen >= rank:
+            return min(bucket_upper_ms(index), entry["max_ms"]) # The upper bound of the bucket, at most the real maximum
+    return 0.0
+
+def load_stats(stats_dir=QUERY_STATS_DIR, service=None):
+    """Merges the statistics saved by all the processes (optionally of one service only)."""
+    merged = {}
+    for path in glob.glob(os.path.join(stats_dir, "*.json")):
+        with open(path) as f:
+            data = json.load(f)
+        if service and data.get("service") != service:
+            continue
+        for fingerprint, stats in data["statements"].items():
+            entry = merged.setdefault(fingerprint, {"statement": stats["statement"], "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": {}})
+            entry["calls"] += stats["calls"]
+            entry["total_ms"] += stats["total_ms"]
+            entry["max_ms"] = max(entry["max_ms"], stats["max_ms"])
+            for index, count in stats["buckets"].items():
+                entry["buckets"][int(index)] = entry["buckets"].get(int(index), 0) + count
+    return merged
+
+def print_report(merged, top=20, order="total"):
+    keys = {"total": lambda e: e["total_ms"], "p99": lambda e: percentile_ms(e, 99), "calls": lambda e: e["calls"]}
+    entries = sorted(merged.values(), key=keys[order], reverse=True)[:top]
+    print(f"{'calls':>8} {'total s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  statement")
+    for e in entries:
+        statement = e["statement"] if len(e["statement"]) <= 100 else e["statement"][:97] + "..."
+        print(f"{e['calls']:>8} {e['total_ms'] / 1000:>9.2f} {percentile_ms(e, 50):>9.2f} {percentile_ms(e, 99):>9.2f} {e['max_ms']:>9.2f}  {statement}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-statement latency report (p50/p99) of all the processes using the instrumented cursor.")
+    parser.add_argument("--top", type=int, default=20, help="Statements shown")
+    parser.add_argument("--order", choices=("total", "p99", "calls"), default="total", help="Sort order")
+    parser.add_argument("--service", help="Only the statements of this service (calendar, bot, ...)")
+    parser.add_argument("--reset", action="store_true", help="Delete the saved statistics after the report")
+    args = parser.parse_args()
+
+    merged = load_stats(QUERY_STATS_DIR, args.service)
+    if not merged:
+        print(f"No statistics in {QUERY_STATS_DIR}/ yet (saved every {QUERY_STATS_FLUSH_SECONDS:.0f} s and at exit by every process).")
+        return
+    print_report(merged, args.top, args.order)
+    print(f"\nSlow statements (> {SLOW_QUERY_MS:.0f} ms) with their plans: {SLOW_QUERY_LOG}")
+    if args.reset:
+        for path in glob.glob(os.path.join(QUERY_STATS_DIR, "*.json")):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dotenv import load_dotenv
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+load_dotenv()  # The settings below are read at import, before the services load the .env themselves
+
+# Minimal distributed tracing with W3C trace context propagation (https://www.w3.org/TR/trace-context/):
+# the bot starts a trace for every update, the `traceparent` header carries it to the Calendar and login
+# services, which continue it down to the SQL statements. The spans of all the processes are written as
+# JSON lines to TRACE_FILE (or to the console), one line per finished span: no collector is needed,
+# the spans of a slow tap are found with  grep <trace_id> traces.jsonl
+# Off by default: with TRACE_EXPORTER=file every sampled span is a line, keep a low sample rate in production.
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none") # file, console or none
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_FILE_MAX_MB = float(os.environ.get("TRACE_FILE_MAX_MB", 100)) # The spans are dropped once the file is this large
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01)) # Share of the new traces that are recorded
+# Services that receive the trace headers (never sent to PayPal, Google or Telegram)
+PROPAGATION_ENV_VARS = ("CALENDAR_SERVICE_URL", "GESTIONE_UTENTI_URL", "TRACE_PROPAGATE_URLS")
+
+current_span = contextvars.ContextVar("current_span", default=None)
+service_name = "unknown"
+
+def set_service_name(name):
+    global service_name
+    service_name = name
+
+# ---- SPANS ----
+class SpanContext:
+    """Identifies the remote parent of a span (extracted from a traceparent header)."""
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+class Span(SpanContext):
+    __slots__ = ("name", "parent_id", "kind", "attributes", "status", "start_time", "start")
+
+    def __init__(self, name, parent=None, kind="internal", attributes=None):
+        if parent is None:
+            super().__init__(os.urandom(16).hex(), os.urandom(8).hex(), random.random() < TRACE_SAMPLE_RATE)
+            self.parent_id = None
+        else:
+            super().__init__(parent.trace_id, os.urandom(8).hex(), parent.sampled)
+            self.parent_id = parent.span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, exception):
+        self.status = "error"
+        self.attributes["error"] = f"{type(exception).__name__}: {exception}"
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self):
+        if self.sampled:
+            export({
+                "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "name": self.name, "service": service_name, "kind": self.kind,
+                "start": round(self.start_time, 6), "duration_ms": round((time.perf_counter() - self.start) * 1000, 3),
+                "status": self.status, "attributes": self.attributes,
+            })
+
+@contextmanager
+def start_span(name, parent=None, kind="internal", **attributes):
+    """Starts a span, child of `parent` or of the current span (a new trace if there is none), and makes it current."""
+    span = Span(name, parent if parent is not None else current_span.get(), kind, attributes)
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        current_span.reset(token)
+        span.end()
+
+def tracing_active():
+    span = current_span.get()
+    return span is not None and span.sampled
+
+def child_span(name, kind="internal", **attributes):
+    """Span recorded only inside a sampled trace: the queries of the setup scripts or of the sweeper start no trace."""
+    if not tracing_active():
+        return nullcontext()
+    return start_span(name, current_span.get(), kind, **attributes)
+
+# ---- PROPAGATION ----
+def parse_traceparent(header):
+    """Returns the SpanContext of a traceparent header, or None if missing or malformed."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3][:2], 16) & 1)
+    except ValueError:
+        return None
+    return SpanContext(parts[1].lower(), parts[2].lower(), sampled)
+
+def propagation_targets():
+    # Read at every call: the URLs come from the .env file, loaded after the imports
+    targets = []
+    for variable in PROPAGATION_ENV_VARS:
+        targets.extend(url.strip().rstrip("/") for url in os.environ.get(variable, "").split(",") if url.strip())
+    return targets
+
+def inject_headers(headers, url):
+    """Adds the traceparent of the current span to `headers` if the request goes to one of our services."""
+    span = current_span.get()
+    if span is None:
+        return
+    url = str(url)
+    if any(url.startswith(target) for target in propagation_targets()):
+        headers["traceparent"] = span.traceparent()
+
+# ---- EXPORT ----
+export_lock = threading.Lock()
+export_fd = None
+export_full = False
+
+def export(record):
+    global export_fd, export_full
+    if TRACE_EXPORTER == "none" or export_full:
+        return
+    line = json.dumps(record, default=str, separators=(",", ":")) + "\n"
+    if TRACE_EXPORTER == "console":
+        sys.stderr.write(line)
+        return
+    with export_lock:
+        if export_fd is None:
+            export_fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.fstat(export_fd).st_size >= TRACE_FILE_MAX_MB * 1024 * 1024:
+            export_full = True
+            print(f"{TRACE_FILE} reached TRACE_FILE_MAX_MB ({TRACE_FILE_MAX_MB:g} MB): spans no longer exported", file=sys.stderr)
+            return
+        # One write per line in append mode: the processes of the webhook mode share the file without mixing lines
+        os.write(export_fd, line.encode("utf-8"))
@@ -0,0 +1,95 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+from flask import g, request
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+# Opt-in capture of the traffic of the Flask services (TRAFFIC_CAPTURE=1): a sample of the requests is appended
+# as JSON lines (time, method, path, body, status, server time) to TRAFFIC_CAPTURE_FILE, to be re-issued by
+# Benchmarks/traffic_replay.py against another instance. The credentials are redacted before anything is written.
+TRAFFIC_CAPTURE = os.environ.get("TRAFFIC_CAPTURE", "0") == "1"
+TRAFFIC_CAPTURE_FILE = os.environ.get("TRAFFIC_CAPTURE_FILE", "traffic_capture.jsonl")
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", 1))
+MAX_BODY_BYTES = int(os.environ.get("TRAFFIC_CAPTURE_MAX_BODY", 65536)) # Larger bodies (poster uploads) are recorded by size only
+REDACTED = "REDACTED"
+# Keys (JSON fields, form fields, query parameters) whose value is never written: credentials and signed tickets
+# (check-in body, "scans" of the batch check-in) contain these words, the personal data of a registration are these keys
+SECRET_KEYS = ("password", "secret", "token", "authorization", "api_key", "apikey", "code", "credential", "session", "cookie", "ticket")
+PERSONAL_KEYS = ("name", "surname", "birthdate", "username", "telegram_id")
+CAPTURED_HEADERS = ("Content-Type", "Accept") # Authorization, cookies and the rest are not needed to replay
+
+def is_secret(key):
+    key = str(key).lower()
+    return key in PERSONAL_KEYS or any(secret in key for secret in SECRET_KEYS)
+
+def redact(value):
+    """Returns a copy of a decoded JSON body with the values of the credential keys replaced."""
+    if isinstance(value, dict):
+        return {key: REDACTED if is_secret(key) and item is not None else redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+def redact_query(query_string):
+    return urlencode([(key, REDACTED if is_secret(key) else item) for key, item in parse_qsl(query_string, keep_blank_values=True)])
+
+def captured_body(content_type, data):
+    """The body as it will be replayed: JSON and forms are decoded and redacted, the rest is recorded by size only."""
+    if not data:
+        return {}
+    if len(data) > MAX_BODY_BYTES:
+        return {"body_size": len(data)}
+    if content_type.startswith("application/json"):
+        try:
+            return {"json": redact(json.loads(data))}
+        except ValueError:
+            pass
+    elif content_type.startswith("application/x-www-form-urlencoded"):
+        return {"form": redact_query(data.decode("utf-8", "replace"))}
+    return {"body_size": len(data)}
+
+# ---- OUTPUT ----
+capture_lock = threading.Lock()
+capture_fd = None
+
+def write_record(record):
+    global capture_fd
+    line = (json.dumps(record, default=str, separators=(",", ":")) + "\n").encode("utf-8")
+    with capture_lock:
+        if capture_fd is None:
+            capture_fd = os.open(TRAFFIC_CAPTURE_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(capture_fd, line) # One write per line: the services can share the file
+
+# ---- MIDDLEWARE ----
+def install_capture(app, service):
+    """Records a sample of the requests of the app, if TRAFFIC_CAPTURE=1 (called by instrument_flask)."""
+    if not TRAFFIC_CAPTURE:
+        return
+
+    @app.before_request
+    def start_capture():
+        if request.path == "/metrics" or random.random() >= TRAFFIC_CAPTURE_SAMPLE_RATE:
+            return
+        g.capture_start = (time.time(), time.perf_counter())
+
+    @app.after_request
+    def capture(response):
+        start = g.pop("capture_start", None)
+        if start is None:
+            return response
+        record = {
+            "ts": round(start[0], 6), "service": service, "method": request.method,
+            "route": request.url_rule.rule if request.url_rule is not None else None,
+            "path": request.path, "query": redact_query(request.query_string.decode("utf-8", "replace")),
+            "headers": {name: request.headers[name] for name in CAPTURED_HEADERS if name in request.headers},
+            "status": response.status_code, "duration_ms": round((time.perf_counter() - start[1]) * 1000, 3),
+            "response_size": response.calculate_content_length(),
+        }
+        record.update(captured_body(request.content_type or "", request.get_data(cache=True)))
+        write_record(record)
+        return response
@@ -3,14 +3,20 @@ import requests
 from dotenv import load_dotenv
 from requests.auth import HTTPBasicAuth
 
+PAYPAL_API_URL = os.environ.get("PAYPAL_API_URL", "https://api-m.sandbox.paypal.com") # A local fake PayPal in the benchmarks
+
 def test_paypal():
+    return create_order("Lezione singola", "50.00")[1]
+
+# Creates a PayPal order for the given product and returns its (order id, approval link)
+def create_order(description, price):
     # Redirect URLs (InstaTunnel)
     RETURN_URL = "https://barcarolograziadei-payment.instatunnel.my/confirm_order"
     CANCEL_URL = "https://barcarolograziadei-payment.instatunnel.my/cancel"
 
     # PayPal API URLs
-    TOKEN_URL = "https://api-m.sandbox.paypal.com/v1/oauth2/token"
-    ORDER_URL = "https://api-m.sandbox.paypal.com/v2/checkout/orders"
+    TOKEN_URL = f"{PAYPAL_API_URL}/v1/oauth2/token"
+    ORDER_URL = f"{PAYPAL_API_URL}/v2/checkout/orders"
 
     # Loads variables from .env file (ID and SECRET of the seller paypal sandbox account)
     load_dotenv()  
@@ -34,10 +40,10 @@ def test_paypal():
         "intent": "CAPTURE",
         "purchase_units": [
             {
-                "description": "Lezione singola",   # Description of the product
+                "description": description,   # Description of the product
                 "amount": {
                     "currency_code": "EUR",
-                    "value": "50.00"    # Price (EURO)
+                    "value": str(price)    # Price (EURO)
                 }
             }
         ],
@@ -52,4 +58,4 @@ def test_paypal():
 
     # Extract the redirect link from the json response
     approve_link = next(link["href"] for link in order["links"] if link["rel"] == "approve")
-    return approve_link
\ No newline at end of file
+    return order["id"], approve_link
\ No newline at end of file
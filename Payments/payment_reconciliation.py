@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+import httpx
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+
+PAYPAL_API_URL = os.environ.get("PAYPAL_API_URL", "https://api-m.sandbox.paypal.com") # A local fake PayPal in the benchmarks
+
+# PayPal order statuses that close a pending reservation
+FINAL_STATUSES = {
+    "COMPLETED": "paid",
+    "VOIDED": "failed",
+}
+
+# Statuses of an order the user never paid: once the hold has expired, its reservation is released (the hold sweeper
+# does it, see Calendar/hold_sweeper.py). /success no longer captures an order without a pending reservation.
+ABANDONED_STATUSES = {"CREATED", "SAVED", "APPROVED", "PAYER_ACTION_REQUIRED"}
+
+# This function performs the connection to the database
+def connect_db():
+    """Establishes a connection to the PostgreSQL database."""
+    try:
+        conn = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD")
+        )
+        return conn
+    except psycopg2.Error as e:
+        print(f"DB connection error: {e}")
+        return None
+
+
+class RateLimiter:
+    """Spaces out the start of outgoing requests so that at most `rate` requests per second are sent."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_slot > now:
+                await asyncio.sleep(self.next_slot - now)
+                now = self.next_slot
+            self.next_slot = now + self.interval
+
+    def pause(self, seconds):
+        # Called when PayPal answers 429: nobody sends anything before the Retry-After delay
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+async def get_access_token(client):
+    """Fetches an access token using the credentials of the seller account."""
+    auth = (os.environ.get("BUSINESS_PAYPAL_ID"), os.environ.get("BUSINESS_PAYPAL_SECRET"))
+    if not all(auth):
+        raise RuntimeError("BUSINESS_PAYPAL_ID and BUSINESS_PAYPAL_SECRET must be set")
+    token_res = await client.post(f"{PAYPAL_API_URL}/v1/oauth2/token", data={"grant_type": "client_credentials"}, auth=auth)
+    token_res.raise_for_status()
+    return token_res.json()["access_token"]
+
+
+async def fetch_order_status(client, access_token, order_id, semaphore, limiter, max_retries=3):
+    """
+    Returns the PayPal status of the given order (e.g. 'COMPLETED'), 'NOT_FOUND' if PayPal does not know it,
+    or raises an exception if the status could not be retrieved.
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    async with semaphore:
+        for attempt in range(max_retries + 1):
+            await limiter.wait()
+            res = await client.get(f"{PAYPAL_API_URL}/v2/checkout/orders/{order_id}", headers=headers)
+            if res.status_code == 429 and attempt < max_retries:
+                limiter.pause(float(res.headers.get("Retry-After", 2 ** attempt)))
+                continue
+            if res.status_code == 404:
+                return "NOT_FOUND"
+            res.raise_for_status()
+            return res.json()["status"]
+
+
+# Applies the statuses found on PayPal to the reservations that are still pending, in a single statement.
+# A completed order marks its reservation as paid. A voided (or unknown) order deletes it and gives its seat and its
+# place in the role balance back, as a cancellation does: the user can book the event again.
+APPLY_CORRECTIONS_QUERY = """
+    WITH v (reservation_id, payment_status) AS (VALUES %s),
+    paid AS (
+        UPDATE reservations AS r SET payment_status = 'paid', paid_at = NOW()
+        FROM v WHERE r.reservation_id = v.reservation_id AND v.payment_status = 'paid' AND r.payment_status = 'pending'
+        RETURNING r.reservation_id
+    ), failed AS (
+        DELETE FROM reservations AS r USING v
+        WHERE r.reservation_id = v.reservation_id AND v.payment_status = 'failed' AND r.payment_status = 'pending'
+        RETURNING r.event_id, r.role
+    ), freed AS (
+        SELECT event_id, COUNT(*) AS seats,
+               COUNT(*) FILTER (WHERE role = 'leader') AS leaders,
+               COUNT(*) FILTER (WHERE role = 'follower') AS followers
+        FROM failed GROUP BY event_id
+    ), released AS (
+        UPDATE events SET
+            remaining_seats = remaining_seats + freed.seats,
+            leaders_count = leaders_count - freed.leaders,
+            followers_count = followers_count - freed.followers
+        FROM freed WHERE events.event_id = freed.event_id
+    )
+    SELECT (SELECT COUNT(*) FROM paid) + (SELECT COUNT(*) FROM failed);
+"""
+
+def apply_corrections(conn, corrections):
+    """
+    Updates the given (reservation_id, payment_status) pairs in a single transaction: 'paid' reservations are
+    marked as paid, 'failed' ones are deleted and their seats released.
+    Rows that stopped being 'pending' in the meantime are left untouched.
+    Returns the number of updated rows.
+    """
+    try:
+        cur = conn.cursor()
+        updated = execute_values(cur, APPLY_CORRECTIONS_QUERY, corrections, page_size=len(corrections), fetch=True)[0][0]
+        conn.commit()
+        return updated
+    except psycopg2.Error as e:
+        print(f"Error while applying corrections: {e}")
+        conn.rollback()
+        raise
+
+
+async def reconcile(batch_size=100, concurrency=5, rate=10.0, min_age_minutes=15, dry_run=False, release_abandoned=False):
+    """
+    Streams the pending reservations that have a PayPal order, asks PayPal for the status of each order
+    and fixes the reservations whose order is already completed (or voided, or abandoned if `release_abandoned`).
+    Returns a dictionary with the number of checked, fixed and failed rows.
+    """
+    summary = {"checked": 0, "fixed": 0, "failed": 0}
+
+    read_conn = connect_db()
+    write_conn = connect_db()
+    if read_conn is None or write_conn is None:
+        raise RuntimeError("Impossible to connect to the database")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+
+    try:
+        # Named cursor: rows are streamed from the server instead of being loaded all at once
+        cur = read_conn.cursor(name="pending_reservations")
+        cur.itersize = batch_size
+        cur.execute("""
+            SELECT reservation_id, paypal_order_id FROM reservations
+            WHERE payment_status = 'pending' AND paypal_order_id IS NOT NULL
+              AND created_at < NOW() - make_interval(mins => %s)
+            ORDER BY reservation_id
+            """, (min_age_minutes,))
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            access_token = None
+
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                if access_token is None:
+                    access_token = await get_access_token(client) # Only when there is something to check
+
+                statuses = await asyncio.gather(
+                    *(fetch_order_status(client, access_token, order_id, semaphore, limiter) for _, order_id in rows),
+                    return_exceptions=True
+                )
+
+                corrections = []
+                for (reservation_id, order_id), status in zip(rows, statuses):
+                    summary["checked"] += 1
+                    if isinstance(status, Exception):
+                        print(f"Impossible to check order {order_id} (reservation {reservation_id}): {status}")
+                        summary["failed"] += 1
+                    elif status == "NOT_FOUND":
+                        corrections.append((reservation_id, "failed"))
+                    elif status in FINAL_STATUSES:
+                        corrections.append((reservation_id, FINAL_STATUSES[status]))
+                    elif release_abandoned and status in ABANDONED_STATUSES:
+                        corrections.append((reservation_id, "failed"))
+
+                if not corrections:
+                    continue
+                if dry_run:
+                    summary["fixed"] += len(corrections)
+                    continue
+                try:
+                    summary["fixed"] += apply_corrections(write_conn, corrections)
+                except psycopg2.Error:
+                    summary["failed"] += len(corrections)
+
+        cur.close()
+    finally:
+        read_conn.close()
+        write_conn.close()
+
+    return summary
+
+
+if __name__ == "__main__":
+    load_dotenv()  # Loads variables from .env into environment
+
+    parser = argparse.ArgumentParser(description="Fix pending reservations whose PayPal order is already completed.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Rows fetched and corrected per transaction")
+    parser.add_argument("--concurrency", type=int, default=5, help="Maximum number of concurrent PayPal requests")
+    parser.add_argument("--rate", type=float, default=10.0, help="Maximum number of PayPal requests per second")
+    parser.add_argument("--min-age", type=int, default=15, help="Ignore reservations created less than N minutes ago")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be fixed")
+    parser.add_argument("--release-abandoned", action="store_true",
+                        help="Also release the reservations whose order was never paid (use a --min-age above the hold TTL)")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    summary = asyncio.run(reconcile(args.batch_size, args.concurrency, args.rate, args.min_age, args.dry_run, args.release_abandoned))
+    print(f"Reconciliation completed in {time.monotonic() - start:.1f}s: "
+          f"{summary['checked']} checked, {summary['fixed']} fixed, {summary['failed']} failed to fix.")
@@ -1,22 +1,65 @@
 import os
+import sys
 from flask import Flask, render_template_string, request
 from dotenv import load_dotenv
 import requests
 from requests.auth import HTTPBasicAuth
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Monitoring.flask_metrics import instrument_flask
+from Monitoring.http_metrics import install_http_metrics
+from PostgreSQL_DB.setup_tables import connect_db
+
 BUSINESS_PAYPAL_ID = os.environ.get("BUSINESS_PAYPAL_ID")
 BUSINESS_PAYPAL_SECRET = os.environ.get("BUSINESS_PAYPAL_SECRET")
+PAYPAL_API_URL = os.environ.get("PAYPAL_API_URL", "https://api-m.sandbox.paypal.com") # A local fake PayPal in the benchmarks
+# Seconds allowed to every PayPal call: the capture runs while the reservation row is locked
+PAYPAL_TIMEOUT = float(os.environ.get("PAYPAL_TIMEOUT", 10))
 
 app = Flask(__name__)
+instrument_flask(app, "payment") # Route latencies on /metrics
+install_http_metrics() # PayPal calls
 
 # This function fetches a new access token from PayPal sandbox using the credentials of the seller account
 def get_access_token():
-    TOKEN_URL = "https://api-m.sandbox.paypal.com/v1/oauth2/token"
+    TOKEN_URL = f"{PAYPAL_API_URL}/v1/oauth2/token"
     auth = HTTPBasicAuth(BUSINESS_PAYPAL_ID, BUSINESS_PAYPAL_SECRET)
     token_data = {"grant_type": "client_credentials"}
-    token_res = requests.post(TOKEN_URL, data=token_data, auth=auth)
+    token_res = requests.post(TOKEN_URL, data=token_data, auth=auth, timeout=PAYPAL_TIMEOUT)
+    token_res.raise_for_status()
     return token_res.json()["access_token"]
 
+# Fetches the status of an order directly from PayPal (used to trust a webhook notification only once verified)
+def get_order_status(order_id):
+    access_token = get_access_token()
+    ORDER_URL = f"{PAYPAL_API_URL}/v2/checkout/orders/{order_id}"
+    order_res = requests.get(ORDER_URL, headers={"Authorization": f"Bearer {access_token}"}, timeout=PAYPAL_TIMEOUT)
+    if order_res.status_code == 404:
+        return None
+    order_res.raise_for_status()
+    return order_res.json()["status"]
+
+# Marks as paid the held reservation of a completed order. Returns False if there is no pending reservation
+# for the order (already marked as paid, or the hold was released).
+def mark_order_paid(cur, order_id):
+    cur.execute(
+        "UPDATE reservations SET payment_status = 'paid', paid_at = NOW() WHERE paypal_order_id = %s AND payment_status = 'pending'",
+        (order_id,)
+    )
+    return cur.rowcount > 0
+
+# Payer, amount and time of a completed capture, for the confirmation page (None for the fields PayPal did not return)
+def capture_summary(capture_data):
+    try:
+        customer_name = capture_data["payer"]["name"]["given_name"] + " " + capture_data["payer"]["name"]["surname"]
+    except (KeyError, TypeError):
+        customer_name = None
+    try:
+        capture = capture_data["purchase_units"][0]["payments"]["captures"][0]
+        return customer_name, capture["amount"]["value"], capture["create_time"]
+    except (KeyError, IndexError, TypeError):
+        return customer_name, None, None
+
 # Homepage route
 @app.route("/")
 def homepage():
@@ -50,22 +93,61 @@ def payment_success():
     if not order_id:
         return "Missing order token", 400
 
-    access_token = get_access_token()
-
-    CAPTURE_URL = f"https://api-m.sandbox.paypal.com/v2/checkout/orders/{order_id}/capture"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
-    capture_res = requests.post(CAPTURE_URL, headers=headers)
-    capture_data = capture_res.json()
-
-    status = capture_data["status"]
-    customer_name = capture_data["payer"]["name"]["given_name"] + " " + capture_data["payer"]["name"]["surname"]
-    price_paid = capture_data["purchase_units"][0]["payments"]["captures"][0]["amount"]["value"]
-    datetime_paid = capture_data["purchase_units"][0]["payments"]["captures"][0]["create_time"]
+    conn = connect_db()
+    if conn is None:
+        return "Internal Server Error: impossible to connect to the database", 500
+
+    try:
+        # The held reservation is locked while the order is captured: the hold sweeper cannot release it in the
+        # meantime, and an order whose hold was already released is not captured (no payment without a seat)
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT reservation_id FROM reservations WHERE paypal_order_id = %s AND payment_status = 'pending' FOR UPDATE",
+            (order_id,)
+        )
+        if cur.fetchone() is None:
+            conn.rollback()
+            return render_template_string("<h1>Payment Not Completed</h1><p>Your seat hold has expired or was already paid. "
+                                          "Please go back to Telegram to book again.</p>")
+
+        access_token = get_access_token()
+
+        CAPTURE_URL = f"{PAYPAL_API_URL}/v2/checkout/orders/{order_id}/capture"
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {access_token}"
+        }
+        capture_res = requests.post(CAPTURE_URL, headers=headers, timeout=PAYPAL_TIMEOUT)
+        try:
+            capture_data = capture_res.json()
+        except ValueError:
+            capture_data = None # Not JSON (e.g. an error page of a proxy)
+        if not capture_res.ok or not isinstance(capture_data, dict):
+            print(f"Capture of the order {order_id} failed: HTTP {capture_res.status_code}")
+            capture_data = {}
+
+        status = str(capture_data.get("status", ""))
+        if status.upper() == "COMPLETED":
+            mark_order_paid(cur, order_id)
+        conn.commit()
+
+    except requests.RequestException as e:
+        # A timeout does not tell whether the order was captured: the webhook or the reconciliation settles it later
+        conn.rollback()
+        print(f"PayPal unreachable while capturing the order {order_id}: {e}")
+        return render_template_string("<h1>Payment Not Confirmed</h1><p>PayPal could not be reached. If you were charged, "
+                                      "your seat will be confirmed shortly: please check in Telegram.</p>"), 502
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error while capturing the order {order_id}: {e}")
+        return "Generic error during the payment", 500
+
+    finally:
+        conn.close()
 
     if status.upper() == "COMPLETED":
+        customer_name, price_paid, datetime_paid = capture_summary(capture_data)
         returned_msg = f"""
         <h1>Payment Successfully Completed</h1>
         <p>Status: {status}</p>
@@ -77,8 +159,6 @@ def payment_success():
     else:
         returned_msg = "<h1>Payment Refused</h1><p>Please try later.</p>"
 
-    # TODO: Insert payment details into your database here
-
     return render_template_string(returned_msg)
 
 @app.route("/cancel", methods=["GET", "POST"])
@@ -97,8 +177,20 @@ def paypal_webhook():
         currency = capture["amount"]["currency_code"]
         datetime_paid = capture["create_time"]
         print(f"[!] Payment received: {payer_name}, {amount} {currency}, at {datetime_paid}")
-        # Insert into your DB here
-        
+
+        # The notification is not signed: the order it refers to is marked as paid only if PayPal confirms it
+        order_id = capture.get("supplementary_data", {}).get("related_ids", {}).get("order_id")
+        if order_id and get_order_status(order_id) == "COMPLETED":
+            conn = connect_db()
+            if conn is None:
+                return "Internal Server Error: impossible to connect to the database", 500 # PayPal retries the notification
+            try:
+                cur = conn.cursor()
+                if not mark_order_paid(cur, order_id):
+                    print(f"[!] Order {order_id} completed but no pending reservation: already paid, or paid after its hold expired")
+                conn.commit()
+            finally:
+                conn.close()
 
     return "", 200  # Must return 200 to acknowledge PayPal
 
@@ -0,0 +1,336 @@
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from itertools import islice
+import bcrypt
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from PostgreSQL_DB.setup_tables import connect_db
+from PostgreSQL_DB.partition_maintenance import ensure_partitions
+
+# Synthetic data at production size (db_seeder.py only inserts 3 users, 3 events and 1 reservation).
+# Every row is derived from (seed, table, row index): the same arguments always give the same data,
+# whatever the number of workers. The rows are streamed to COPY FROM STDIN by generators, so the
+# memory used does not depend on the number of rows.
+# The generated rows use their own id ranges, checked to be free before the load. The ids of the generated users and
+# events are also recorded in generated_users and generated_events: --clean removes exactly those rows (and their
+# reservations, by cascade), never a real user whose Telegram id falls in the range. The sequences are left untouched.
+GENERATED_USER_BASE = 1_200_000_000
+GENERATED_EVENT_BASE = 100_000_000
+GENERATED_RESERVATION_BASE = 1_000_000_000
+CHUNK_ROWS = 100_000 # Rows of users/events per task
+RESERVATION_CHUNK_EVENTS = 2_000 # Events whose reservations are written by one task
+COPY_BUFFER = 1 << 16
+GENERATED_PASSWORD = "generated-password" # Password of all the generated users (one bcrypt hash)
+
+FIRST_NAMES = ("Giulia", "Marco", "Sofia", "Luca", "Alessia", "Matteo", "Chiara", "Andrea", "Sara", "Davide",
+               "Martina", "Francesco", "Elena", "Lorenzo", "Anna", "Simone", "Laura", "Federico", "Valentina", "Paolo")
+SURNAMES = ("Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci", "Marino", "Greco",
+            "Bruno", "Gallo", "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti")
+LOCATIONS = ("Sala Polivalente - Ravina", "FitUp - Trento", "Teatro Sociale - Trento", "Palazzo Roccabruna - Trento",
+             "Centro Giovani - Rovereto", "Circolo Arci - Pergine", "Auditorium - Riva del Garda", "Piazza Duomo - Trento")
+EVENT_TYPES = ("serata", "porta_party", "workshop")
+EVENT_TYPE_WEIGHTS = (60, 15, 25)
+CAPACITIES = (20, 30, 50, 80, 100, 150, 200, 300)
+CAPACITY_WEIGHTS = (10, 15, 25, 15, 15, 10, 7, 3)
+ADMIN_SHARE = 0.001
+LEADER_SHARE = 47 # % of the dancers
+
+# ---- DETERMINISTIC HELPERS ----
+MASK64 = (1 << 64) - 1
+
+def mix(value):
+    """splitmix64: a cheap, well distributed hash used for the per-user attributes needed by other tables."""
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+def admin_count(users):
+    return max(1, int(users * ADMIN_SHARE))
+
+def user_role(seed, index, users):
+    if index < admin_count(users):
+        return "admin"
+    return "leader" if mix(seed * 1_000_003 + index) % 100 < LEADER_SHARE else "follower"
+
+class Settings:
+    """Arguments shared by all the tasks (sent to the worker processes)."""
+
+    def __init__(self, seed, users, events, reservations, years, anchor, password_hash):
+        self.seed = seed
+        self.users = users
+        self.events = events
+        self.reservations = reservations
+        self.anchor = datetime.combine(anchor, dtime(), timezone.utc)
+        self.first_day = self.anchor - timedelta(days=365 * (years - 1)) # Events from years-1 years ago to one year ahead
+        self.span_days = 365 * years
+        self.password_hash = password_hash
+        self.scale = 1.0 # Reservations per unit of popularity: set by plan_reservations
+
+# ---- ROWS ----
+def event_attributes(settings, index):
+    rng = random.Random(f"{settings.seed}:event:{index}")
+    event_type = rng.choices(EVENT_TYPES, EVENT_TYPE_WEIGHTS)[0]
+    day = settings.first_day + timedelta(days=rng.randrange(settings.span_days))
+    if event_type == "workshop":
+        start = day + timedelta(hours=rng.choice((10, 14, 15, 16)))
+        end = start + timedelta(hours=rng.choice((2, 3)))
+    else:
+        start = day + timedelta(hours=rng.choice((19, 20, 21)), minutes=rng.choice((0, 30)))
+        end = start + timedelta(hours=rng.choice((3, 4, 5)))
+    capacity = rng.choices(CAPACITIES, CAPACITY_WEIGHTS)[0]
+    popularity = rng.betavariate(2, 2) # Share of the seats that would be booked
+    row = (
+        GENERATED_EVENT_BASE + index, event_type, f"{event_type.replace('_', ' ').title()} #{index}", start, end,
+        rng.choice(LOCATIONS), capacity, rng.choice((0, 10, 12, 15, 20, 25)), rng.random() < 0.95,
+        None if rng.random() < 0.7 else f"Generated {event_type} with {capacity} seats.",
+    )
+    return row, capacity, popularity
+
+def reservation_count(settings, capacity, popularity):
+    return min(capacity, settings.users - admin_count(settings.users), round(capacity * popularity * settings.scale))
+
+def user_rows(settings, first, last):
+    rng = random.Random(f"{settings.seed}:users:{first}")
+    for index in range(first, last):
+        created = settings.anchor - timedelta(seconds=rng.randrange(settings.span_days * 86400))
+        yield (
+            GENERATED_USER_BASE + index, rng.choice(FIRST_NAMES), rng.choice(SURNAMES),
+            date(rng.randint(1960, 2006), rng.randint(1, 12), rng.randint(1, 28)), f"gen_user_{index}",
+            settings.password_hash, user_role(settings.seed, index, settings.users),
+            created, created + timedelta(seconds=rng.randrange(max(1, int((settings.anchor - created).total_seconds())))),
+        )
+
+def event_rows(settings, first, last):
+    for index in range(first, last):
+        yield event_attributes(settings, index)[0]
+
+def reservation_rows(settings, first_event, last_event, first_reservation):
+    reservation_id = GENERATED_RESERVATION_BASE + first_reservation
+    admins = admin_count(settings.users)
+    for index in range(first_event, last_event):
+        event, capacity, popularity = event_attributes(settings, index)
+        event_id, start = event[0], event[3]
+        past = start < settings.anchor
+        rng = random.Random(f"{settings.seed}:reservations:{index}")
+        for user_index in rng.sample(range(admins, settings.users), reservation_count(settings, capacity, popularity)):
+            created = start - timedelta(seconds=rng.randrange(60 * 86400)) # Booked up to 60 days before
+            draw = rng.random()
+            if past:
+                status = "paid" if draw < 0.88 else "failed"
+            else:
+                status = "paid" if draw < 0.80 else ("pending" if draw < 0.92 else "failed")
+            paid_at = created + timedelta(seconds=rng.randint(30, 1800)) if status == "paid" else None
+            checked_in = past and status == "paid" and rng.random() < 0.85
+            yield (
+                reservation_id, GENERATED_USER_BASE + user_index, event_id, start, status, user_role(settings.seed, user_index, settings.users),
+                checked_in, start + timedelta(seconds=rng.randrange(5400)) if checked_in else None, paid_at, created,
+            )
+            reservation_id += 1
+
+# ---- COPY ----
+def copy_text(value):
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+COPY_FORMATS = {
+    str: copy_text, int: str, float: repr, bool: lambda value: "t" if value else "f",
+    datetime: datetime.isoformat, date: date.isoformat, type(None): lambda value: "\\N",
+}
+
+def copy_value(value):
+    """Text format of COPY: dispatched on the exact type, this runs once per column of millions of rows."""
+    return COPY_FORMATS[type(value)](value)
+
+class CopyStream(io.RawIOBase):
+    """File-like object read by COPY FROM STDIN, filled on demand from a generator of rows."""
+
+    def __init__(self, rows):
+        self.lines = ("\t".join(map(copy_value, row)).encode("utf-8") + b"\n" for row in rows)
+        self.buffer = b""
+        self.rows = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self.buffer) < len(target):
+            lines = list(islice(self.lines, 1000))
+            if not lines:
+                break
+            self.rows += len(lines)
+            self.buffer += b"".join(lines)
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+COPY_COLUMNS = {
+    "users": "users (user_id, name, surname, birthdate, username, password_hash, role, created_at, last_access)",
+    "events": "events (event_id, event_type, title, start_date_time, end_date_time, location, capacity, cost, is_active, description)",
+    "reservations": "reservations (reservation_id, user_id, event_id, event_start, payment_status, role, is_checked_in, check_in_time, paid_at, created_at)",
+}
+
+# Tables recording the ids of the generated rows, with the first id of the range of each table
+GENERATED_TABLES = {
+    "users": ("generated_users", "user_id", GENERATED_USER_BASE),
+    "events": ("generated_events", "event_id", GENERATED_EVENT_BASE),
+}
+
+def copy_task(task):
+    """Runs in a worker process: streams one chunk of a table with COPY, records its ids and commits it."""
+    table, settings, args = task
+    rows = {"users": user_rows, "events": event_rows, "reservations": reservation_rows}[table](settings, *args)
+    start = time.perf_counter()
+    conn = connect_db()
+    try:
+        cur = conn.cursor()
+        stream = CopyStream(rows)
+        cur.copy_expert(f"COPY {COPY_COLUMNS[table]} FROM STDIN", stream, size=COPY_BUFFER)
+        if table in GENERATED_TABLES:
+            tracking, column, base = GENERATED_TABLES[table]
+            cur.execute(f"INSERT INTO {tracking} ({column}) SELECT generate_series(%s, %s);", (base + args[0], base + args[1] - 1))
+        conn.commit()
+        return table, stream.rows, time.perf_counter() - start
+    finally:
+        conn.close()
+
+# ---- PLANNING ----
+def plan_reservations(settings):
+    """
+    Computes the reservations of every event (popularity x capacity, scaled to reach the requested total)
+    and splits the events in chunks with the first reservation id of each: one pass over the events,
+    only the chunk boundaries are kept in memory.
+    """
+    total_popularity = sum(capacity * popularity for _, capacity, popularity in
+                           (event_attributes(settings, index) for index in range(settings.events)))
+    settings.scale = settings.reservations / total_popularity if total_popularity else 0.0
+
+    chunks, first_reservation = [], 0
+    for first in range(0, settings.events, RESERVATION_CHUNK_EVENTS):
+        last = min(first + RESERVATION_CHUNK_EVENTS, settings.events)
+        chunks.append((first, last, first_reservation))
+        first_reservation += sum(reservation_count(settings, capacity, popularity) for _, capacity, popularity in
+                                 (event_attributes(settings, index) for index in range(first, last)))
+    return chunks, first_reservation
+
+def run_tasks(pool, tasks):
+    totals = {}
+    for table, rows, seconds in pool.map(copy_task, tasks):
+        count, elapsed = totals.get(table, (0, 0.0))
+        totals[table] = (count + rows, elapsed + seconds)
+    return totals
+
+# ---- DATABASE ----
+def create_tracking_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS generated_users (user_id INTEGER PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE);
+        CREATE TABLE IF NOT EXISTS generated_events (event_id INTEGER PRIMARY KEY REFERENCES events (event_id) ON DELETE CASCADE);
+    """)
+    conn.commit()
+
+def generated_rows_exist(cur):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM generated_users) OR EXISTS (SELECT 1 FROM generated_events);")
+    return cur.fetchone()[0]
+
+def id_range_conflicts(cur, settings, reservations):
+    """Returns the tables that already have rows in the id range of the rows to generate."""
+    ranges = (("users", "user_id", GENERATED_USER_BASE, settings.users), ("events", "event_id", GENERATED_EVENT_BASE, settings.events),
+              ("reservations", "reservation_id", GENERATED_RESERVATION_BASE, reservations))
+    conflicts = []
+    for table, column, base, count in ranges:
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE {column} >= %s AND {column} < %s);", (base, base + count))
+        if cur.fetchone()[0]:
+            conflicts.append(table)
+    return conflicts
+
+def clean_generated(conn):
+    cur = conn.cursor()
+    # Cascades to their reservations and to the tracking rows
+    cur.execute("DELETE FROM events WHERE event_id IN (SELECT event_id FROM generated_events);")
+    cur.execute("DELETE FROM users WHERE user_id IN (SELECT user_id FROM generated_users);")
+    conn.commit()
+
+def finish(conn):
+    """Recomputes the seat and role counters of the generated events, analyzes."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE events SET
+            remaining_seats = GREATEST(events.capacity - COALESCE(r.seats, 0), 0),
+            leaders_count = COALESCE(r.leaders, 0),
+            followers_count = COALESCE(r.followers, 0)
+        FROM events e LEFT JOIN (
+            SELECT event_id, COUNT(*) AS seats,
+                   COUNT(*) FILTER (WHERE role = 'leader') AS leaders,
+                   COUNT(*) FILTER (WHERE role = 'follower') AS followers
+            FROM reservations WHERE payment_status <> 'failed' AND event_id IN (SELECT event_id FROM generated_events) GROUP BY event_id
+        ) r ON r.event_id = e.event_id
+        WHERE events.event_id = e.event_id AND e.event_id IN (SELECT event_id FROM generated_events);
+    """)
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("ANALYZE users; ANALYZE events; ANALYZE reservations;")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates large synthetic data sets (users, events, reservations) with COPY.")
+    parser.add_argument("--users", type=int, default=100_000, help="Users to generate")
+    parser.add_argument("--events", type=int, default=10_000, help="Events to generate")
+    parser.add_argument("--reservations", type=int, default=1_000_000, help="Approximate number of reservations (limited by the seats)")
+    parser.add_argument("--years", type=int, default=5, help="Years covered by the events (the last one in the future)")
+    parser.add_argument("--anchor", type=date.fromisoformat, default=date.today(), help="Reference date YYYY-MM-DD (default: today)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the data set")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Parallel COPY processes")
+    parser.add_argument("--clean", action="store_true", help="Delete the previously generated rows first")
+    args = parser.parse_args()
+
+    conn = connect_db()
+    if conn is None:
+        sys.exit("Cannot connect to the database.")
+    create_tracking_tables(conn)
+    if args.clean:
+        print("Deleting the previously generated rows...")
+        clean_generated(conn)
+    elif generated_rows_exist(conn.cursor()):
+        conn.rollback()
+        sys.exit("Generated rows already present: use --clean to replace them.")
+    conn.rollback()
+
+    password_hash = bcrypt.hashpw(GENERATED_PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    settings = Settings(args.seed, args.users, args.events, args.reservations, args.years, args.anchor, password_hash)
+    started = time.perf_counter()
+    chunks, planned = plan_reservations(settings)
+    if planned < args.reservations * 0.95:
+        print(f"Note: only {planned} reservations fit in the seats of {args.events} events.")
+    conflicts = id_range_conflicts(conn.cursor(), settings, planned)
+    conn.rollback()
+    if conflicts:
+        sys.exit(f"Real rows in the id range of the generated {', '.join(conflicts)}: nothing generated.")
+    print(f"Generating {args.users} users, {args.events} events and {planned} reservations (seed {args.seed}, anchor {args.anchor}, {args.workers} workers)")
+
+    # Monthly partitions of the reservations over the whole period, so that COPY never fills the default partition
+    first_month = settings.first_day.date().replace(day=1)
+    ensure_partitions(conn, (args.years + 1) * 12, first_month)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # The reservations reference users and events: their chunks are written once both tables are committed
+        totals = run_tasks(pool, [("users", settings, (first, min(first + CHUNK_ROWS, args.users))) for first in range(0, args.users, CHUNK_ROWS)]
+                           + [("events", settings, (first, min(first + CHUNK_ROWS, args.events))) for first in range(0, args.events, CHUNK_ROWS)])
+        totals.update(run_tasks(pool, [("reservations", settings, chunk) for chunk in chunks]))
+
+    for table, (rows, seconds) in totals.items():
+        print(f"  {table:<13} {rows:>11,} rows  {rows / seconds if seconds else 0:>10,.0f} rows/s per worker")
+    print("Recomputing the seat counters and analyzing...")
+    finish(conn)
+    conn.close()
+    print(f"Done in {time.perf_counter() - started:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -97,19 +97,32 @@ def seed_database():
         event_id_test = cur.fetchone()[0]
         reservations_data = (
             1000000002,             
-            event_id_test,          
             'paid',                 
-            'E1_U2_TOKEN_ABC123'    
+            'E1_U2_TOKEN_ABC123',
+            event_id_test
         )
         
         insert_reservations_query = """
-            INSERT INTO reservations (user_id, event_id, payment_status, qr_code_value) 
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (user_id, event_id) DO NOTHING;
+            INSERT INTO reservations (user_id, event_id, event_start, payment_status, qr_code_value)
+            SELECT %s, event_id, start_date_time, %s, %s FROM events WHERE event_id = %s
+            ON CONFLICT (user_id, event_id, event_start) DO NOTHING;
         """
         cur.execute(insert_reservations_query, reservations_data)
         print(f"Inserted {cur.rowcount} new reservations.")
 
+        # 4. Initializing the seat and role counters of the new events
+        cur.execute("""
+            UPDATE reservations SET role = users.role FROM users
+            WHERE reservations.user_id = users.user_id AND reservations.role IS NULL;
+        """)
+        cur.execute("""
+            UPDATE events SET
+                remaining_seats = GREATEST(capacity - (SELECT COUNT(*) FROM reservations r WHERE r.event_id = events.event_id), 0),
+                leaders_count = (SELECT COUNT(*) FROM reservations r WHERE r.event_id = events.event_id AND r.role = 'leader'),
+                followers_count = (SELECT COUNT(*) FROM reservations r WHERE r.event_id = events.event_id AND r.role = 'follower')
+            WHERE remaining_seats IS NULL;
+        """)
+
         conn.commit() # Final commit for all inserts
         print("--- Seeding completed successfully. ---")
 
@@ -0,0 +1,225 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from PostgreSQL_DB.setup_tables import connect_db, setup_database
+
+# Versioned schema changes on top of the tables of setup_tables.py: the files migrations/NNNN_name.sql are applied
+# in order, once, and recorded in schema_migrations. A migration starting with the line "-- migrate: no-transaction"
+# is run statement by statement outside of a transaction: required by CREATE INDEX CONCURRENTLY, which builds the
+# index without blocking the writes (the bookings) on a live database. Its statements must therefore be idempotent
+# (IF NOT EXISTS), since a failure cannot be rolled back: the migration is simply run again.
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+MIGRATIONS_LOCK_ID = 720_401 # Advisory lock: two processes (e.g. two deploys) never migrate at the same time
+CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.I)
+
+class Migration:
+    def __init__(self, path):
+        match = MIGRATION_FILE.match(os.path.basename(path))
+        self.version, self.name = match.group(1), match.group(2)
+        with open(path, encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def statements(self):
+        """Statements of the file (one per ';' at the end of a line), without the comment lines."""
+        code = "\n".join(line for line in self.sql.splitlines() if not line.lstrip().startswith("--"))
+        return [statement.strip() for statement in re.split(r";\s*$", code, flags=re.M) if statement.strip()]
+
+def load_migrations():
+    migrations = [Migration(os.path.join(MIGRATIONS_DIR, name)) for name in sorted(os.listdir(MIGRATIONS_DIR)) if MIGRATION_FILE.match(name)]
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        sys.exit(f"Two migrations with the same version in {MIGRATIONS_DIR}")
+    return migrations
+
+def applied_migrations(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(4) PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            duration_ms INTEGER
+        );
+    """)
+    cur.execute("SELECT version, checksum FROM schema_migrations;")
+    return dict(cur.fetchall())
+
+def drop_invalid_indexes(cur, migration):
+    """A CREATE INDEX CONCURRENTLY that failed leaves an INVALID index, that IF NOT EXISTS would then skip: drop it first."""
+    for index in CONCURRENT_INDEX.findall(migration.sql):
+        cur.execute("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace AND NOT i.indisvalid;
+        """, (index,))
+        if cur.fetchone():
+            print(f"  dropping the invalid index {index} left by a failed build")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index};")
+
+def apply(conn, migration):
+    start = time.perf_counter()
+    cur = conn.cursor()
+    if migration.transactional:
+        conn.autocommit = False
+        cur.execute(migration.sql)
+    else:
+        conn.autocommit = True
+        drop_invalid_indexes(cur, migration)
+        for statement in migration.statements():
+            cur.execute(statement)
+        conn.autocommit = False
+    duration_ms = int((time.perf_counter() - start) * 1000)
+    cur.execute("INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s);",
+                (migration.version, migration.name, migration.checksum, duration_ms))
+    conn.commit()
+    return duration_ms
+
+def migrate(dry_run=False):
+    """Creates the tables if needed, then applies the pending migrations. Returns the versions applied."""
+    if not dry_run:
+        setup_database()
+    conn = connect_db()
+    if conn is None:
+        sys.exit("Cannot connect to the database.")
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATIONS_LOCK_ID,))
+    try:
+        applied = applied_migrations(cur)
+        done = []
+        for migration in load_migrations():
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    print(f"Warning: migration {migration.version}_{migration.name} was changed after being applied")
+                continue
+            if dry_run:
+                print(f"Pending: {migration.version}_{migration.name}")
+                continue
+            print(f"Applying {migration.version}_{migration.name}...")
+            print(f"  done in {apply(conn, migration)} ms")
+            done.append(migration.version)
+        if not dry_run:
+            print(f"Schema up to date ({len(done)} migrations applied).")
+        return done
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+        cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATIONS_LOCK_ID,))
+        conn.close()
+
+# ---- PLAN CHECKS ----
+# The hot queries of the listing, reservation and check-in paths, with the index each one must be able to use.
+# Sequential scans are disabled while planning: on a small database the planner rightly prefers them, while here
+# the question is whether an index serving the query exists (if not, the plan is a sequential scan anyway). The tables
+# need some rows and statistics: on an almost empty table the planner picks any of the indexes with the same cost.
+# The ids are those of an existing reservation: for ids absent from the statistics the estimates are meaningless.
+# A check may accept several indexes: a check-in is one index lookup by its key or by its event, the planner
+# picks either one depending on the size of the partitions.
+PLAN_CHECKS = (
+    ("upcoming active events (bot listing)", "idx_events_active_start",
+     "SELECT * FROM events WHERE start_date_time > NOW() AND is_active = TRUE ORDER BY start_date_time ASC LIMIT 3 OFFSET 30"),
+    ("upcoming events (all)", "idx_events_start",
+     "SELECT * FROM events WHERE start_date_time > NOW() ORDER BY start_date_time ASC LIMIT 3 OFFSET 30"),
+    ("reservation of a user for an event", "idx_unique_reservation",
+     "SELECT reservation_id, payment_status FROM reservations WHERE user_id = %(user_id)s AND event_id = %(event_id)s "
+     "AND event_start = (SELECT start_date_time FROM events WHERE event_id = %(event_id)s)"),
+    ("paid tickets of an event", "idx_reservations_event_status",
+     "SELECT reservation_id, user_id, qr_code_value FROM reservations WHERE event_id = %(event_id)s AND payment_status = 'paid' ORDER BY reservation_id"),
+    ("seat recount of an event", "idx_reservations_event_status",
+     "SELECT COUNT(*) FILTER (WHERE role = 'leader'), COUNT(*) FILTER (WHERE role = 'follower') FROM reservations WHERE event_id = %(event_id)s"),
+    ("check-in of a ticket", ("reservations_pkey", "idx_reservations_event_status"),
+     "UPDATE reservations SET is_checked_in = TRUE, check_in_time = NOW() WHERE reservation_id = %(reservation_id)s AND event_id = %(event_id)s "
+     "AND payment_status = 'paid' AND is_checked_in IS NOT TRUE AND event_start = (SELECT start_date_time FROM events WHERE event_id = %(event_id)s)"),
+    ("expired holds", "idx_pending_reservations",
+     "SELECT reservation_id FROM reservations WHERE payment_status = 'pending' AND created_at < NOW() - INTERVAL '15 minutes' ORDER BY created_at LIMIT 500"),
+)
+
+# Queries on the upcoming events, that must not scan the partitions of the reservations of the past months
+PRUNING_CHECKS = (
+    ("upcoming reminders", "SELECT reservation_id FROM reservations WHERE payment_status = 'paid' "
+     "AND event_start > NOW() AND event_start <= NOW() + INTERVAL '30 days'"),
+)
+PARTITION_NAME = re.compile(r"^reservations_(\d{4})_(\d{2})$")
+
+def plan_nodes(plan, key):
+    """Values of `key` (e.g. "Index Name", "Relation Name") in all the nodes of the plan."""
+    values = {plan[key]} if key in plan else set()
+    for child in plan.get("Plans", ()):
+        values |= plan_nodes(child, key)
+    return values
+
+def explain(cur, query, params=None):
+    cur.execute("SET LOCAL enable_seqscan = off;")
+    cur.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+    plan = cur.fetchone()[0]
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+def check_plans():
+    """EXPLAINs the hot queries and checks that each one uses its index. Returns the number of failures."""
+    conn = connect_db()
+    if conn is None:
+        sys.exit("Cannot connect to the database.")
+    cur = conn.cursor()
+    failures = 0
+    try:
+        # On a partitioned table the plan names the index of every partition: each one is mapped to its parent index
+        cur.execute("""
+            SELECT c.relname, p.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent
+            WHERE c.relkind = 'i';
+        """)
+        parent_index = dict(cur.fetchall())
+        cur.execute("SELECT to_char(NOW() AT TIME ZONE 'UTC', 'YYYY_MM');")
+        current_month = cur.fetchone()[0]
+        cur.execute("SELECT reservation_id, user_id, event_id FROM reservations ORDER BY created_at DESC LIMIT 1;")
+        sample = dict(zip(("reservation_id", "user_id", "event_id"), cur.fetchone() or (1, 1, 1)))
+        conn.rollback()
+
+        for description, indexes, query in PLAN_CHECKS:
+            indexes = (indexes,) if isinstance(indexes, str) else indexes
+            used = {parent_index.get(name, name) for name in plan_nodes(explain(cur, query, sample), "Index Name")}
+            ok = bool(used.intersection(indexes))
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {description}: {' or '.join(indexes)}" +
+                  ("" if ok else f" not used (plan uses {', '.join(sorted(used)) or 'no index'})"))
+            conn.rollback()
+
+        for description, query in PRUNING_CHECKS:
+            scanned = plan_nodes(explain(cur, query), "Relation Name")
+            past = sorted(name for name in scanned if PARTITION_NAME.match(name) and name[len("reservations_"):] < current_month)
+            failures += bool(past)
+            print(f"{'FAIL' if past else 'ok  '} {description}: " + (f"scans the past partitions {', '.join(past)}" if past else
+                  f"{len(scanned)} partitions scanned, none of the past months"))
+            conn.rollback()
+    finally:
+        conn.close()
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Applies the pending schema migrations (tables of setup_tables.py first).")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the pending migrations")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="Check that the hot queries use their indexes and partitions (exit code 1 if not)")
+    args = parser.parse_args()
+
+    if args.check_plans:
+        failures = check_plans()
+        checks = len(PLAN_CHECKS) + len(PRUNING_CHECKS)
+        print(f"\n{checks - failures}/{checks} plans use their index and skip the past partitions.")
+        return 1 if failures else 0
+    migrate(args.dry_run)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
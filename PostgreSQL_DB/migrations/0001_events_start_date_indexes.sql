@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- Listing of the upcoming events (GET /events): range on start_date_time, ordered by it, paged with LIMIT/OFFSET.
+-- The bot lists the active events only: the partial index holds just those, already in the listing order.
+-- The reminder scheduler uses the same range on the upcoming events.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_start ON events (start_date_time);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_active_start ON events (start_date_time) WHERE is_active;
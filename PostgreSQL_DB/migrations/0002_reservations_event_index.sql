@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- Reservations of an event: tickets of the event and door bundles (event + 'paid'), seat and role recounts,
+-- and the ON DELETE CASCADE from events. The unique (user_id, event_id) index cannot serve them (user_id first).
+-- The queries on payment_status alone are served by the partial indexes of the pending and paid reservations.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservations_event_status ON reservations (event_id, payment_status);
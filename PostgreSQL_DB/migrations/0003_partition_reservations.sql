@@ -0,0 +1,93 @@
+-- Reservations partitioned by the start month of their event: the reservations of the past events end up in
+-- partitions that the queries on the upcoming events never touch (partition pruning on event_start), and that
+-- PostgreSQL_DB/partition_maintenance.py detaches and archives once they are old enough, instead of DELETEs.
+-- event_start is a copy of events.start_date_time: the foreign key (event_id, event_start) keeps it in sync
+-- (ON UPDATE CASCADE moves the reservations to the right partition if an event is rescheduled).
+-- This migration rewrites the table in one transaction: the bookings wait for it, run it in a quiet moment.
+
+-- The key of the partitioned table and its unique indexes must contain event_start: (reservation_id, event_start),
+-- (user_id, event_id, event_start). Since event_start depends on event_id, the second one still forbids double
+-- bookings. qr_code_value is no longer unique at database level: the tickets are signed and contain the reservation id.
+ALTER TABLE events ADD CONSTRAINT events_event_id_start_key UNIQUE (event_id, start_date_time);
+
+CREATE TABLE reservations_partitioned (
+    reservation_id INTEGER NOT NULL DEFAULT nextval('reservations_reservation_id_seq'),
+    user_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    event_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    payment_status VARCHAR(50) NOT NULL,
+    role VARCHAR(50),
+    qr_code_value VARCHAR(255),
+    paypal_order_id VARCHAR(64),
+    is_checked_in BOOLEAN DEFAULT FALSE,
+    check_in_time TIMESTAMP WITH TIME ZONE,
+    paid_at TIMESTAMP WITH TIME ZONE,
+    ticket_file_id VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT reservations_payment_status_check CHECK (payment_status IN ('pending', 'paid', 'failed'))
+) PARTITION BY RANGE (event_start);
+
+-- Catches the reservations of events beyond the last monthly partition, until the maintenance creates their month
+CREATE TABLE reservations_default PARTITION OF reservations_partitioned DEFAULT;
+
+-- Monthly partitions (UTC months) for the existing reservations and the next 12 months (PARTITION_MONTHS_AHEAD
+-- of partition_maintenance.py), created before the copy
+DO $$
+DECLARE
+    month TIMESTAMP;
+BEGIN
+    FOR month IN SELECT generate_series(
+        date_trunc('month', LEAST(NOW(), (SELECT MIN(e.start_date_time) FROM reservations r JOIN events e ON e.event_id = r.event_id)) AT TIME ZONE 'UTC'),
+        date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '12 months',
+        INTERVAL '1 month'
+    ) LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF reservations_partitioned FOR VALUES FROM (%L) TO (%L)',
+                       'reservations_' || to_char(month, 'YYYY_MM'), month AT TIME ZONE 'UTC', (month + INTERVAL '1 month') AT TIME ZONE 'UTC');
+    END LOOP;
+END $$;
+
+INSERT INTO reservations_partitioned (reservation_id, user_id, event_id, event_start, payment_status, role, qr_code_value,
+    paypal_order_id, is_checked_in, check_in_time, paid_at, ticket_file_id, created_at)
+SELECT r.reservation_id, r.user_id, r.event_id, e.start_date_time, r.payment_status, r.role, r.qr_code_value,
+    r.paypal_order_id, r.is_checked_in, r.check_in_time, r.paid_at, r.ticket_file_id, r.created_at
+FROM reservations r JOIN events e ON e.event_id = r.event_id;
+
+-- reminders_sent cannot reference reservation_id alone any more: its rows are removed with the archived partitions
+ALTER TABLE reminders_sent DROP CONSTRAINT IF EXISTS reminders_sent_reservation_id_fkey;
+ALTER SEQUENCE reservations_reservation_id_seq OWNED BY NONE;
+DROP TABLE reservations;
+ALTER TABLE reservations_partitioned RENAME TO reservations;
+ALTER SEQUENCE reservations_reservation_id_seq OWNED BY reservations.reservation_id;
+
+-- The constraints and indexes are created on the parent, which creates them on every partition (present and future)
+ALTER TABLE reservations ADD CONSTRAINT reservations_pkey PRIMARY KEY (reservation_id, event_start);
+ALTER TABLE reservations ADD CONSTRAINT reservations_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE;
+ALTER TABLE reservations ADD CONSTRAINT reservations_event_fkey
+    FOREIGN KEY (event_id, event_start) REFERENCES events (event_id, start_date_time) ON DELETE CASCADE ON UPDATE CASCADE;
+CREATE UNIQUE INDEX idx_unique_reservation ON reservations (user_id, event_id, event_start);
+CREATE INDEX idx_reservations_event_status ON reservations (event_id, payment_status);
+CREATE INDEX idx_pending_reservations ON reservations (created_at) WHERE payment_status = 'pending';
+CREATE INDEX idx_paid_reservations ON reservations (paid_at) WHERE payment_status = 'paid';
+
+-- Creates the partition of a month (UTC) if it does not exist yet, moving into it the rows already in the default
+-- partition for that month. Returns the name of the partition created, NULL if it already existed.
+CREATE OR REPLACE FUNCTION create_reservations_partition(month DATE) RETURNS TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    first_day TIMESTAMP WITH TIME ZONE := date_trunc('month', month::timestamp) AT TIME ZONE 'UTC';
+    next_month TIMESTAMP WITH TIME ZONE := (date_trunc('month', month::timestamp) + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+    partition_name TEXT := 'reservations_' || to_char(date_trunc('month', month::timestamp), 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    IF EXISTS (SELECT 1 FROM reservations_default WHERE event_start >= first_day AND event_start < next_month) THEN
+        EXECUTE format('CREATE TABLE %I (LIKE reservations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM reservations_default WHERE event_start >= %L AND event_start < %L RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM moved', first_day, next_month, partition_name);
+        EXECUTE format('ALTER TABLE reservations ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', partition_name, first_day, next_month);
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF reservations FOR VALUES FROM (%L) TO (%L)', partition_name, first_day, next_month);
+    END IF;
+    RETURN partition_name;
+END $$;
@@ -0,0 +1,4 @@
+-- /success, the PayPal webhook and the hold sweeper find a reservation by its PayPal order. Only the holds being
+-- paid have one: a partial index. Not built CONCURRENTLY, which PostgreSQL does not support on a partitioned table:
+-- the index is created on every partition in one transaction, the bookings wait for it.
+CREATE INDEX IF NOT EXISTS idx_reservations_paypal_order ON reservations (paypal_order_id) WHERE paypal_order_id IS NOT NULL;
@@ -0,0 +1,6 @@
+-- The posters of the Calendar service store were saved with the host of the request that set them: keep only the
+-- path, which the bot prefixes with its CALENDAR_SERVICE_URL. The Telegram file_id stays valid (same source).
+UPDATE events SET
+    poster_image_url = regexp_replace(poster_image_url, '^https?://[^/]+/posters/', '/posters/'),
+    poster_file_source = regexp_replace(poster_file_source, '^https?://[^/]+/posters/', '/posters/')
+WHERE poster_image_url ~ '^https?://[^/]+/posters/[0-9a-f]{64}$';
@@ -0,0 +1,14 @@
+-- The two bots (telegram_bot.py and telegram_bot2.py) share the persistence tables: keyed by user_id only, their
+-- user_data overwrote each other, and a user_data.clear() in one bot deleted the row of the other one.
+-- Every row now belongs to a bot (the name given to PostgresPersistence), part of the primary key.
+-- The existing user_data cannot be told apart: it is kept by the main bot. The conversations are assigned by their name.
+ALTER TABLE bot_user_data ADD COLUMN bot VARCHAR(50) NOT NULL DEFAULT 'bot';
+ALTER TABLE bot_user_data ALTER COLUMN bot DROP DEFAULT;
+ALTER TABLE bot_user_data DROP CONSTRAINT bot_user_data_pkey;
+ALTER TABLE bot_user_data ADD PRIMARY KEY (bot, user_id);
+
+ALTER TABLE bot_conversations ADD COLUMN bot VARCHAR(50) NOT NULL DEFAULT 'bot';
+ALTER TABLE bot_conversations ALTER COLUMN bot DROP DEFAULT;
+UPDATE bot_conversations SET bot = 'auth_bot' WHERE name IN ('registration', 'login');
+ALTER TABLE bot_conversations DROP CONSTRAINT bot_conversations_pkey;
+ALTER TABLE bot_conversations ADD PRIMARY KEY (bot, name, key);
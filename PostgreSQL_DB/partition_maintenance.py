@@ -0,0 +1,159 @@
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime, timezone
+import psycopg2
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from PostgreSQL_DB.setup_tables import connect_db
+
+# Maintenance of the monthly partitions of reservations (see migrations/0003_partition_reservations.sql):
+# - the partitions of the next PARTITION_MONTHS_AHEAD months are created in advance, so that the bookings never
+#   land in the default partition (the Calendar service does it once a day). The rows already in the default
+#   partition are moved to their month by create_reservations_partition().
+# - the partitions of the events ended more than ARCHIVE_AFTER_MONTHS months ago are detached from reservations and
+#   moved to the ARCHIVE_SCHEMA schema (or dropped with --drop): a metadata change, instead of deleting millions of rows.
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", 12))
+ARCHIVE_AFTER_MONTHS = int(os.environ.get("ARCHIVE_AFTER_MONTHS", 12))
+ARCHIVE_SCHEMA = os.environ.get("ARCHIVE_SCHEMA", "archive")
+LOCK_TIMEOUT = "5s" # DDL on reservations waits for the bookings in progress: give up rather than queue them all behind it
+PARTITION_NAME = re.compile(r"^reservations_(\d{4})_(\d{2})$")
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def current_month():
+    today = datetime.now(timezone.utc).date()
+    return date(today.year, today.month, 1)
+
+def list_partitions(cur):
+    """Returns the monthly partitions attached to reservations as (month, name), oldest first."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'reservations'::regclass;
+    """)
+    partitions = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+def ensure_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD, first_month=None, dry_run=False):
+    """
+    Creates the missing partitions from `first_month` (default: the current month) to `months_ahead` months later,
+    and the ones of the months that have rows in the default partition. One transaction per partition.
+    Returns the names of the partitions created.
+    """
+    cur = conn.cursor()
+    first_month = first_month or current_month()
+    months = {add_months(first_month, i) for i in range(months_ahead + 1)}
+    cur.execute("SELECT DISTINCT date_trunc('month', event_start AT TIME ZONE 'UTC')::date FROM reservations_default;")
+    months.update(row[0] for row in cur.fetchall())
+    months.difference_update(month for month, _ in list_partitions(cur))
+    conn.rollback()
+
+    created = []
+    for month in sorted(months):
+        if dry_run:
+            created.append(f"reservations_{month:%Y_%m}")
+            continue
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';")
+            cur.execute("SELECT create_reservations_partition(%s);", (month,))
+            name = cur.fetchone()[0]
+            conn.commit()
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"Partition of {month:%Y-%m} not created: reservations busy, retried at the next run")
+            continue
+        if name:
+            created.append(name)
+    return created
+
+def archive_partitions(conn, archive_after_months=ARCHIVE_AFTER_MONTHS, drop=False, dry_run=False):
+    """
+    Detaches the partitions of the months ended more than `archive_after_months` months ago and moves them to the
+    archive schema (or drops them). The reminders already sent for their reservations are deleted too.
+    Returns the names of the partitions archived.
+    """
+    cur = conn.cursor()
+    limit = add_months(current_month(), -archive_after_months)
+    old = [name for month, name in list_partitions(cur) if add_months(month, 1) <= limit]
+    conn.rollback()
+    if dry_run:
+        return old
+
+    archived = []
+    for name in old:
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';")
+            cur.execute(f"DELETE FROM reminders_sent WHERE reservation_id IN (SELECT reservation_id FROM {name});")
+            cur.execute(f"ALTER TABLE reservations DETACH PARTITION {name};")
+            if drop:
+                cur.execute(f"DROP TABLE {name};")
+            else:
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};")
+                cur.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA};")
+            conn.commit()
+            archived.append(name)
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"{name} not archived: reservations busy, retried at the next run")
+    return archived
+
+def maintain_once(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Creates the partitions ahead (used by the Calendar service). Returns the names of the partitions created."""
+    conn = connect_db()
+    if conn is None:
+        return []
+    try:
+        return ensure_partitions(conn, months_ahead)
+    except psycopg2.Error as e:
+        print(f"Error while creating the reservation partitions: {e}")
+        return []
+    finally:
+        conn.close()
+
+def run_partition_maintenance(interval_seconds=86400, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Creates the partitions ahead every `interval_seconds` (never returns)."""
+    while True:
+        created = maintain_once(months_ahead)
+        if created:
+            print(f"Created the reservation partitions {', '.join(created)}.")
+        time.sleep(interval_seconds)
+
+def start_partition_thread(interval_seconds=86400, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Starts the creation of the partitions ahead in a background (daemon) thread of the current process."""
+    thread = threading.Thread(
+        target=run_partition_maintenance, args=(interval_seconds, months_ahead), name="partition-maintenance", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the future partitions of reservations and archive the old ones.")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD, help="Months of partitions created in advance")
+    parser.add_argument("--archive-after", type=int, default=ARCHIVE_AFTER_MONTHS, help="Months after which a partition is archived")
+    parser.add_argument("--drop", action="store_true", help="Drop the old partitions instead of moving them to the archive schema")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would be done")
+    args = parser.parse_args()
+
+    conn = connect_db()
+    if conn is None:
+        sys.exit("Cannot connect to the database.")
+    try:
+        created = ensure_partitions(conn, args.months_ahead, dry_run=args.dry_run)
+        archived = archive_partitions(conn, args.archive_after, args.drop, args.dry_run)
+    finally:
+        conn.close()
+    action = "dropped" if args.drop else f"archived to the {ARCHIVE_SCHEMA} schema"
+    prefix = "(dry run) " if args.dry_run else ""
+    print(f"{prefix}Partitions created: {', '.join(created) or 'none'}")
+    print(f"{prefix}Partitions {action}: {', '.join(archived) or 'none'}")
@@ -1,7 +1,11 @@
 import psycopg2 # PostgreSQL adapter for Python
 import os # For accessing environment variables
+import sys
 from dotenv import load_dotenv # To load environment variables from .env file
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+from Monitoring.db_metrics import InstrumentedCursor
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -13,7 +17,8 @@ def connect_db():
             port=os.getenv("DB_PORT"),
             database=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
+            password=os.getenv("DB_PASSWORD"),
+            cursor_factory=InstrumentedCursor, # Times every query (see Monitoring/db_metrics.py)
         )
         return conn
     except psycopg2.Error as e:
@@ -22,7 +27,10 @@ def connect_db():
         return None
 
 def setup_database():
-    """Executes the SQL script to create the tables."""
+    """
+    Executes the SQL script to create the base tables, on which the migrations of migrate.py are applied
+    (e.g. the partitioning of the reservations): alone it does not give the schema expected by the services.
+    """
     conn = connect_db()
     if conn is None:
         return
@@ -55,9 +63,15 @@ def setup_database():
                 end_date_time TIMESTAMP WITH TIME ZONE NOT NULL CHECK (end_date_time > start_date_time),
                 location VARCHAR(255),
                 capacity INTEGER NOT NULL CHECK (capacity >= 0),
+                remaining_seats INTEGER CHECK (remaining_seats >= 0),
+                leaders_count INTEGER NOT NULL DEFAULT 0,
+                followers_count INTEGER NOT NULL DEFAULT 0,
+                max_role_imbalance INTEGER CHECK (max_role_imbalance > 0),
                 cost DECIMAL(10,2) DEFAULT 0.00 CHECK (cost >= 0.00),
                 description TEXT,
                 poster_image_url TEXT,
+                poster_file_id VARCHAR(255),
+                poster_file_source TEXT,
                 is_active BOOLEAN DEFAULT TRUE,
                 created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
             );
@@ -69,13 +83,99 @@ def setup_database():
                 user_id INTEGER NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
                 event_id INTEGER NOT NULL REFERENCES events (event_id) ON DELETE CASCADE,
                 payment_status VARCHAR(50) NOT NULL CHECK (payment_status IN ('pending', 'paid', 'failed')),
+                role VARCHAR(50),
                 qr_code_value VARCHAR(255) UNIQUE,
+                paypal_order_id VARCHAR(64),
                 is_checked_in BOOLEAN DEFAULT FALSE,
                 check_in_time TIMESTAMP WITH TIME ZONE,
+                paid_at TIMESTAMP WITH TIME ZONE,
+                ticket_file_id VARCHAR(255),
                 created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
             );
             -- Unique index to prevent double bookings
             CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_reservation ON reservations (user_id, event_id);
+            """,
+            """
+            -- Creates the table of the tickets revoked after being paid, used by the door bundles (5)
+            CREATE TABLE IF NOT EXISTS ticket_revocations (
+                reservation_id INTEGER PRIMARY KEY,
+                event_id INTEGER NOT NULL REFERENCES events (event_id) ON DELETE CASCADE,
+                revoked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_ticket_revocations_event ON ticket_revocations (event_id, revoked_at);
+            """,
+            """
+            -- Creates the table of the announcements sent to all the users, with the progress of their delivery (6)
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                broadcast_id SERIAL PRIMARY KEY,
+                message TEXT NOT NULL,
+                created_by BIGINT,
+                status VARCHAR(50) NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'completed', 'cancelled')),
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent_count INTEGER NOT NULL DEFAULT 0,
+                failed_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP WITH TIME ZONE
+            );
+            """,
+            """
+            -- Creates the table of the event reminders already sent, one row per reservation and kind of reminder (7)
+            CREATE TABLE IF NOT EXISTS reminders_sent (
+                reservation_id INTEGER NOT NULL REFERENCES reservations (reservation_id) ON DELETE CASCADE,
+                kind VARCHAR(10) NOT NULL,
+                sent_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (reservation_id, kind)
+            );
+            """,
+            """
+            -- Creates the tables of the bot persistence: states of the conversations in progress and user_data (8)
+            CREATE TABLE IF NOT EXISTS bot_conversations (
+                name VARCHAR(100) NOT NULL,
+                key TEXT NOT NULL,
+                state BYTEA NOT NULL,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (name, key)
+            );
+            CREATE TABLE IF NOT EXISTS bot_user_data (
+                user_id BIGINT PRIMARY KEY,
+                data BYTEA NOT NULL,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            """
+            -- Adds the columns introduced after the first release to existing databases (4)
+            ALTER TABLE reservations ADD COLUMN IF NOT EXISTS paypal_order_id VARCHAR(64);
+            ALTER TABLE events ADD COLUMN IF NOT EXISTS remaining_seats INTEGER CHECK (remaining_seats >= 0);
+            -- Initializes the seat counter of the events that do not have one yet
+            UPDATE events SET remaining_seats = GREATEST(capacity - (
+                SELECT COUNT(*) FROM reservations r WHERE r.event_id = events.event_id
+            ), 0) WHERE remaining_seats IS NULL;
+            ALTER TABLE events ADD COLUMN IF NOT EXISTS leaders_count INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE events ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE events ADD COLUMN IF NOT EXISTS max_role_imbalance INTEGER CHECK (max_role_imbalance > 0);
+            ALTER TABLE reservations ADD COLUMN IF NOT EXISTS role VARCHAR(50);
+            -- Copies the role of the user into the reservations that do not have one yet and updates the per-event counters
+            WITH backfilled AS (
+                UPDATE reservations SET role = users.role FROM users
+                WHERE reservations.user_id = users.user_id AND reservations.role IS NULL
+                RETURNING reservations.event_id, reservations.role
+            ), counts AS (
+                SELECT event_id,
+                       COUNT(*) FILTER (WHERE role = 'leader') AS leaders,
+                       COUNT(*) FILTER (WHERE role = 'follower') AS followers
+                FROM backfilled GROUP BY event_id
+            )
+            UPDATE events SET leaders_count = leaders_count + counts.leaders, followers_count = followers_count + counts.followers
+            FROM counts WHERE events.event_id = counts.event_id;
+            ALTER TABLE reservations ADD COLUMN IF NOT EXISTS paid_at TIMESTAMP WITH TIME ZONE;
+            UPDATE reservations SET paid_at = created_at WHERE payment_status = 'paid' AND paid_at IS NULL;
+            ALTER TABLE reservations ADD COLUMN IF NOT EXISTS ticket_file_id VARCHAR(255);
+            ALTER TABLE events ADD COLUMN IF NOT EXISTS poster_file_id VARCHAR(255);
+            ALTER TABLE events ADD COLUMN IF NOT EXISTS poster_file_source TEXT;
+            -- Partial index used to find expired holds (pending reservations) without scanning paid ones
+            CREATE INDEX IF NOT EXISTS idx_pending_reservations ON reservations (created_at) WHERE payment_status = 'pending';
+            -- Partial index used by the reminder scheduler to find the reservations paid since its last refresh
+            CREATE INDEX IF NOT EXISTS idx_paid_reservations ON reservations (paid_at) WHERE payment_status = 'paid';
             """
         ]
         
@@ -98,6 +198,7 @@ def setup_database():
         if conn:
             conn.close() # Close connection
 
-# Execute the setup function
+# Creates the complete schema: the base tables, then the migrations
 if __name__ == "__main__":
-    setup_database()
\ No newline at end of file
+    from PostgreSQL_DB.migrate import migrate
+    migrate()
\ No newline at end of file
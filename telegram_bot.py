@@ -1,11 +1,22 @@
 from dotenv import load_dotenv
 from telegram.ext import Application, CommandHandler, CommandHandler, MessageHandler, ConversationHandler, filters,CallbackQueryHandler
+import argparse
 import logging
 import os
 import sys
 from Bot_utilities.bot_create_event import *
 from Bot_utilities.bot_view_events import *
 from Bot_utilities.bot_payment import *
+from Bot_utilities.bot_waiting_room import *
+from Bot_utilities.bot_tickets import *
+from Bot_utilities.bot_broadcast import *
+from Bot_utilities.bot_reminders import *
+from Bot_utilities.bot_webhook import run_webhook
+from Bot_utilities.bot_persistence import PostgresPersistence
+from Bot_utilities.bot_concurrency import *
+from Bot_utilities.bot_profiling import profile_command
+from Bot_utilities.bot_metrics import BOT_METRICS_PORT, InstrumentedHTTPXRequest, instrument_application
+from Monitoring.metrics import start_metrics_server
 from Bot_utilities.bot_google_authentication import *
 
 pending_states = {}   # state_token → tg_id
@@ -19,20 +30,57 @@ logging.basicConfig(
 
 # Read config from environment; fallback to existing token if not set
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org") # A local fake Bot API in the load tests
 
-def main() -> None:
-    app = Application.builder().token(BOT_TOKEN).build()
+# Executed once the bot is initialized, before it starts receiving updates
+async def post_init(app) -> None:
+    await warm_poster_cache(app)
+    await start_reminder_scheduler(app)
+
+# Builds the bot with all its handlers (in webhook mode, executed in every worker process)
+def build_application() -> Application:
+    # Conversations in progress and user_data are stored in the database: they survive restarts.
+    # Updates of different chats are handled concurrently, those of the same chat in order.
+    # The Bot API calls are timed (same connection pool size as the default request of the builder).
+    app = (
+        Application.builder().token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .request(InstrumentedHTTPXRequest(connection_pool_size=256))
+        .persistence(PostgresPersistence("bot"))
+        .concurrent_updates(PerChatUpdateProcessor())
+        .post_init(post_init)
+        .build()
+    )
 
     app.add_handler(CommandHandler("startGoogle", start_google))
 
     # Handler for payment services
     app.add_handler(CommandHandler("pay", pay_function))
-    app.add_handler(CallbackQueryHandler(pay_button_callback, pattern="^pay$"))
+    app.add_handler(CallbackQueryHandler(pay_button_callback, pattern=r"^pay:\d+$"))
+
+    # Handler for the tickets (QR codes) of the paid reservations
+    app.add_handler(CommandHandler("ticket", ticket_command))
+    app.add_handler(CommandHandler("closeSales", close_sales_command))
+
+    # Handler for the waiting rooms of high-demand events
+    app.add_handler(CommandHandler("openQueue", open_queue_command))
+    app.add_handler(CommandHandler("closeQueue", close_queue_command))
+
+    # Handler for the statistics of the update processing
+    app.add_handler(CommandHandler("botStats", bot_stats_command))
+
+    # Handler for the on-demand profile of the bot process
+    app.add_handler(CommandHandler("profile", profile_command))
+
+    # Handler for the announcements sent to all the users
+    app.add_handler(CommandHandler("broadcast", broadcast_command))
+    app.add_handler(CommandHandler("resumeBroadcast", resume_broadcast_command))
 
     # Handler for event creation
     conv_handler_event_creation = ConversationHandler(
         entry_points=[CommandHandler("createEvent", start_create_event)],
         states={
+            EVENT_TYPE: [CallbackQueryHandler(get_event_type)],
             TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_title)],
             START_DATE: [CallbackQueryHandler(start_date_handler)],
             START_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, start_time_handler)],
@@ -43,7 +91,9 @@ def main() -> None:
             COST: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_cost)],
             IS_ACTIVE: [CallbackQueryHandler(get_is_active)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="event_creation",
+        persistent=True,
     )
     app.add_handler(conv_handler_event_creation)
 
@@ -54,9 +104,31 @@ def main() -> None:
 
     app.add_handler(CallbackQueryHandler(see_more_callback, pattern="^see_more:"))
 
+    # Latency of every handler and conversation state, exposed on /metrics
+    instrument_application(app)
+    return app
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Telegram bot of the events.")
+    parser.add_argument("--webhook", action="store_true", help="Receive the updates through a webhook instead of polling")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEBHOOK_WORKERS", 0)) or None,
+                        help="Worker processes in webhook mode (default: number of CPU cores)")
+    args = parser.parse_args()
 
-    # Polling (Waiting for requests)
-    app.run_polling()
+    if args.webhook:
+        # Webhook (Telegram sends the updates to WEBHOOK_URL, handled by several processes)
+        run_webhook(
+            build_application,
+            workers=args.workers,
+            port=int(os.environ.get("WEBHOOK_PORT", 8080)),
+            webhook_url=os.environ.get("WEBHOOK_URL"),
+            secret=os.environ.get("WEBHOOK_SECRET"),
+            metrics_port=BOT_METRICS_PORT,
+        )
+    else:
+        # Polling (Waiting for requests)
+        start_metrics_server(BOT_METRICS_PORT)
+        build_application().run_polling()
 
 
 if __name__ == "__main__":
@@ -4,12 +4,18 @@ from telegram.ext import (
     Application, CommandHandler, ContextTypes, MessageHandler,
     ConversationHandler, filters, CallbackQueryHandler
 )
+import argparse
 import logging
 import os
 import sys
-import requests
+import httpx
 from datetime import date
 from telegram_bot_calendar import DetailedTelegramCalendar, LSTEP
+from Bot_utilities.bot_webhook import run_webhook
+from Bot_utilities.bot_persistence import PostgresPersistence
+from Bot_utilities.bot_concurrency import PerChatUpdateProcessor
+from Bot_utilities.bot_metrics import InstrumentedHTTPXRequest, instrument_application
+from Monitoring.metrics import start_metrics_server
 
 sys.dont_write_bytecode = True
 load_dotenv()
@@ -19,6 +25,7 @@ load_dotenv()
 # ------------------------------
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GESTIONE_UTENTI_URL = os.getenv("GESTIONE_UTENTI_URL")
+BOT2_METRICS_PORT = int(os.getenv("BOT2_METRICS_PORT", 9200)) # /metrics of this bot (the events bot uses 9100)
 
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
 
@@ -150,7 +157,8 @@ async def reg_password(update, context):
     }
 
     try:
-        resp = requests.post(f"{GESTIONE_UTENTI_URL}/register", json=payload)
+        async with httpx.AsyncClient() as client:
+            resp = await client.post(f"{GESTIONE_UTENTI_URL}/register", json=payload)
 
         if resp.status_code == 200:
             await update.effective_chat.send_message("Registration complete! Type /start.")
@@ -186,7 +194,8 @@ async def auth_attempt_login(update, context):
     }
 
     try:
-        resp = requests.post(f"{GESTIONE_UTENTI_URL}/login", json=payload)
+        async with httpx.AsyncClient() as client:
+            resp = await client.post(f"{GESTIONE_UTENTI_URL}/login", json=payload)
 
         if resp.status_code == 200:
             data = resp.json()
@@ -211,12 +220,14 @@ async def auth_attempt_login(update, context):
 # ------------------------------
 # MAIN
 # ------------------------------
-def main():
-    if not BOT_TOKEN:
-        print("BOT_TOKEN missing")
-        sys.exit(1)
-
-    app = Application.builder().token(BOT_TOKEN).build()
+def build_application():
+    app = (
+        Application.builder().token(BOT_TOKEN)
+        .request(InstrumentedHTTPXRequest(connection_pool_size=256))
+        .persistence(PostgresPersistence("auth_bot"))
+        .concurrent_updates(PerChatUpdateProcessor()) # A slow login (bcrypt) does not block the other users
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start_function))
     app.add_handler(CallbackQueryHandler(logout_callback, pattern="^logout$"))
@@ -231,7 +242,9 @@ def main():
             REG_USERNAME: [MessageHandler(filters.TEXT, reg_username)],
             REG_PASSWORD: [MessageHandler(filters.TEXT, reg_password)]
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="registration",
+        persistent=True
     )
 
     login_conv = ConversationHandler(
@@ -240,13 +253,39 @@ def main():
             AUTH_USERNAME: [MessageHandler(filters.TEXT, auth_username)],
             AUTH_PASSWORD: [MessageHandler(filters.TEXT, auth_attempt_login)]
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="login",
+        persistent=True
     )
 
     app.add_handler(registration)
     app.add_handler(login_conv)
+    instrument_application(app, "auth_bot")
+    return app
+
 
-    app.run_polling()
+def main():
+    if not BOT_TOKEN:
+        print("BOT_TOKEN missing")
+        sys.exit(1)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webhook", action="store_true", help="Receive the updates through a webhook instead of polling")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes in webhook mode (default: CPU cores)")
+    args = parser.parse_args()
+
+    if args.webhook:
+        run_webhook(
+            build_application,
+            workers=args.workers,
+            port=int(os.getenv("WEBHOOK_PORT", 8080)),
+            webhook_url=os.getenv("WEBHOOK_URL"),
+            secret=os.getenv("WEBHOOK_SECRET"),
+            metrics_port=BOT2_METRICS_PORT,
+        )
+    else:
+        start_metrics_server(BOT2_METRICS_PORT)
+        build_application().run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+import os
+import sys
+import psycopg2
+import pytest
+from dotenv import load_dotenv
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+
+# The database tests run on a throwaway database (MIGRATION_TEST_DB, on the server of the .env settings) created and
+# migrated once for the whole session. They are skipped when no database is configured (DB_NAME not set) or the
+# server cannot be reached.
+load_dotenv()  # Loads variables from .env into environment
+TEST_DB_NAME = os.environ.get("MIGRATION_TEST_DB", "sde_migration_test")
+
+def admin_connect():
+    conn = psycopg2.connect(host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"), database=os.getenv("BENCH_ADMIN_DB", "postgres"),
+                            user=os.getenv("DB_USER"), password=os.getenv("DB_PASSWORD"))
+    conn.autocommit = True
+    return conn
+
+@pytest.fixture(scope="session")
+def migrated_db():
+    """Yields the versions of all the migrations and the ones applied when the database was created."""
+    if not os.environ.get("DB_NAME"):
+        pytest.skip("No database configured (DB_NAME)")
+    try:
+        conn = admin_connect()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Database server not reachable: {e}")
+    cur = conn.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{TEST_DB_NAME}" WITH (FORCE);')
+    cur.execute(f'CREATE DATABASE "{TEST_DB_NAME}";')
+
+    previous_db = os.environ["DB_NAME"]
+    os.environ["DB_NAME"] = TEST_DB_NAME # Read by setup_tables.connect_db at every connection
+    try:
+        from PostgreSQL_DB.migrate import load_migrations, migrate
+        applied = migrate()
+        yield [migration.version for migration in load_migrations()], applied
+    finally:
+        os.environ["DB_NAME"] = previous_db
+        cur.execute(f'DROP DATABASE IF EXISTS "{TEST_DB_NAME}" WITH (FORCE);')
+        conn.close()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+
+# Applies the migrations to the throwaway database of the migrated_db fixture (see conftest.py), seeds it with the
+# benchmark data set and checks the plans of the hot queries with migrate.check_plans().
+
+def test_all_migrations_applied_once(migrated_db):
+    from PostgreSQL_DB.migrate import migrate
+    versions, applied = migrated_db
+    assert applied == versions
+    assert migrate() == [] # A second run has nothing to do
+
+def test_reservations_partitioned(migrated_db):
+    from PostgreSQL_DB.partition_maintenance import list_partitions
+    from PostgreSQL_DB.setup_tables import connect_db
+    conn = connect_db()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT relkind FROM pg_class WHERE relname = 'reservations';")
+        assert cur.fetchone()[0] == "p"
+        assert len(list_partitions(cur)) >= 13 # The current month and the 12 next ones
+    finally:
+        conn.close()
+
+def test_hot_queries_use_their_indexes(migrated_db):
+    from Benchmarks.service_benchmark import seed_database
+    from PostgreSQL_DB.migrate import check_plans
+    seed_database(events=1000, users=1000, reservations=5000, seed=42)
+    assert check_plans() == 0
@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.dont_write_bytecode = True  # Prevent .pyc files generation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Allows imports from the project root
+
+# Runs the concurrent booking stress test of Calendar/reservation_stress.py on the throwaway database of the
+# migrated_db fixture (see conftest.py): many bookers released at the same moment on a small event.
+
+def test_concurrent_bookings_never_oversell(migrated_db):
+    from Calendar.reservation_engine import BOOKED
+    from Calendar.reservation_stress import run_stress_test
+    results = run_stress_test(bookers=300, capacity=40, attempts=2, pool_size=20)
+    assert sum(results["outcomes"].values()) == 600 # Every attempt got an answer
+    assert results["outcomes"][BOOKED] == results["reservations"] == 40 # Full, not one seat more
+    assert results["reservations"] == results["distinct_users"]
+    assert results["reservations"] + results["remaining_seats"] == 40
+    assert results["consistent"]
+
+def test_concurrent_bookings_keep_the_role_balance(migrated_db):
+    from Calendar.reservation_engine import ROLE_IMBALANCE
+    from Calendar.reservation_stress import run_stress_test
+    results = run_stress_test(bookers=300, capacity=200, attempts=2, pool_size=20, max_role_imbalance=3)
+    assert abs(results["leaders"] - results["followers"]) <= 3
+    assert (results["leaders"], results["followers"]) == (results["leaders_count"], results["followers_count"])
+    assert results["outcomes"][ROLE_IMBALANCE] > 0 # Two followers out of three: the limit was reached
+    assert results["consistent"]